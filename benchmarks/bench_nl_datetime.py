@@ -0,0 +1,59 @@
+"""
+Micro-benchmark: time per parse of addCalendarEntry's event_from/event_to.
+
+Compares a cold parse (the grammar's caches cleared before every call) with
+a cached one for spoken and ISO 8601 expressions, through
+shared.nl_datetime.parse_event_times.
+
+Usage (from the repository root):
+    python benchmarks/bench_nl_datetime.py [--iterations N]
+"""
+import os
+import sys
+import argparse
+import timeit
+from datetime import datetime, timezone
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from shared import nl_datetime
+from shared.nl_datetime import parse_event_times
+
+NOW = datetime(2025, 3, 4, 14, 30, tzinfo=timezone.utc)
+TZ = 'America/New_York'
+
+EXPRESSIONS = {
+    'iso': ('2025-03-04T15:00:00Z', '2025-03-04T16:00:00Z', None),
+    'tomorrow 3pm': ('tomorrow at 3pm', None, None),
+    'next tuesday +45m': ('next tuesday at 3:30 pm', 'for 45 minutes', None),
+    'march 12 9-10am': ('march 12th at 9am', '10am', None),
+    'in 2 hours for 1h': ('in 2 hours for an hour', None, None),
+    'friday evening': ('friday evening', None, '90 minutes'),
+}
+
+def _clear_caches():
+    nl_datetime._plan.cache_clear()
+    nl_datetime._duration_seconds.cache_clear()
+
+def cold(event_from, event_to, duration):
+    _clear_caches()
+    return parse_event_times(event_from, event_to, duration, TZ, now=NOW)
+
+def cached(event_from, event_to, duration):
+    return parse_event_times(event_from, event_to, duration, TZ, now=NOW)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--iterations', type=int, default=20000)
+    options = parser.parse_args()
+
+    print(f"{'expression':<20}{'cold (us)':>12}{'cached (us)':>13}{'speedup':>10}")
+    for name, args in EXPRESSIONS.items():
+        cold_time = min(timeit.repeat(lambda: cold(*args), number=options.iterations, repeat=3))
+        cached_time = min(timeit.repeat(lambda: cached(*args), number=options.iterations, repeat=3))
+        cold_us = cold_time / options.iterations * 1e6
+        cached_us = cached_time / options.iterations * 1e6
+        print(f"{name:<20}{cold_us:>12.2f}{cached_us:>13.2f}{cold_us / cached_us:>9.2f}x")
+
+if __name__ == '__main__':
+    main()
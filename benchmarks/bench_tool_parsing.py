@@ -0,0 +1,77 @@
+"""
+Micro-benchmark: parse + validate time per VAPI tool request.
+
+Compares the original path (Flask's get_json, then ToolRequest(**data), then
+json.loads on string arguments) with shared.helpers.parse_tool_request +
+validate_arguments (model_validate_json on the raw bytes, orjson for the
+arguments, precompiled TypeAdapters for the argument schema).
+
+Usage (from the repository root):
+    python benchmarks/bench_tool_parsing.py [--iterations N]
+"""
+import os
+import sys
+import json
+import argparse
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from shared.schemas import ToolRequest
+from shared.helpers import parse_tool_request, validate_arguments
+
+def _payload(function_name, arguments, calls=1):
+    return json.dumps({
+        'message': {
+            'type': 'tool-calls',
+            'timestamp': 1730000000000,
+            'call': {'id': 'call-123', 'orgId': 'org-1', 'type': 'inboundPhoneCall'},
+            'toolCalls': [
+                {
+                    'id': f'call_{i}',
+                    'type': 'function',
+                    'function': {'name': function_name, 'arguments': json.dumps(arguments)},
+                }
+                for i in range(calls)
+            ],
+        }
+    }).encode('utf-8')
+
+PAYLOADS = {
+    'createTodo': _payload('createTodo', {'title': 'Buy groceries', 'description': 'Milk, eggs and bread'}),
+    'getTodos': _payload('getTodos', {'completed': 'false', 'limit': '20', 'fields': 'id,title'}),
+    'addCalendarEntry': _payload('addCalendarEntry', {
+        'title': 'Dentist', 'description': 'Checkup',
+        'event_from': '2025-03-04T15:00:00Z', 'event_to': '2025-03-04T16:00:00Z'}),
+    'createTodo x5': _payload('createTodo', {'title': 'Buy groceries'}, calls=5),
+}
+
+def old_path(raw):
+    data = json.loads(raw)
+    tool_req = ToolRequest(**data)
+    for tool_call in tool_req.message.toolCalls:
+        if isinstance(tool_call.function.arguments, str):
+            tool_call.function.arguments = json.loads(tool_call.function.arguments)
+    return tool_req
+
+def new_path(raw):
+    tool_req = parse_tool_request(raw)
+    for tool_call in tool_req.message.toolCalls:
+        validate_arguments(tool_call)
+    return tool_req
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--iterations', type=int, default=20000)
+    options = parser.parse_args()
+
+    print(f"{'payload':<18}{'old (us)':>12}{'new (us)':>12}{'speedup':>10}")
+    for name, raw in PAYLOADS.items():
+        old = min(timeit.repeat(lambda: old_path(raw), number=options.iterations, repeat=3))
+        new = min(timeit.repeat(lambda: new_path(raw), number=options.iterations, repeat=3))
+        old_us = old / options.iterations * 1e6
+        new_us = new / options.iterations * 1e6
+        print(f"{name:<18}{old_us:>12.2f}{new_us:>12.2f}{old_us / new_us:>9.2f}x")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,281 @@
+"""
+Load test for the vapi_todo blueprint against a fake Google Calendar.
+
+Mounts vapi_flask_bp on a throwaway Flask app backed by SQLite (default) or
+any SQLAlchemy URL, swaps the Calendar service for an in-process
+FakeCalendarService with injected latency and errors, and replays realistic
+VAPI tool-call payloads for every tool endpoint at a fixed concurrency over
+real HTTP. Reports p50/p95/p99 latency and throughput per endpoint and can
+save them as JSON and compare against a previous run.
+
+The blueprint imports `db` from the host application's `extensions` module,
+so run this from the host app root or pass --app-root:
+
+    python benchmarks/bench_vapi_todo.py --app-root ../portfolio \\
+        --requests 500 --concurrency 16 --calendar-latency-ms 150 \\
+        --output bench.json --compare bench-main.json
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import itertools
+import subprocess
+import tempfile
+import threading
+import uuid
+import http.client
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, time as clock, timedelta
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# name -> (path, VAPI function name, argument factory taking a sequence number)
+# Calendar entries are booked from next Monday on: starts in the past are refused.
+_TODAY = datetime.utcnow().date()
+WEEK_START = datetime.combine(_TODAY + timedelta(days=7 - _TODAY.weekday()), clock())
+
+ENDPOINTS = {
+    'create_todo': ('/vapi_project/create_todo', 'createTodo',
+                    lambda n: {'title': f'Buy groceries #{n}', 'description': 'Milk, eggs and bread'}),
+    'get_todos': ('/vapi_project/get_todos', 'getTodos', lambda n: {'completed': False, 'limit': 20}),
+    'complete_todo': ('/vapi_project/complete_todo', 'completeTodo', None),
+    'delete_todo': ('/vapi_project/delete_todo', 'deleteTodo', None),
+    'add_reminder': ('/vapi_project/add_reminder', 'addReminder',
+                     lambda n: {'reminder_text': f'Call the dentist #{n}', 'importance': 'high'}),
+    'get_reminders': ('/vapi_project/get_reminders', 'getReminders', lambda n: {'importance': 'high'}),
+    'delete_reminder': ('/vapi_project/delete_reminder', 'deleteReminder', None),
+    'add_calendar_entry': ('/vapi_project/add_calendar_entry', 'addCalendarEntry', lambda n: {
+        'title': f'Team sync #{n}', 'description': 'Weekly',
+        'event_from': (WEEK_START + timedelta(hours=9 + n)).isoformat() + 'Z',
+        'event_to': (WEEK_START + timedelta(hours=10 + n)).isoformat() + 'Z'}),
+    'get_calendar_entries': ('/vapi_project/get_calendar_entries', 'getCalendarEntries',
+                             lambda n: {'from': WEEK_START.isoformat() + 'Z',
+                                        'to': (WEEK_START + timedelta(days=7)).isoformat() + 'Z'}),
+    'delete_calendar_entry': ('/vapi_project/delete_calendar_entry', 'deleteCalendarEntry', None),
+    'create_todos': ('/vapi_project/create_todos', 'createTodos',
+                     lambda n: {'todos': [{'title': f'Dictated item {n}.{i}'} for i in range(10)]}),
+}
+
+# Endpoints that consume one seeded row per request, and the create endpoint that seeds them.
+CONSUMERS = {
+    'complete_todo': 'create_todo',
+    'delete_todo': 'create_todo',
+    'delete_reminder': 'add_reminder',
+    'delete_calendar_entry': 'add_calendar_entry',
+}
+
+def vapi_payload(function_name, arguments, sequence):
+    """
+    A tool-calls message shaped like the ones VAPI sends. Every tool call
+    gets a fresh toolCallId, as VAPI does; reused ones would be answered
+    from the idempotency store (idempotency.py) instead of running.
+    """
+    return json.dumps({
+        'message': {
+            'type': 'tool-calls',
+            'timestamp': int(time.time() * 1000),
+            'call': {'id': f'bench-call-{sequence % 50}', 'orgId': 'bench', 'type': 'webCall'},
+            'toolCalls': [{
+                'id': f'call_{uuid.uuid4().hex}',
+                'type': 'function',
+                'function': {'name': function_name, 'arguments': json.dumps(arguments)},
+            }],
+        }
+    }).encode('utf-8')
+
+def percentile(sorted_values, fraction):
+    """Nearest-rank percentile of an already sorted list."""
+    if not sorted_values:
+        return None
+    index = min(len(sorted_values) - 1, max(0, int(round(fraction * len(sorted_values) + 0.5)) - 1))
+    return sorted_values[index]
+
+def build_app(database_url, sync_workers):
+    os.environ['VAPI_CALENDAR_SYNC_WORKERS'] = str(sync_workers)
+    from flask import Flask
+    from extensions import db
+    from vapi_todo import vapi_flask_bp
+
+    app = Flask('vapi_todo_bench')
+    app.config['SQLALCHEMY_DATABASE_URI'] = database_url
+    db.init_app(app)
+    app.register_blueprint(vapi_flask_bp)
+    with app.app_context():
+        db.drop_all()
+        db.create_all()
+    return app
+
+def serve(app):
+    from werkzeug.serving import make_server, WSGIRequestHandler
+
+    class KeepAliveHandler(WSGIRequestHandler):
+        protocol_version = 'HTTP/1.1'
+
+        def log_request(self, *args, **kwargs):
+            pass
+
+    server = make_server('127.0.0.1', 0, app, threaded=True, request_handler=KeepAliveHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+class Client(threading.local):
+    """One keep-alive connection per load-generator thread."""
+
+    def __init__(self, port):
+        self.port = port
+        self.connection = None
+
+    def post(self, path, body):
+        for attempt in range(2):
+            if self.connection is None:
+                self.connection = http.client.HTTPConnection('127.0.0.1', self.port, timeout=30)
+            try:
+                self.connection.request('POST', path, body, {'Content-Type': 'application/json'})
+                response = self.connection.getresponse()
+                response.read()
+                return response.status
+            except (http.client.HTTPException, ConnectionError):
+                self.connection.close()
+                self.connection = None
+                if attempt:
+                    raise
+
+def run_endpoint(client, name, requests, concurrency, id_pool):
+    path, function_name, make_args = ENDPOINTS[name]
+    counter = itertools.count(1)
+
+    def one(_):
+        sequence = next(counter)
+        arguments = {'id': next(id_pool)} if make_args is None else make_args(sequence)
+        body = vapi_payload(function_name, arguments, sequence)
+        started = time.perf_counter()
+        status = client.post(path, body)
+        return time.perf_counter() - started, status
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        samples = list(pool.map(one, range(requests)))
+    elapsed = time.perf_counter() - started
+
+    latencies = sorted(latency * 1000 for latency, _ in samples)
+    errors = sum(1 for _, status in samples if not 200 <= status < 300)
+    return {
+        'requests': requests,
+        'errors': errors,
+        'p50_ms': round(percentile(latencies, 0.50), 3),
+        'p95_ms': round(percentile(latencies, 0.95), 3),
+        'p99_ms': round(percentile(latencies, 0.99), 3),
+        'mean_ms': round(sum(latencies) / len(latencies), 3),
+        'throughput_rps': round(requests / elapsed, 1),
+    }
+
+def git_commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], cwd=REPO_ROOT,
+                                       stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def compare(results, baseline_path, threshold):
+    """Print per-endpoint deltas against a saved run; returns the regressed endpoints."""
+    with open(baseline_path) as f:
+        baseline = json.load(f)
+    print(f"\nCompared with {baseline_path} (commit {baseline['meta'].get('commit')}):")
+    print(f"{'endpoint':<24}{'p50':>10}{'p99':>10}{'rps':>10}")
+    regressions = []
+    for name, current in results['endpoints'].items():
+        previous = baseline['endpoints'].get(name)
+        if not previous:
+            continue
+        deltas = {key: (current[key] - previous[key]) / previous[key] * 100 if previous[key] else 0.0
+                  for key in ('p50_ms', 'p99_ms', 'throughput_rps')}
+        print(f"{name:<24}{deltas['p50_ms']:>+9.1f}%{deltas['p99_ms']:>+9.1f}%{deltas['throughput_rps']:>+9.1f}%")
+        if deltas['p99_ms'] > threshold or deltas['throughput_rps'] < -threshold:
+            regressions.append(name)
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description='Load test the vapi_todo blueprint.')
+    parser.add_argument('--app-root', help='Directory containing the host app\'s extensions.py')
+    parser.add_argument('--database-url', help='SQLAlchemy URL (default: a temporary SQLite file)')
+    parser.add_argument('--requests', type=int, default=200, help='Requests per endpoint')
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--endpoints', default=','.join(ENDPOINTS), help='Comma-separated subset')
+    parser.add_argument('--calendar-latency-ms', type=float, default=100.0)
+    parser.add_argument('--calendar-jitter-ms', type=float, default=50.0)
+    parser.add_argument('--calendar-error-rate', type=float, default=0.0)
+    parser.add_argument('--sync-workers', type=int, default=2, help='Outbox worker threads (0 = none)')
+    parser.add_argument('--output', help='Write results as JSON to this file')
+    parser.add_argument('--compare', help='Baseline JSON from a previous run')
+    parser.add_argument('--regression-threshold', type=float, default=10.0,
+                        help='Percent p99/throughput change counted as a regression')
+    options = parser.parse_args()
+
+    sys.path.insert(0, REPO_ROOT)
+    if options.app_root:
+        sys.path.insert(0, os.path.abspath(options.app_root))
+
+    from shared.fake_calendar import FakeCalendarService
+    from shared.google_calendar import set_calendar_service
+    fake = FakeCalendarService(
+        latency=options.calendar_latency_ms / 1000,
+        jitter=options.calendar_jitter_ms / 1000,
+        error_rate=options.calendar_error_rate,
+    )
+    set_calendar_service(fake)
+
+    database_url = options.database_url or f"sqlite:///{tempfile.mkdtemp()}/vapi_bench.db"
+    app = build_app(database_url, options.sync_workers)
+    server = serve(app)
+    client = Client(server.server_port)
+
+    selected = [name.strip() for name in options.endpoints.split(',') if name.strip()]
+    # Consumers need rows to work on: before timing anything, seed one row per
+    # request through the matching create endpoint. The tables start empty, so
+    # the seeded IDs are consecutive.
+    id_pools = {}
+    seeded = {}
+    for name in selected:
+        if name in CONSUMERS:
+            source = CONSUMERS[name]
+            start = seeded.get(source, 0) + 1
+            run_endpoint(client, source, options.requests, options.concurrency, iter(()))
+            seeded[source] = start + options.requests - 1
+            id_pools[name] = iter(range(start, start + options.requests))
+
+    results = {
+        'meta': {
+            'commit': git_commit(),
+            'timestamp': datetime.utcnow().isoformat() + 'Z',
+            'database': database_url.split('://')[0],
+            'requests': options.requests,
+            'concurrency': options.concurrency,
+            'calendar_latency_ms': options.calendar_latency_ms,
+            'calendar_error_rate': options.calendar_error_rate,
+        },
+        'endpoints': {},
+    }
+    print(f"{'endpoint':<24}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'rps':>10}{'errors':>8}")
+    for name in selected:
+        stats = run_endpoint(client, name, options.requests, options.concurrency,
+                             id_pools.get(name, iter(())))
+        results['endpoints'][name] = stats
+        print(f"{name:<24}{stats['p50_ms']:>10.2f}{stats['p95_ms']:>10.2f}{stats['p99_ms']:>10.2f}"
+              f"{stats['throughput_rps']:>10.1f}{stats['errors']:>8}")
+    results['meta']['fake_calendar_calls'] = fake.calls
+    server.shutdown()
+
+    if options.output:
+        with open(options.output, 'w') as f:
+            json.dump(results, f, indent=2)
+        print(f"\nResults written to {options.output}")
+    if options.compare:
+        regressions = compare(results, options.compare, options.regression_threshold)
+        if regressions:
+            print(f"Regressions: {', '.join(regressions)}")
+            sys.exit(1)
+
+if __name__ == '__main__':
+    main()
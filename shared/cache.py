@@ -0,0 +1,176 @@
+import os
+import json
+import time
+import asyncio
+import pickle
+import hashlib
+import threading
+from collections import OrderedDict
+from typing import Optional, Any, Awaitable, Callable, Dict
+
+class LRUCacheBackend:
+    """In-process LRU store with per-entry expiry. Only valid for a single process."""
+
+    # Calls never wait on I/O, so async callers may make them on the event loop.
+    blocking = False
+
+    def __init__(self, max_entries: int = 1024):
+        self.max_entries = max_entries
+        self._entries: 'OrderedDict[str, tuple]' = OrderedDict()
+        self._counters: Dict[str, int] = {}
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[Any]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            value, expires_at = entry
+            if expires_at <= time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key: str, value: Any, ttl: float):
+        with self._lock:
+            self._entries[key] = (value, time.monotonic() + ttl)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def get_counter(self, key: str) -> int:
+        # Counters live outside the LRU so a generation is never evicted
+        # while entries cached under it are still around.
+        with self._lock:
+            return self._counters.get(key, 0)
+
+    def incr(self, key: str) -> int:
+        with self._lock:
+            value = self._counters.get(key, 0) + 1
+            self._counters[key] = value
+            return value
+
+class RedisCacheBackend:
+    """Store backed by any redis-py compatible client; shared by all processes."""
+
+    # Every call is a network round trip: async callers run it in a thread.
+    blocking = True
+
+    def __init__(self, client):
+        self.client = client
+
+    def get(self, key: str) -> Optional[Any]:
+        data = self.client.get(key)
+        return pickle.loads(data) if data is not None else None
+
+    def set(self, key: str, value: Any, ttl: float):
+        self.client.set(key, pickle.dumps(value), px=max(1, int(ttl * 1000)))
+
+    def get_counter(self, key: str) -> int:
+        value = self.client.get(key)
+        return int(value) if value is not None else 0
+
+    def incr(self, key: str) -> int:
+        return int(self.client.incr(key))
+
+class VersionedReadCache:
+    """
+    Cache of serialized read results, invalidated by per-entity generations.
+
+    Every entry key embeds the generation of its entity type at the time the
+    read started. Writers call bump() after committing, which moves readers
+    to a fresh generation; entries of older generations are never looked up
+    again and simply age out through the LRU or the TTL. Because the
+    generation is read before the database is, a result computed from data
+    older than a committed write can only ever be stored under a superseded
+    generation.
+    """
+
+    def __init__(self, backend, namespace: str = 'vapi', ttl: float = 30.0):
+        self.backend = backend
+        self.namespace = namespace
+        self.ttl = ttl
+
+    def _generation_key(self, entity: str) -> str:
+        return f"{self.namespace}:gen:{entity}"
+
+    def generation(self, entity: str) -> int:
+        return self.backend.get_counter(self._generation_key(entity))
+
+    def bump(self, entity: str) -> int:
+        """Invalidate every cached read of an entity type. Call after commit."""
+        return self.backend.incr(self._generation_key(entity))
+
+    async def bump_async(self, entity: str) -> int:
+        """bump() for the ASGI service, off the event loop when the backend blocks."""
+        return await self._off_loop(self.bump, entity)
+
+    def get_or_load(self, entity: str, params: Dict[str, Any], loader: Callable[[], Any],
+                    ttl: Optional[float] = None) -> Any:
+        """
+        Return the cached result for (entity, params), loading it on a miss.
+
+        Args:
+            entity: Entity type whose writes invalidate this result
+            params: Everything the result depends on; must be JSON serializable
+            loader: Computes the result on a miss
+            ttl: Seconds to keep a loaded result (default: self.ttl, and never longer)
+        """
+        key = self._key(entity, params)
+        value = self.backend.get(key)
+        if value is None:
+            value = loader()
+            self.backend.set(key, value, min(self.ttl, ttl) if ttl is not None else self.ttl)
+        return value
+
+    async def get_or_load_async(self, entity: str, params: Dict[str, Any],
+                                loader: Callable[[], Awaitable[Any]]) -> Any:
+        """
+        get_or_load() for a coroutine loader (the ASGI service). Backend calls
+        of a blocking backend (Redis) run in a worker thread, so a cache round
+        trip does not stall the event loop.
+        """
+        key = await self._off_loop(self._key, entity, params)
+        value = await self._off_loop(self.backend.get, key)
+        if value is None:
+            value = await loader()
+            await self._off_loop(self.backend.set, key, value, self.ttl)
+        return value
+
+    async def _off_loop(self, function: Callable[..., Any], *args) -> Any:
+        if getattr(self.backend, 'blocking', True):
+            return await asyncio.to_thread(function, *args)
+        return function(*args)
+
+    def _key(self, entity: str, params: Dict[str, Any]) -> str:
+        # The generation is read here, before the loader reads the database.
+        generation = self.generation(entity)
+        digest = hashlib.sha1(json.dumps(params, sort_keys=True, default=str).encode('utf-8')).hexdigest()
+        return f"{self.namespace}:{entity}:{generation}:{digest}"
+
+# Global instance for easy access
+_read_cache = None
+_read_cache_lock = threading.Lock()
+
+def get_read_cache() -> VersionedReadCache:
+    """
+    Get or create the global read cache.
+
+    Uses Redis when VAPI_CACHE_URL is set (required when more than one process
+    serves writes), otherwise an in-process LRU of VAPI_CACHE_MAX_ENTRIES
+    entries. Entries expire after VAPI_CACHE_TTL seconds.
+    """
+    global _read_cache
+    if _read_cache is None:
+        with _read_cache_lock:
+            if _read_cache is None:
+                ttl = float(os.getenv('VAPI_CACHE_TTL', '30'))
+                url = os.getenv('VAPI_CACHE_URL')
+                if url:
+                    import redis
+                    backend = RedisCacheBackend(redis.Redis.from_url(url))
+                else:
+                    backend = LRUCacheBackend(int(os.getenv('VAPI_CACHE_MAX_ENTRIES', '1024')))
+                _read_cache = VersionedReadCache(backend, ttl=ttl)
+    return _read_cache
@@ -0,0 +1,405 @@
+"""
+Local fakes of the Google Calendar v3 events API, for development, tests and
+benchmarks.
+
+FakeCalendarServer speaks HTTP, so the real GoogleCalendarService (and
+googleapiclient underneath it) can be exercised against it.
+FakeCalendarService skips HTTP entirely: it is a drop-in replacement for
+GoogleCalendarService with configurable latency and error rate, installed
+with shared.google_calendar.set_calendar_service().
+
+Pointing the real service at the server:
+
+    server = FakeCalendarServer().start()
+    service = GoogleCalendarService(
+        credentials=AnonymousCredentials(),
+        api_endpoint=server.api_endpoint,
+    )
+
+The server implements events.insert/get/patch/update/delete/list and freebusy.query, including
+syncToken/nextSyncToken semantics, pagination and 410 Gone for expired sync
+tokens (see expire_sync_tokens), ETags with If-Match (412) and the
+privateExtendedProperty filter. The batch endpoint is not implemented.
+"""
+import json
+import random
+import re
+import threading
+import time
+import uuid
+from datetime import datetime, timedelta, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Optional, Dict, Any, List
+from urllib.parse import urlparse, parse_qs
+
+from .metrics import phase, CALENDAR_REQUEST_SECONDS, CALENDAR_ERRORS
+
+_EVENTS_PATH = re.compile(r'^/calendar/v3/calendars/(?P<calendar>[^/]+)/events(?:/(?P<event>[^/]+))?$')
+
+def _naive_utc(value: str) -> datetime:
+    parsed = datetime.fromisoformat(value.replace('Z', '+00:00'))
+    return parsed.astimezone(timezone.utc).replace(tzinfo=None) if parsed.tzinfo else parsed
+
+def _has_properties(event: Dict[str, Any], private_properties: Optional[Dict[str, str]]) -> bool:
+    if not private_properties:
+        return True
+    stored = (event.get('extendedProperties') or {}).get('private') or {}
+    return all(stored.get(key) == value for key, value in private_properties.items())
+
+class FakeCalendarStore:
+    """Thread-safe in-memory event store with a global change sequence."""
+
+    def __init__(self):
+        self.events: Dict[str, Dict[str, Any]] = {}
+        self.sequence = 0
+        self.token_epoch = 0
+        self.lock = threading.Lock()
+
+    def _touch(self, event: Dict[str, Any]):
+        self.sequence += 1
+        event['_sequence'] = self.sequence
+        event['updated'] = datetime.utcnow().isoformat() + 'Z'
+        event['etag'] = f'"{self.sequence}"'
+
+    @staticmethod
+    def public(event: Dict[str, Any]) -> Dict[str, Any]:
+        return {key: value for key, value in event.items() if not key.startswith('_')}
+
+    def insert(self, body: Dict[str, Any]) -> Dict[str, Any]:
+        with self.lock:
+            event = dict(body, id=body.get('id') or uuid.uuid4().hex, status='confirmed', kind='calendar#event')
+            self._touch(event)
+            self.events[event['id']] = event
+            return self.public(event)
+
+    def get(self, event_id: str) -> Optional[Dict[str, Any]]:
+        with self.lock:
+            event = self.events.get(event_id)
+            return self.public(event) if event and event['status'] != 'cancelled' else None
+
+    def modify(self, event_id: str, body: Dict[str, Any], replace: bool) -> Optional[Dict[str, Any]]:
+        with self.lock:
+            event = self.events.get(event_id)
+            if not event or event['status'] == 'cancelled':
+                return None
+            if replace:
+                event = {'id': event_id, 'status': 'confirmed', 'kind': 'calendar#event', **body}
+                self.events[event_id] = event
+            else:
+                existing = (event.get('extendedProperties') or {}).get('private') or {}
+                event.update(body)
+                if 'extendedProperties' in body:
+                    # Patches merge private properties like the real API does.
+                    event['extendedProperties'] = {
+                        'private': {**existing, **(body['extendedProperties'].get('private') or {})}}
+            self._touch(event)
+            return self.public(event)
+
+    def delete(self, event_id: str) -> bool:
+        with self.lock:
+            event = self.events.get(event_id)
+            if not event or event['status'] == 'cancelled':
+                return False
+            event['status'] = 'cancelled'
+            self._touch(event)
+            return True
+
+    def busy(self, time_min: datetime, time_max: datetime) -> List[Dict[str, str]]:
+        """Busy blocks of confirmed timed events overlapping [time_min, time_max), as in freebusy."""
+        blocks = []
+        with self.lock:
+            for event in self.events.values():
+                start = (event.get('start') or {}).get('dateTime')
+                end = (event.get('end') or {}).get('dateTime')
+                if event['status'] == 'cancelled' or not start or not end:
+                    continue
+                start, end = _naive_utc(start), _naive_utc(end)
+                if start < time_max and end > time_min:
+                    blocks.append({'start': start.isoformat() + 'Z', 'end': end.isoformat() + 'Z'})
+        return sorted(blocks, key=lambda block: block['start'])
+
+    def expire_sync_tokens(self):
+        """Invalidate every sync token handed out so far (clients get 410 Gone)."""
+        with self.lock:
+            self.token_epoch += 1
+
+    def list(self, sync_token: Optional[str], page_token: Optional[str],
+             max_results: int, show_deleted: bool, private_properties: Dict[str, str] = None):
+        """Returns (status, body)."""
+        with self.lock:
+            since = 0
+            if sync_token:
+                epoch, _, sequence = sync_token.partition(':')
+                if int(epoch) != self.token_epoch:
+                    return 410, {'error': {'code': 410, 'message': 'Sync token is no longer valid, a full sync is required.',
+                                           'errors': [{'reason': 'fullSyncRequired'}]}}
+                since = int(sequence)
+            # The listing is a snapshot up to the sequence seen on its first page.
+            offset, upto = (map(int, page_token.split(':')) if page_token else (0, self.sequence))
+            changed = sorted(
+                (event for event in self.events.values()
+                 if since < event['_sequence'] <= upto
+                 and (sync_token or show_deleted or event['status'] != 'cancelled')
+                 and _has_properties(event, private_properties)),
+                key=lambda event: event['_sequence'])
+            page = changed[offset:offset + max_results]
+            body = {'kind': 'calendar#events', 'items': [self.public(event) for event in page]}
+            if offset + max_results < len(changed):
+                body['nextPageToken'] = f'{offset + max_results}:{upto}'
+            else:
+                body['nextSyncToken'] = f'{self.token_epoch}:{upto}'
+            return 200, body
+
+class _Handler(BaseHTTPRequestHandler):
+    store: FakeCalendarStore = None
+
+    def log_message(self, format, *args):
+        pass
+
+    def _reply(self, status: int, body: Optional[Dict[str, Any]] = None):
+        data = json.dumps(body).encode('utf-8') if body is not None else b''
+        self.send_response(status)
+        if data:
+            self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _not_found(self):
+        self._reply(404, {'error': {'code': 404, 'message': 'Not Found'}})
+
+    def _body(self) -> Dict[str, Any]:
+        length = int(self.headers.get('Content-Length') or 0)
+        return json.loads(self.rfile.read(length) or b'{}')
+
+    def _route(self):
+        url = urlparse(self.path)
+        match = _EVENTS_PATH.match(url.path)
+        return match, parse_qs(url.query)
+
+    def do_GET(self):
+        match, query = self._route()
+        if not match:
+            return self._not_found()
+        if match.group('event'):
+            event = self.store.get(match.group('event'))
+            return self._reply(200, event) if event else self._not_found()
+        status, body = self.store.list(
+            query.get('syncToken', [None])[0],
+            query.get('pageToken', [None])[0],
+            int(query.get('maxResults', ['250'])[0]),
+            query.get('showDeleted', ['false'])[0] == 'true',
+            dict(item.partition('=')[::2] for item in query.get('privateExtendedProperty', [])))
+        self._reply(status, body)
+
+    def do_POST(self):
+        if urlparse(self.path).path == '/calendar/v3/freeBusy':
+            body = self._body()
+            blocks = self.store.busy(_naive_utc(body['timeMin']), _naive_utc(body['timeMax']))
+            calendars = {item['id']: {'busy': blocks} for item in body.get('items', [])}
+            return self._reply(200, {'kind': 'calendar#freeBusy', 'calendars': calendars})
+        match, _ = self._route()
+        if not match or match.group('event'):
+            return self._not_found()
+        self._reply(200, self.store.insert(self._body()))
+
+    def _modify(self, replace: bool):
+        match, _ = self._route()
+        if not match or not match.group('event'):
+            return self._not_found()
+        current = self.store.get(match.group('event'))
+        if_match = self.headers.get('If-Match')
+        if current and if_match and if_match != current['etag']:
+            return self._reply(412, {'error': {'code': 412, 'message': 'Precondition Failed',
+                                               'errors': [{'reason': 'conditionNotMet'}]}})
+        event = self.store.modify(match.group('event'), self._body(), replace)
+        return self._reply(200, event) if event else self._not_found()
+
+    def do_PATCH(self):
+        self._modify(replace=False)
+
+    def do_PUT(self):
+        self._modify(replace=True)
+
+    def do_DELETE(self):
+        match, _ = self._route()
+        if not match or not match.group('event'):
+            return self._not_found()
+        if self.store.delete(match.group('event')):
+            return self._reply(204)
+        self._reply(410, {'error': {'code': 410, 'message': 'Resource has been deleted'}})
+
+class FakeCalendarServer:
+    """Serves a FakeCalendarStore over HTTP on a background thread."""
+
+    def __init__(self, host: str = '127.0.0.1', port: int = 0, store: FakeCalendarStore = None):
+        self.store = store or FakeCalendarStore()
+        handler = type('FakeCalendarHandler', (_Handler,), {'store': self.store})
+        self.httpd = ThreadingHTTPServer((host, port), handler)
+        self._thread = None
+
+    @property
+    def api_endpoint(self) -> str:
+        host, port = self.httpd.server_address[:2]
+        return f'http://{host}:{port}/calendar/v3/'
+
+    def start(self) -> 'FakeCalendarServer':
+        self._thread = threading.Thread(target=self.httpd.serve_forever, name='fake-calendar', daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+class FakeCalendarService:
+    """
+    In-process stand-in for GoogleCalendarService.
+
+    Every call sleeps for `latency` seconds (plus up to `jitter`) and fails
+    with probability `error_rate`, the way the real service reports failures:
+    None/False from the single-event methods and ok=False per batch item.
+    A batch costs one latency, like one HTTP round trip.
+    """
+
+    def __init__(self, latency: float = 0.0, jitter: float = 0.0, error_rate: float = 0.0,
+                 store: FakeCalendarStore = None):
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.store = store or FakeCalendarStore()
+        self.calendar_id = 'primary'
+        self.calls = 0
+        self._calls_lock = threading.Lock()
+
+    def _round_trip(self, operation: str) -> bool:
+        """Simulate one HTTP round trip; returns False if it 'failed'."""
+        with self._calls_lock:
+            self.calls += 1
+        delay = self.latency + random.uniform(0, self.jitter)
+        if delay:
+            with phase('calendar'):
+                time.sleep(delay)
+        CALENDAR_REQUEST_SECONDS.observe(delay, operation=operation)
+        if random.random() < self.error_rate:
+            CALENDAR_ERRORS.inc(operation=operation)
+            return False
+        return True
+
+    @staticmethod
+    def _body(title=None, description=None, start_time=None, end_time=None,
+              timezone='UTC', properties=None, calendar_id=None, partial=False) -> Dict[str, Any]:
+        body = {}
+        if properties:
+            body['extendedProperties'] = {'private': dict(properties)}
+        if title or not partial:
+            body['summary'] = title
+        if description is not None or not partial:
+            body['description'] = description or ''
+        if not partial and not start_time:
+            start_time = datetime.utcnow()
+        if not partial and not end_time:
+            end_time = start_time + timedelta(hours=1)
+        if start_time:
+            body['start'] = {'dateTime': start_time.isoformat(), 'timeZone': timezone}
+        if end_time:
+            body['end'] = {'dateTime': end_time.isoformat(), 'timeZone': timezone}
+        return body
+
+    def warm(self, clients: int = 1):
+        pass
+
+    def create_event(self, title, description=None, start_time=None, end_time=None,
+                     timezone='UTC', calendar_id=None, properties=None) -> Optional[str]:
+        if not self._round_trip('create_event'):
+            return None
+        return self.store.insert(self._body(title, description, start_time, end_time, timezone, properties))['id']
+
+    def update_event(self, event_id, title=None, description=None, start_time=None,
+                     end_time=None, timezone='UTC', calendar_id=None, etag=None) -> bool:
+        if not self._round_trip('update_event'):
+            return False
+        body = self._body(title, description, start_time, end_time, timezone, partial=True)
+        return self.store.modify(event_id, body, replace=False) is not None
+
+    def delete_event(self, event_id) -> bool:
+        if not self._round_trip('delete_event'):
+            return False
+        self.store.delete(event_id)
+        return True
+
+    def get_event(self, event_id) -> Optional[Dict[str, Any]]:
+        if not self._round_trip('get_event'):
+            return None
+        return self.store.get(event_id)
+
+    def free_busy(self, time_min, time_max, calendar_ids=None):
+        if not self._round_trip('freebusy'):
+            return None
+        return [(_naive_utc(block['start']), _naive_utc(block['end']))
+                for block in self.store.busy(time_min, time_max)]
+
+    def batch_execute(self, operations: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        results = []
+        for offset in range(0, len(operations), 50):
+            succeeded = self._round_trip('batch')
+            for operation in operations[offset:offset + 50]:
+                fields = {key: value for key, value in operation.items() if key not in ('op', 'event_id', 'etag')}
+                event = None
+                status = None
+                ok = succeeded and random.random() >= self.error_rate
+                if not ok:
+                    status = 503
+                if succeeded and not ok:
+                    CALENDAR_ERRORS.inc(operation=f"batch_{operation['op']}")
+                if ok and operation['op'] == 'create':
+                    event = self.store.insert(self._body(**fields))
+                elif ok and operation['op'] == 'update':
+                    event = self.store.modify(operation['event_id'], self._body(partial=True, **fields), replace=False)
+                    ok = event is not None
+                    status = None if ok else 404
+                elif ok and operation['op'] == 'delete':
+                    self.store.delete(operation['event_id'])
+                results.append({
+                    'ok': ok,
+                    'event_id': event['id'] if event else operation.get('event_id'),
+                    'event': event,
+                    'error': None if ok else 'Injected fake calendar error',
+                    'status': status,
+                })
+        return results
+
+    def list_events(self, private_properties=None, page_size=2500, fields=None):
+        page_token = None
+        while True:
+            self._round_trip('list_events')
+            _, body = self.store.list(None, page_token, page_size, show_deleted=False,
+                                      private_properties=private_properties)
+            yield body['items']
+            page_token = body.get('nextPageToken')
+            if not page_token:
+                return
+
+    def list_event_changes(self, sync_token=None, page_size=250, max_pages=None):
+        page_token = None
+        pages = 0
+        while True:
+            self._round_trip('list_events')
+            status, body = self.store.list(sync_token, page_token, page_size, show_deleted=True)
+            if status == 410:
+                from .google_calendar import SyncTokenExpired
+                raise SyncTokenExpired(body['error']['message'])
+            page_token = body.get('nextPageToken')
+            pages += 1
+            yield body['items'], body.get('nextSyncToken')
+            if not page_token or (max_pages and pages >= max_pages):
+                return
+
+if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser(description='Run a fake Google Calendar API server.')
+    parser.add_argument('--port', type=int, default=8085)
+    options = parser.parse_args()
+    server = FakeCalendarServer(port=options.port)
+    print(f'Fake Calendar API at {server.api_endpoint}')
+    server.httpd.serve_forever()
@@ -1,106 +1,315 @@
 import os
 import json
+import queue
 import base64
 import tempfile
-from datetime import datetime, timedelta
-from typing import Optional, Dict, Any
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from datetime import datetime, timedelta, timezone
+from typing import Optional, Dict, Any, List, Iterator, Tuple, Callable, Set
 from google.oauth2.credentials import Credentials
 from google_auth_oauthlib.flow import InstalledAppFlow
 from google.auth.transport.requests import Request
-from googleapiclient.discovery import build
+from googleapiclient.discovery import build, build_from_document
+from googleapiclient.discovery_cache import get_static_doc
 from googleapiclient.errors import HttpError
 import pickle
 
+from .metrics import phase, CALENDAR_REQUEST_SECONDS, CALENDAR_ERRORS
+from .rate_limit import CalendarGuard, CalendarUnavailable, background_calls, error_status, get_calendar_guard
+
 # If modifying these scopes, delete the file token.pickle.
 SCOPES = ['https://www.googleapis.com/auth/calendar']
 
+# The Calendar batch endpoint accepts at most 50 calls per request.
+BATCH_LIMIT = 50
+
+# Credentials are refreshed this long before they expire, so no API call
+# ever has to stop and refresh them mid-flight.
+REFRESH_MARGIN = timedelta(minutes=5)
+
+_discovery_document = None
+
+def _calendar_discovery_document() -> Optional[Dict[str, Any]]:
+    """
+    The Calendar v3 discovery document bundled with googleapiclient, loaded
+    and parsed once. Building a client from the parsed document takes about
+    0.1 ms instead of re-parsing 130 KB of JSON per client; the fix-ups
+    build_from_document applies to it are the same every time.
+    """
+    global _discovery_document
+    if _discovery_document is None:
+        document = get_static_doc('calendar', 'v3')
+        _discovery_document = json.loads(document) if document else None
+    return _discovery_document
+
+def _naive_utc(value: str) -> datetime:
+    """Parse an RFC 3339 timestamp from the API into a naive UTC datetime."""
+    parsed = datetime.fromisoformat(value.replace('Z', '+00:00'))
+    if parsed.tzinfo is not None:
+        parsed = parsed.astimezone(timezone.utc).replace(tzinfo=None)
+    return parsed
+
+def load_credentials(credentials_file: str = 'credentials.json', token_file: str = 'token.pickle'):
+    """Load OAuth credentials from the environment or token file, running the login flow if needed."""
+    creds = None
+
+    # Try to load token from environment variable first, then fallback to file
+    token_b64 = os.getenv('GOOGLE_TOKEN_B64')
+    if token_b64:
+        try:
+            token_data = base64.b64decode(token_b64)
+            creds = pickle.loads(token_data)
+        except Exception as e:
+            print(f"Warning: Could not load token from environment variable: {e}")
+            creds = None
+    elif os.path.exists(token_file):
+        with open(token_file, 'rb') as token:
+            creds = pickle.load(token)
+
+    # If there are no (valid) credentials available, let the user log in.
+    if not creds or not creds.valid:
+        if creds and creds.expired and creds.refresh_token:
+            creds.refresh(Request())
+        else:
+            creds = oauth_flow(credentials_file).run_local_server(port=0)
+
+        # Save the credentials for the next run
+        # Save to environment variable (base64 encoded) and also to file as backup
+        try:
+            token_data = pickle.dumps(creds)
+            token_b64 = base64.b64encode(token_data).decode('utf-8')
+            # Note: In production, you'd want to update the .env file or use a proper config management system
+            # For now, we'll just save to file as backup
+            print(f"Token updated. To persist in .env, add: GOOGLE_TOKEN_B64={token_b64}")
+        except Exception as e:
+            print(f"Warning: Could not encode token for environment variable: {e}")
+
+        # Also save to file as backup
+        with open(token_file, 'wb') as token:
+            pickle.dump(creds, token)
+
+    return creds
+
+def oauth_flow(credentials_file: str = 'credentials.json') -> InstalledAppFlow:
+    """The OAuth consent flow for the app's client secrets (GOOGLE_CREDENTIALS_B64 or credentials_file)."""
+    # Try to get credentials from environment variable first
+    credentials_b64 = os.getenv('GOOGLE_CREDENTIALS_B64')
+    if credentials_b64:
+        try:
+            credentials_data = base64.b64decode(credentials_b64)
+            credentials_json = json.loads(credentials_data.decode('utf-8'))
+
+            # Create a temporary file for the credentials
+            with tempfile.NamedTemporaryFile(mode='w', suffix='.json', delete=False) as temp_file:
+                json.dump(credentials_json, temp_file)
+                temp_credentials_file = temp_file.name
+
+            flow = InstalledAppFlow.from_client_secrets_file(
+                temp_credentials_file, SCOPES)
+
+            # Clean up the temporary file
+            os.unlink(temp_credentials_file)
+
+        except Exception as e:
+            raise RuntimeError(f"Could not load credentials from environment variable: {e}")
+    elif os.path.exists(credentials_file):
+        flow = InstalledAppFlow.from_client_secrets_file(
+            credentials_file, SCOPES)
+    else:
+        raise FileNotFoundError(
+            f"Credentials not found in environment variable 'GOOGLE_CREDENTIALS_B64' "
+            f"or file '{credentials_file}'. Please set the environment variable "
+            "or download the credentials file from Google Cloud Console."
+        )
+    return flow
+
+def credentials_need_refresh(creds) -> bool:
+    """True if credentials are invalid or expire within REFRESH_MARGIN."""
+    if creds.expiry is None:
+        return not creds.valid
+    return creds.expiry - datetime.utcnow() < REFRESH_MARGIN
+
+class SyncTokenExpired(Exception):
+    """The stored syncToken is no longer valid (HTTP 410); a full resync is required."""
+
 class GoogleCalendarService:
-    def __init__(self, credentials_file: str = 'credentials.json', token_file: str = 'token.pickle'):
+    def __init__(self, credentials_file: str = 'credentials.json', token_file: str = 'token.pickle',
+                 max_clients: int = None, credentials=None, api_endpoint: str = None,
+                 guard: CalendarGuard = None, calendar_id: str = None,
+                 on_refresh: Callable[[Any], None] = None):
         """
         Initialize Google Calendar service.
         
+        API clients are not thread-safe (each wraps its own httplib2.Http), so
+        the service keeps a pool of them and lends one to each call. All
+        clients share a single credentials object that is refreshed under a
+        lock shortly before it expires.
+        
         Args:
             credentials_file: Path to Google API credentials JSON file
             token_file: Path to store/load OAuth token
+            max_clients: Upper bound on pooled API clients
+                (default: VAPI_CALENDAR_CLIENTS or 8)
+            credentials: Ready-made google-auth credentials; skips the OAuth flow
+            api_endpoint: Base URL overriding https://www.googleapis.com/calendar/v3/,
+                e.g. a local fake server (default: GOOGLE_CALENDAR_API_ENDPOINT)
+            guard: Rate limiter, retries and circuit breaker for every call
+                (default: the process-wide get_calendar_guard())
+            calendar_id: Calendar that calls without an explicit calendar_id
+                act on (default: GOOGLE_CALENDAR_ID or 'primary')
+            on_refresh: Called with the credentials after each refresh, e.g.
+                to store the new access token
         """
         self.credentials_file = credentials_file
         self.token_file = token_file
-        self.service = None
-        self._authenticate()
+        self.credentials = credentials
+        self.guard = guard or get_calendar_guard()
+        self.calendar_id = calendar_id or os.getenv('GOOGLE_CALENDAR_ID', 'primary')
+        self.on_refresh = on_refresh
+        self.api_endpoint = api_endpoint or os.getenv('GOOGLE_CALENDAR_API_ENDPOINT')
+        self.max_clients = max_clients or int(os.getenv('VAPI_CALENDAR_CLIENTS', '8'))
+        self._idle_clients = queue.LifoQueue()
+        self._clients_created = 0
+        self._pool_lock = threading.Lock()
+        self._refresh_lock = threading.Lock()
+        if self.credentials is None:
+            self._authenticate()
     
     def _authenticate(self):
         """Authenticate with Google Calendar API."""
-        creds = None
+        self.credentials = load_credentials(self.credentials_file, self.token_file)
+    
+    def _ensure_fresh_credentials(self):
+        """Refresh the shared credentials if they expire within REFRESH_MARGIN."""
+        if not credentials_need_refresh(self.credentials):
+            return
+        with self._refresh_lock:
+            # Another thread may have refreshed while we waited for the lock.
+            if credentials_need_refresh(self.credentials) and self.credentials.refresh_token:
+                self.credentials.refresh(Request())
+                if self.on_refresh is not None:
+                    self.on_refresh(self.credentials)
+    
+    def _build_client(self):
+        """Build an API client from the bundled discovery document (no network round trip)."""
+        client_options = {'api_endpoint': self.api_endpoint} if self.api_endpoint else None
+        document = _calendar_discovery_document()
+        if document is None:
+            return build('calendar', 'v3', credentials=self.credentials, cache_discovery=False,
+                         client_options=client_options)
+        return build_from_document(document, credentials=self.credentials, client_options=client_options)
+    
+    @contextmanager
+    def client(self):
+        """
+        Check an API client out of the pool for the duration of a call.
         
-        # Try to load token from environment variable first, then fallback to file
-        token_b64 = os.getenv('GOOGLE_TOKEN_B64')
-        if token_b64:
-            try:
-                token_data = base64.b64decode(token_b64)
-                creds = pickle.loads(token_data)
-            except Exception as e:
-                print(f"Warning: Could not load token from environment variable: {e}")
-                creds = None
-        elif os.path.exists(self.token_file):
-            with open(self.token_file, 'rb') as token:
-                creds = pickle.load(token)
-        
-        # If there are no (valid) credentials available, let the user log in.
-        if not creds or not creds.valid:
-            if creds and creds.expired and creds.refresh_token:
-                creds.refresh(Request())
+        Builds a new client while fewer than max_clients exist, otherwise
+        waits for one to be returned.
+        """
+        self._ensure_fresh_credentials()
+        try:
+            service = self._idle_clients.get_nowait()
+        except queue.Empty:
+            with self._pool_lock:
+                can_build = self._clients_created < self.max_clients
+                if can_build:
+                    self._clients_created += 1
+            if can_build:
+                try:
+                    service = self._build_client()
+                except Exception:
+                    with self._pool_lock:
+                        self._clients_created -= 1
+                    raise
             else:
-                # Try to get credentials from environment variable first
-                credentials_b64 = os.getenv('GOOGLE_CREDENTIALS_B64')
-                if credentials_b64:
-                    try:
-                        credentials_data = base64.b64decode(credentials_b64)
-                        credentials_json = json.loads(credentials_data.decode('utf-8'))
-                        
-                        # Create a temporary file for the credentials
-                        with tempfile.NamedTemporaryFile(mode='w', suffix='.json', delete=False) as temp_file:
-                            json.dump(credentials_json, temp_file)
-                            temp_credentials_file = temp_file.name
-                        
-                        flow = InstalledAppFlow.from_client_secrets_file(
-                            temp_credentials_file, SCOPES)
-                        
-                        # Clean up the temporary file
-                        os.unlink(temp_credentials_file)
-                        
-                    except Exception as e:
-                        raise RuntimeError(f"Could not load credentials from environment variable: {e}")
-                elif os.path.exists(self.credentials_file):
-                    flow = InstalledAppFlow.from_client_secrets_file(
-                        self.credentials_file, SCOPES)
-                else:
-                    raise FileNotFoundError(
-                        f"Credentials not found in environment variable 'GOOGLE_CREDENTIALS_B64' "
-                        f"or file '{self.credentials_file}'. Please set the environment variable "
-                        "or download the credentials file from Google Cloud Console."
-                    )
-                creds = flow.run_local_server(port=0)
-            
-            # Save the credentials for the next run
-            # Save to environment variable (base64 encoded) and also to file as backup
-            try:
-                token_data = pickle.dumps(creds)
-                token_b64 = base64.b64encode(token_data).decode('utf-8')
-                # Note: In production, you'd want to update the .env file or use a proper config management system
-                # For now, we'll just save to file as backup
-                print(f"Token updated. To persist in .env, add: GOOGLE_TOKEN_B64={token_b64}")
-            except Exception as e:
-                print(f"Warning: Could not encode token for environment variable: {e}")
-            
-            # Also save to file as backup
-            with open(self.token_file, 'wb') as token:
-                pickle.dump(creds, token)
-        
-        self.service = build('calendar', 'v3', credentials=creds)
+                service = self._idle_clients.get()
+        try:
+            yield service
+        finally:
+            self._idle_clients.put(service)
+    
+    def warm(self, clients: int = 1):
+        """Refresh credentials and pre-build up to `clients` pooled API clients."""
+        self._ensure_fresh_credentials()
+        with self._pool_lock:
+            missing = max(0, min(clients, self.max_clients) - self._clients_created)
+            self._clients_created += missing
+        for _ in range(missing):
+            self._idle_clients.put(self._build_client())
+    
+    def _execute(self, request, operation: str, cost: int = 1, idempotent: bool = True):
+        """
+        Execute an API request through the guard (quota, retries, circuit
+        breaker). Raises CalendarUnavailable if the guard refuses the call.
+        """
+        return self.guard.call(lambda: self._execute_once(request, operation), operation,
+                               cost=cost, idempotent=idempotent)
+    
+    @staticmethod
+    def _execute_once(request, operation: str):
+        """Execute an API request once, recording its latency and any HTTP error under `operation`."""
+        started = time.perf_counter()
+        try:
+            with phase('calendar'):
+                return request.execute()
+        except HttpError:
+            CALENDAR_ERRORS.inc(operation=operation)
+            raise
+        finally:
+            CALENDAR_REQUEST_SECONDS.observe(time.perf_counter() - started, operation=operation)
+    
+    @staticmethod
+    def _event_body(title: str, description: str = None,
+                    start_time: datetime = None, end_time: datetime = None,
+                    timezone: str = 'UTC', properties: Dict[str, str] = None) -> Dict[str, Any]:
+        """Build a full event resource, defaulting to a one hour slot starting now."""
+        if not start_time:
+            start_time = datetime.utcnow()
+        if not end_time:
+            end_time = start_time + timedelta(hours=1)
+        body = {
+            'summary': title,
+            'description': description or '',
+            'start': {
+                'dateTime': start_time.isoformat(),
+                'timeZone': timezone,
+            },
+            'end': {
+                'dateTime': end_time.isoformat(),
+                'timeZone': timezone,
+            },
+        }
+        if properties:
+            body['extendedProperties'] = {'private': dict(properties)}
+        return body
+    
+    @staticmethod
+    def _patch_body(title: str = None, description: str = None,
+                    start_time: datetime = None, end_time: datetime = None,
+                    timezone: str = 'UTC', properties: Dict[str, str] = None) -> Dict[str, Any]:
+        """Build a partial event resource containing only the given fields."""
+        body = {}
+        if title:
+            body['summary'] = title
+        if description is not None:
+            body['description'] = description
+        if start_time:
+            body['start'] = {'dateTime': start_time.isoformat(), 'timeZone': timezone}
+        if end_time:
+            body['end'] = {'dateTime': end_time.isoformat(), 'timeZone': timezone}
+        if properties:
+            # Patching merges these keys into the event's existing private properties.
+            body['extendedProperties'] = {'private': dict(properties)}
+        return body
     
     def create_event(self, title: str, description: str = None, 
                     start_time: datetime = None, end_time: datetime = None,
-                    timezone: str = 'UTC') -> Optional[str]:
+                    timezone: str = 'UTC', calendar_id: str = None,
+                    properties: Dict[str, str] = None) -> Optional[str]:
         """
         Create a Google Calendar event.
         
@@ -110,44 +319,32 @@ class GoogleCalendarService:
             start_time: Start datetime
             end_time: End datetime
             timezone: Timezone string
+            calendar_id: Calendar to create it in (default: self.calendar_id)
+            properties: Private extended properties to tag the event with
             
         Returns:
             Google Calendar event ID if successful, None otherwise
         """
         try:
-            if not start_time:
-                start_time = datetime.utcnow()
-            if not end_time:
-                end_time = start_time + timedelta(hours=1)
-            
-            event = {
-                'summary': title,
-                'description': description or '',
-                'start': {
-                    'dateTime': start_time.isoformat(),
-                    'timeZone': timezone,
-                },
-                'end': {
-                    'dateTime': end_time.isoformat(),
-                    'timeZone': timezone,
-                },
-            }
+            event = self._event_body(title, description, start_time, end_time, timezone, properties)
             
-            event = self.service.events().insert(
-                calendarId='primary', body=event
-            ).execute()
+            with self.client() as service:
+                event = self._execute(service.events().insert(
+                    calendarId=calendar_id or self.calendar_id, body=event
+                ), 'create_event', idempotent=False)
             
             return event.get('id')
         
-        except HttpError as error:
+        except (HttpError, CalendarUnavailable) as error:
             print(f'An error occurred: {error}')
             return None
     
     def update_event(self, event_id: str, title: str = None, 
                     description: str = None, start_time: datetime = None,
-                    end_time: datetime = None, timezone: str = 'UTC') -> bool:
+                    end_time: datetime = None, timezone: str = 'UTC', calendar_id: str = None,
+                    etag: str = None) -> bool:
         """
-        Update a Google Calendar event.
+        Update a Google Calendar event with a single patch call.
         
         Args:
             event_id: Google Calendar event ID
@@ -156,86 +353,491 @@ class GoogleCalendarService:
             start_time: New start datetime
             end_time: New end datetime
             timezone: Timezone string
+            calendar_id: Calendar holding the event (default: self.calendar_id)
+            etag: ETag of the version last synced; see patch_event
             
         Returns:
             True if successful, False otherwise
         """
-        try:
-            # Get existing event
-            event = self.service.events().get(
-                calendarId='primary', eventId=event_id
-            ).execute()
-            
-            # Update fields
-            if title:
-                event['summary'] = title
-            if description is not None:
-                event['description'] = description
-            if start_time:
-                event['start']['dateTime'] = start_time.isoformat()
-            if end_time:
-                event['end']['dateTime'] = end_time.isoformat()
-            
-            self.service.events().update(
-                calendarId='primary', eventId=event_id, body=event
-            ).execute()
-            
-            return True
+        return self.patch_event(event_id, title, description, start_time, end_time, timezone,
+                                calendar_id, etag) is not None
+    
+    def patch_event(self, event_id: str, title: str = None, 
+                    description: str = None, start_time: datetime = None,
+                    end_time: datetime = None, timezone: str = 'UTC', calendar_id: str = None,
+                    etag: str = None, properties: Dict[str, str] = None) -> Optional[Dict[str, Any]]:
+        """
+        Patch only the given fields of an event in one round trip.
         
-        except HttpError as error:
+        With an `etag` the patch is conditional (If-Match). If the event
+        changed in Google since then (412), it is fetched again and only the
+        fields that still differ are patched against the new ETag.
+        
+        Args:
+            event_id: Google Calendar event ID
+            title: New event title
+            description: New event description
+            start_time: New start datetime
+            end_time: New end datetime
+            timezone: Timezone string
+            calendar_id: Calendar holding the event (default: self.calendar_id)
+            etag: ETag of the version last synced
+            properties: Private extended properties to set
+            
+        Returns:
+            The updated event (with its new ETag) if successful, None otherwise
+        """
+        body = self._patch_body(title, description, start_time, end_time, timezone, properties)
+        try:
+            with self.client() as service:
+                return self._conditional_patch(service, calendar_id or self.calendar_id, event_id, body, etag)
+        except (HttpError, CalendarUnavailable) as error:
             print(f'An error occurred: {error}')
-            return False
+            return None
+    
+    def _patch_request(self, service, calendar_id: str, event_id: str, body: Dict[str, Any], etag: str = None):
+        request = service.events().patch(calendarId=calendar_id, eventId=event_id, body=body)
+        if etag:
+            request.headers['If-Match'] = etag
+        return request
+    
+    def _conditional_patch(self, service, calendar_id: str, event_id: str, body: Dict[str, Any],
+                           etag: str = None, stale: bool = False) -> Dict[str, Any]:
+        """Patch If-Match `etag`, refetching on 412; `stale` skips straight to the refetch."""
+        if not stale:
+            try:
+                return self._execute(self._patch_request(service, calendar_id, event_id, body, etag),
+                                     'update_event')
+            except HttpError as error:
+                if not etag or error.resp.status != 412:
+                    raise
+        # Edited in Google since our last sync: refetch and patch what still differs.
+        current = self._execute(service.events().get(calendarId=calendar_id, eventId=event_id), 'get_event')
+        body = self._unapplied_fields(current, body)
+        if not body:
+            return current
+        return self._execute(self._patch_request(service, calendar_id, event_id, body, current.get('etag')),
+                             'update_event')
     
-    def delete_event(self, event_id: str) -> bool:
+    @staticmethod
+    def _unapplied_fields(event: Dict[str, Any], body: Dict[str, Any]) -> Dict[str, Any]:
+        """The part of a patch body that `event` does not already reflect."""
+        remaining = {}
+        for key, value in body.items():
+            if key in ('start', 'end'):
+                current = (event.get(key) or {}).get('dateTime')
+                if current and value.get('timeZone') == 'UTC' and \
+                        _naive_utc(current) == datetime.fromisoformat(value['dateTime']).replace(microsecond=0):
+                    continue
+            elif key == 'extendedProperties':
+                current = (event.get(key) or {}).get('private') or {}
+                if all(current.get(name) == item for name, item in value.get('private', {}).items()):
+                    continue
+            elif event.get(key) == value:
+                continue
+            remaining[key] = value
+        return remaining
+    
+    def delete_event(self, event_id: str, calendar_id: str = None) -> bool:
         """
         Delete a Google Calendar event.
         
         Args:
             event_id: Google Calendar event ID
+            calendar_id: Calendar holding the event (default: self.calendar_id)
             
         Returns:
             True if successful, False otherwise
         """
         try:
-            self.service.events().delete(
-                calendarId='primary', eventId=event_id
-            ).execute()
+            with self.client() as service:
+                self._execute(service.events().delete(
+                    calendarId=calendar_id or self.calendar_id, eventId=event_id
+                ), 'delete_event')
             return True
         
-        except HttpError as error:
+        except (HttpError, CalendarUnavailable) as error:
             print(f'An error occurred: {error}')
             return False
     
-    def get_event(self, event_id: str) -> Optional[Dict[str, Any]]:
+    def get_event(self, event_id: str, calendar_id: str = None) -> Optional[Dict[str, Any]]:
         """
         Get a Google Calendar event.
         
         Args:
             event_id: Google Calendar event ID
+            calendar_id: Calendar holding the event (default: self.calendar_id)
             
         Returns:
             Event data if found, None otherwise
         """
         try:
-            event = self.service.events().get(
-                calendarId='primary', eventId=event_id
-            ).execute()
+            with self.client() as service:
+                event = self._execute(service.events().get(
+                    calendarId=calendar_id or self.calendar_id, eventId=event_id
+                ), 'get_event')
             return event
         
-        except HttpError as error:
+        except (HttpError, CalendarUnavailable) as error:
             print(f'An error occurred: {error}')
             return None
 
+    def free_busy(self, time_min: datetime, time_max: datetime,
+                  calendar_ids: List[str] = None) -> Optional[List[Tuple[datetime, datetime]]]:
+        """
+        Get busy blocks from the freebusy API.
+        
+        Args:
+            time_min: Start of the window (naive UTC)
+            time_max: End of the window (naive UTC)
+            calendar_ids: Calendars to query (default: [self.calendar_id])
+            
+        Returns:
+            (start, end) busy blocks as naive UTC datetimes if successful, None otherwise
+        """
+        body = {
+            'timeMin': time_min.isoformat() + 'Z',
+            'timeMax': time_max.isoformat() + 'Z',
+            'items': [{'id': calendar_id} for calendar_id in (calendar_ids or [self.calendar_id])],
+        }
+        try:
+            with self.client() as service:
+                response = self._execute(service.freebusy().query(body=body), 'freebusy')
+        except (HttpError, CalendarUnavailable) as error:
+            print(f'An error occurred: {error}')
+            return None
+        
+        busy = []
+        for calendar in response.get('calendars', {}).values():
+            for block in calendar.get('busy', []):
+                busy.append((_naive_utc(block['start']), _naive_utc(block['end'])))
+        return busy
+
+    def list_event_changes(self, sync_token: str = None, page_size: int = 250,
+                           max_pages: int = None) -> Iterator[Tuple[List[Dict[str, Any]], Optional[str]]]:
+        """
+        Page through events changed since a sync token, or through all events.
+        
+        Deleted events are included (with status 'cancelled') so callers can
+        mirror deletions.
+        
+        Args:
+            sync_token: nextSyncToken from a previous complete listing; None lists everything
+            page_size: Events per page (Google allows up to 2500)
+            max_pages: Stop after this many pages, leaving the listing incomplete
+            
+        Yields:
+            (events, next_sync_token) per page; next_sync_token is only set on the last page
+            
+        Raises:
+            SyncTokenExpired: If Google rejected the sync token with 410 Gone
+            HttpError: For any other API error
+        """
+        page_token = None
+        pages = 0
+        while True:
+            params = {'calendarId': self.calendar_id, 'maxResults': page_size, 'showDeleted': True}
+            if sync_token:
+                params['syncToken'] = sync_token
+            if page_token:
+                params['pageToken'] = page_token
+            try:
+                with self.client() as service:
+                    response = self._execute(service.events().list(**params), 'list_events')
+            except HttpError as error:
+                if error.resp.status == 410:
+                    raise SyncTokenExpired(str(error))
+                raise
+            page_token = response.get('nextPageToken')
+            pages += 1
+            yield response.get('items', []), response.get('nextSyncToken')
+            if not page_token or (max_pages and pages >= max_pages):
+                return
+    
+    def list_events(self, private_properties: Dict[str, str] = None, page_size: int = 2500,
+                    fields: str = None) -> Iterator[List[Dict[str, Any]]]:
+        """
+        Page through the calendar's current (not deleted) events.
+        
+        Args:
+            private_properties: Only events whose private extended properties
+                have these values, e.g. {'vapiEntity': 'todo'}
+            page_size: Events per page (Google allows up to 2500)
+            fields: Partial response selector for the items, e.g. 'id,summary'
+            
+        Yields:
+            One list of events per page
+            
+        Raises:
+            HttpError: If a page could not be fetched
+        """
+        params = {'calendarId': self.calendar_id, 'maxResults': page_size}
+        if private_properties:
+            params['privateExtendedProperty'] = [f'{key}={value}' for key, value in private_properties.items()]
+        if fields:
+            params['fields'] = f'items({fields}),nextPageToken'
+        while True:
+            with self.client() as service:
+                response = self._execute(service.events().list(**params), 'list_events')
+            yield response.get('items', [])
+            params['pageToken'] = response.get('nextPageToken')
+            if not params['pageToken']:
+                return
+    
+    def _batch_request(self, service, operation: Dict[str, Any]):
+        """Translate one batch operation into an unexecuted API request."""
+        op = operation.get('op')
+        events = service.events()
+        calendar_id = operation.get('calendar_id') or self.calendar_id
+        if op == 'create':
+            body = self._event_body(
+                operation.get('title'), operation.get('description'),
+                operation.get('start_time'), operation.get('end_time'),
+                operation.get('timezone', 'UTC'), operation.get('properties'))
+            return events.insert(calendarId=calendar_id, body=body)
+        if op == 'update':
+            body = self._patch_body(
+                operation.get('title'), operation.get('description'),
+                operation.get('start_time'), operation.get('end_time'),
+                operation.get('timezone', 'UTC'), operation.get('properties'))
+            return self._patch_request(service, calendar_id, operation['event_id'], body, operation.get('etag'))
+        if op == 'delete':
+            return events.delete(calendarId=calendar_id, eventId=operation['event_id'])
+        raise ValueError(f"Unknown batch operation '{op}'")
+    
+    def batch_execute(self, operations: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """
+        Run many create/update/delete calls through the Calendar batch endpoint.
+        
+        Operations are sent in multipart batch requests of up to BATCH_LIMIT
+        calls each. Updates are sent as patches, conditional on 'etag' when
+        given; the few that fail with 412 are retried one by one after a
+        refetch, as in patch_event. Batches come from background work (the
+        outbox, reconcile), so they wait for quota up to the guard's
+        background deadline.
+        
+        Args:
+            operations: One dict per call. 'op' is 'create', 'update' or 'delete';
+                the other keys are the keyword arguments of create_event,
+                update_event or delete_event ('event_id' for update/delete,
+                optionally 'calendar_id', 'properties' and, for updates, 'etag').
+            
+        Returns:
+            One dict per operation, in the same order, with keys 'ok',
+            'event_id', 'event' (the returned resource, if any), 'error',
+            'status' (the HTTP status of a failed call, if known) and
+            'unavailable' (True if the guard refused the call, so it was never sent)
+        """
+        results: List[Optional[Dict[str, Any]]] = [None] * len(operations)
+        conflicts: Set[int] = set()  # A retried batch reports them again
+        
+        def collect(request_id, response, exception):
+            index = int(request_id)
+            operation = operations[index]
+            if exception is None:
+                event = response or None
+                event_id = event.get('id') if event else operation.get('event_id')
+                results[index] = {'ok': True, 'event_id': event_id, 'event': event, 'error': None, 'status': None}
+                return
+            status = getattr(getattr(exception, 'resp', None), 'status', None)
+            if operation.get('op') == 'delete' and status in (404, 410):
+                # Already gone; deleting is idempotent.
+                results[index] = {'ok': True, 'event_id': operation.get('event_id'), 'event': None,
+                                  'error': None, 'status': None}
+                return
+            if operation.get('op') == 'update' and operation.get('etag') and status == 412:
+                conflicts.add(index)
+                return
+            CALENDAR_ERRORS.inc(operation=f"batch_{operation.get('op')}")
+            print(f'An error occurred in batch call {index}: {exception}')
+            results[index] = {'ok': False, 'event_id': operation.get('event_id'), 'event': None,
+                              'error': str(exception), 'status': status}
+        
+        with self.client() as service, background_calls():
+            for offset in range(0, len(operations), BATCH_LIMIT):
+                batch = service.new_batch_http_request(callback=collect)
+                added = []
+                for index in range(offset, min(offset + BATCH_LIMIT, len(operations))):
+                    try:
+                        batch.add(self._batch_request(service, operations[index]), request_id=str(index))
+                        added.append(operations[index])
+                    except (KeyError, ValueError) as error:
+                        results[index] = {'ok': False, 'event_id': None, 'event': None, 'error': str(error),
+                                          'status': None}
+                try:
+                    # Every call in the batch counts against the quota.
+                    self._execute(batch, 'batch', cost=len(added),
+                                  idempotent=not any(operation.get('op') == 'create' for operation in added))
+                except (HttpError, CalendarUnavailable) as error:
+                    print(f'An error occurred: {error}')
+                    for index in range(offset, min(offset + BATCH_LIMIT, len(operations))):
+                        if results[index] is None:
+                            results[index] = {'ok': False, 'event_id': operations[index].get('event_id'),
+                                              'event': None, 'error': str(error), 'status': error_status(error),
+                                              'unavailable': isinstance(error, CalendarUnavailable)}
+            
+            for index in sorted(conflicts):
+                operation = operations[index]
+                body = self._patch_body(
+                    operation.get('title'), operation.get('description'),
+                    operation.get('start_time'), operation.get('end_time'),
+                    operation.get('timezone', 'UTC'), operation.get('properties'))
+                try:
+                    event = self._conditional_patch(service, operation.get('calendar_id') or self.calendar_id,
+                                                    operation['event_id'], body, operation['etag'], stale=True)
+                    results[index] = {'ok': True, 'event_id': operation['event_id'], 'event': event,
+                                      'error': None, 'status': None}
+                except (HttpError, CalendarUnavailable) as error:
+                    print(f'An error occurred in batch call {index}: {error}')
+                    results[index] = {'ok': False, 'event_id': operation['event_id'], 'event': None,
+                                      'error': str(error), 'status': error_status(error),
+                                      'unavailable': isinstance(error, CalendarUnavailable)}
+        
+        return results
+
 # Global instance for easy access
 _calendar_service = None
+_calendar_service_lock = threading.Lock()
 
-def get_calendar_service() -> GoogleCalendarService:
-    """Get or create the global Google Calendar service instance."""
+def get_calendar_service(user_id: str = None) -> Optional[GoogleCalendarService]:
+    """
+    Get the Google Calendar service for a user, or the global instance.
+    
+    Args:
+        user_id: User whose stored credentials to use; None for the
+            deployment's own calendar (token.pickle / GOOGLE_TOKEN_B64)
+        
+    Returns:
+        The service, or None if the user has no stored credentials
+    """
+    if user_id is not None:
+        return _user_services.get(user_id) if _user_services is not None else None
     global _calendar_service
     if _calendar_service is None:
-        _calendar_service = GoogleCalendarService()
+        with _calendar_service_lock:
+            if _calendar_service is None:
+                _calendar_service = GoogleCalendarService()
     return _calendar_service 
 
+def set_calendar_service(service):
+    """Replace the global instance, e.g. with a FakeCalendarService for benchmarks."""
+    global _calendar_service
+    with _calendar_service_lock:
+        _calendar_service = service
+
+class UserCalendarServices:
+    """
+    Bounded LRU cache of per-user GoogleCalendarService instances.
+    
+    Services are built from the credentials `loader(user_id)` returns and
+    keep their pooled API clients between calls. The least recently used
+    service is dropped beyond `max_users`, and any service idle for
+    `idle_seconds` is dropped on the next lookup. Users without credentials
+    are remembered for `negative_ttl` seconds so they cost no lookup per call.
+    """
+    
+    def __init__(self, loader: Callable[[str], Optional[Tuple[Any, Optional[str]]]],
+                 saver: Callable[[str, Any], None] = None, max_users: int = 256,
+                 idle_seconds: float = 900.0, clients_per_user: int = 2, negative_ttl: float = 60.0):
+        """
+        Args:
+            loader: user_id -> (credentials, calendar_id or None), or None if the user has none
+            saver: Called with (user_id, credentials) after a refresh, to store the new token
+            max_users: Upper bound on cached services
+            idle_seconds: Drop services unused for this long
+            clients_per_user: Pooled API clients per service
+            negative_ttl: How long a user without credentials is remembered
+        """
+        self.loader = loader
+        self.saver = saver
+        self.max_users = max_users
+        self.idle_seconds = idle_seconds
+        self.clients_per_user = clients_per_user
+        self.negative_ttl = negative_ttl
+        # user_id -> (service or None, loaded at); ordered from least to most recently used
+        self._entries: 'OrderedDict[str, Tuple[Optional[GoogleCalendarService], float, float]]' = OrderedDict()
+        self._lock = threading.Lock()
+    
+    def _evict(self, now: float):
+        # Entries are in order of last use, so idle ones are all at the front.
+        while self._entries:
+            _, last_used, _ = next(iter(self._entries.values()))
+            if now - last_used < self.idle_seconds and len(self._entries) <= self.max_users:
+                break
+            self._entries.popitem(last=False)
+    
+    def _build(self, user_id: str) -> Optional[GoogleCalendarService]:
+        loaded = self.loader(user_id)
+        if loaded is None:
+            return None
+        credentials, calendar_id = loaded
+        on_refresh = None
+        if self.saver is not None:
+            def on_refresh(creds):
+                try:
+                    self.saver(user_id, creds)
+                except Exception as e:
+                    print(f"Warning: Could not store refreshed credentials for user {user_id}: {e}")
+        return GoogleCalendarService(credentials=credentials, calendar_id=calendar_id,
+                                     max_clients=self.clients_per_user, on_refresh=on_refresh)
+    
+    def get(self, user_id: str) -> Optional[GoogleCalendarService]:
+        """The user's service, built on first use; None if the user has no credentials."""
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if entry is not None and (entry[0] is not None or now - entry[2] < self.negative_ttl):
+                self._entries[user_id] = (entry[0], now, entry[2])
+                self._entries.move_to_end(user_id)
+                return entry[0]
+        # Built outside the lock: the loader may query the database.
+        service = self._build(user_id)
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if entry is not None and entry[0] is not None:
+                service = entry[0]  # Another thread got there first
+            self._entries[user_id] = (service, now, now)
+            self._entries.move_to_end(user_id)
+            self._evict(now)
+        return service
+    
+    def invalidate(self, user_id: str):
+        """Forget a user's service, e.g. after their credentials changed."""
+        with self._lock:
+            self._entries.pop(user_id, None)
+    
+    def __len__(self) -> int:
+        return len(self._entries)
+
+_user_services: Optional[UserCalendarServices] = None
+
+def set_user_credentials_store(loader: Callable[[str], Optional[Tuple[Any, Optional[str]]]],
+                               saver: Callable[[str, Any], None] = None):
+    """
+    Enable per-user calendars: get_calendar_service(user_id) then builds
+    services from `loader`. Sized by VAPI_CALENDAR_MAX_USERS (256) and
+    VAPI_CALENDAR_USER_IDLE_SECONDS (900).
+    """
+    global _user_services
+    _user_services = UserCalendarServices(
+        loader, saver,
+        max_users=int(os.getenv('VAPI_CALENDAR_MAX_USERS', '256')),
+        idle_seconds=float(os.getenv('VAPI_CALENDAR_USER_IDLE_SECONDS', '900')))
+
+def get_user_calendar_services() -> Optional[UserCalendarServices]:
+    return _user_services
+
+def warm_calendar_service(clients: int = 1):
+    """
+    Authenticate and pre-build pooled API clients so the first real call
+    does not pay for token loading, refresh and client construction.
+    Failures are printed, not raised: warming is an optimization.
+    """
+    try:
+        get_calendar_service().warm(clients)
+    except Exception as e:
+        print(f"Warning: Could not warm Google Calendar service: {e}")
+
 if __name__ == "__main__":
     # To generate token.pickle from credentials.json in the project root,
     # run this script from the project root directory.
@@ -0,0 +1,325 @@
+"""
+Google Calendar v3 client for asyncio services, on plain REST over httpx.
+
+googleapiclient is synchronous (httplib2), so the ASGI service talks to the
+REST API directly: one shared httpx.AsyncClient keeps a bounded pool of
+keep-alive connections, and the google-auth credentials are reused from the
+synchronous service (load_credentials), refreshed in a worker thread under
+an asyncio lock. Request and response bodies are the same as the ones
+GoogleCalendarService sends, so both services can point at the real API or
+at a FakeCalendarServer.
+
+The multipart batch endpoint is not used: batch_execute() runs the calls
+concurrently over the pooled connections instead, which is as fast as one
+batch round trip and reports each call's outcome separately.
+"""
+import os
+import time
+import asyncio
+from datetime import datetime
+from urllib.parse import quote
+from typing import Optional, Dict, Any, List, Tuple
+
+import httpx
+from google.auth.transport.requests import Request
+
+from .google_calendar import GoogleCalendarService, load_credentials, credentials_need_refresh, _naive_utc
+from .metrics import phase, CALENDAR_REQUEST_SECONDS, CALENDAR_ERRORS
+from .rate_limit import CalendarGuard, CalendarUnavailable, background_calls, get_calendar_guard
+
+DEFAULT_API_ENDPOINT = 'https://www.googleapis.com/calendar/v3/'
+
+class CalendarAPIError(Exception):
+    """A Calendar REST call answered with an error status."""
+
+    def __init__(self, status: int, message: str, retry_after: Optional[str] = None):
+        super().__init__(f'HTTP {status}: {message}')
+        self.status = status
+        self.retry_after = retry_after
+
+class AsyncGoogleCalendarService:
+    def __init__(self, credentials_file: str = 'credentials.json', token_file: str = 'token.pickle',
+                 max_connections: int = None, credentials=None, api_endpoint: str = None,
+                 timeout: float = 30.0, guard: CalendarGuard = None, calendar_id: str = None):
+        """
+        Initialize the async Google Calendar service.
+
+        Credentials are loaded on first use, so constructing the service never
+        blocks the event loop.
+
+        Args:
+            credentials_file: Path to Google API credentials JSON file
+            token_file: Path to store/load OAuth token
+            max_connections: Upper bound on concurrent connections and in-flight calls
+                (default: VAPI_CALENDAR_CLIENTS or 8)
+            credentials: Ready-made google-auth credentials; skips the OAuth flow
+            api_endpoint: Base URL overriding https://www.googleapis.com/calendar/v3/,
+                e.g. a local fake server (default: GOOGLE_CALENDAR_API_ENDPOINT)
+            timeout: Per-request timeout in seconds
+            guard: Rate limiter, retries and circuit breaker for every call
+                (default: the process-wide get_calendar_guard())
+            calendar_id: Calendar the events live in (default: GOOGLE_CALENDAR_ID or 'primary')
+        """
+        self.credentials_file = credentials_file
+        self.token_file = token_file
+        self.credentials = credentials
+        self.guard = guard or get_calendar_guard()
+        self.calendar_id = calendar_id or os.getenv('GOOGLE_CALENDAR_ID', 'primary')
+        self._events_path = f"calendars/{quote(self.calendar_id, safe='')}/events"
+        endpoint = api_endpoint or os.getenv('GOOGLE_CALENDAR_API_ENDPOINT') or DEFAULT_API_ENDPOINT
+        self.api_endpoint = endpoint if endpoint.endswith('/') else endpoint + '/'
+        self.max_connections = max_connections or int(os.getenv('VAPI_CALENDAR_CLIENTS', '8'))
+        self._client = httpx.AsyncClient(
+            base_url=self.api_endpoint,
+            timeout=timeout,
+            limits=httpx.Limits(max_connections=self.max_connections,
+                                max_keepalive_connections=self.max_connections),
+        )
+        self._semaphore = asyncio.Semaphore(self.max_connections)
+        self._credentials_lock = asyncio.Lock()
+
+    async def _headers(self) -> Dict[str, str]:
+        """Authorization headers, loading or refreshing the credentials if needed."""
+        if self.credentials is None or credentials_need_refresh(self.credentials):
+            async with self._credentials_lock:
+                # Another task may have loaded or refreshed them while we waited.
+                if self.credentials is None:
+                    self.credentials = await asyncio.to_thread(
+                        load_credentials, self.credentials_file, self.token_file)
+                elif credentials_need_refresh(self.credentials) and self.credentials.refresh_token:
+                    await asyncio.to_thread(self.credentials.refresh, Request())
+        headers: Dict[str, str] = {}
+        self.credentials.apply(headers)
+        return headers
+
+    async def _request(self, method: str, path: str, operation: str,
+                       json: Dict[str, Any] = None, etag: str = None) -> Optional[Dict[str, Any]]:
+        """
+        Send one REST call through the guard (quota, retries, circuit breaker).
+
+        Returns:
+            The decoded response body, or None for an empty one
+
+        Raises:
+            CalendarAPIError: If the API answered with an error status
+            httpx.HTTPError: If the API could not be reached
+            CalendarUnavailable: If the guard refused the call
+        """
+        headers = await self._headers()
+        if etag:
+            headers['If-Match'] = etag
+        # Inserts are not retried after a connection or server error: they may have been applied.
+        return await self.guard.acall(lambda: self._send(method, path, operation, json, headers), operation,
+                                      idempotent=method != 'POST' or path == 'freeBusy')
+
+    async def _send(self, method: str, path: str, operation: str, json: Optional[Dict[str, Any]],
+                    headers: Dict[str, str]) -> Optional[Dict[str, Any]]:
+        """Send one REST call once, recording its latency and any error under `operation`."""
+        started = time.perf_counter()
+        try:
+            with phase('calendar'):
+                async with self._semaphore:
+                    response = await self._client.request(method, path, json=json, headers=headers)
+            if response.status_code >= 400:
+                raise CalendarAPIError(response.status_code, response.text[:500],
+                                       response.headers.get('retry-after'))
+        except (CalendarAPIError, httpx.HTTPError):
+            CALENDAR_ERRORS.inc(operation=operation)
+            raise
+        finally:
+            CALENDAR_REQUEST_SECONDS.observe(time.perf_counter() - started, operation=operation)
+        return response.json() if response.content else None
+
+    async def create_event(self, title: str, description: str = None,
+                           start_time: datetime = None, end_time: datetime = None,
+                           timezone: str = 'UTC') -> Optional[str]:
+        """
+        Create a Google Calendar event.
+
+        Args:
+            title: Event title
+            description: Event description
+            start_time: Start datetime
+            end_time: End datetime
+            timezone: Timezone string
+
+        Returns:
+            Google Calendar event ID if successful, None otherwise
+        """
+        body = GoogleCalendarService._event_body(title, description, start_time, end_time, timezone)
+        try:
+            event = await self._request('POST', self._events_path, 'create_event', body)
+        except (CalendarAPIError, httpx.HTTPError, CalendarUnavailable) as error:
+            print(f'An error occurred: {error}')
+            return None
+        return event.get('id')
+
+    async def update_event(self, event_id: str, title: str = None,
+                           description: str = None, start_time: datetime = None,
+                           end_time: datetime = None, timezone: str = 'UTC', etag: str = None) -> bool:
+        """
+        Update a Google Calendar event with a single patch call.
+
+        Args:
+            event_id: Google Calendar event ID
+            title: New event title
+            description: New event description
+            start_time: New start datetime
+            end_time: New end datetime
+            timezone: Timezone string
+            etag: ETag of the version last synced; makes the patch conditional,
+                with a refetch on 412
+
+        Returns:
+            True if successful, False otherwise
+        """
+        body = GoogleCalendarService._patch_body(title, description, start_time, end_time, timezone)
+        try:
+            await self._conditional_patch(event_id, body, etag)
+        except (CalendarAPIError, httpx.HTTPError, CalendarUnavailable) as error:
+            print(f'An error occurred: {error}')
+            return False
+        return True
+
+    async def delete_event(self, event_id: str) -> bool:
+        """
+        Delete a Google Calendar event.
+
+        Args:
+            event_id: Google Calendar event ID
+
+        Returns:
+            True if successful, False otherwise
+        """
+        try:
+            await self._request('DELETE', f'{self._events_path}/{event_id}', 'delete_event')
+        except (CalendarAPIError, httpx.HTTPError, CalendarUnavailable) as error:
+            print(f'An error occurred: {error}')
+            return False
+        return True
+
+    async def get_event(self, event_id: str) -> Optional[Dict[str, Any]]:
+        """
+        Get a Google Calendar event.
+
+        Args:
+            event_id: Google Calendar event ID
+
+        Returns:
+            Event data if found, None otherwise
+        """
+        try:
+            return await self._request('GET', f'{self._events_path}/{event_id}', 'get_event')
+        except (CalendarAPIError, httpx.HTTPError, CalendarUnavailable) as error:
+            print(f'An error occurred: {error}')
+            return None
+
+    async def free_busy(self, time_min: datetime, time_max: datetime,
+                        calendar_ids: List[str] = None) -> Optional[List[Tuple[datetime, datetime]]]:
+        """
+        Get busy blocks from the freebusy API.
+
+        Args:
+            time_min: Start of the window (naive UTC)
+            time_max: End of the window (naive UTC)
+            calendar_ids: Calendars to query (default: self.calendar_id)
+
+        Returns:
+            (start, end) busy blocks as naive UTC datetimes if successful, None otherwise
+        """
+        body = {
+            'timeMin': time_min.isoformat() + 'Z',
+            'timeMax': time_max.isoformat() + 'Z',
+            'items': [{'id': calendar_id} for calendar_id in (calendar_ids or [self.calendar_id])],
+        }
+        try:
+            response = await self._request('POST', 'freeBusy', 'freebusy', body)
+        except (CalendarAPIError, httpx.HTTPError, CalendarUnavailable) as error:
+            print(f'An error occurred: {error}')
+            return None
+
+        busy = []
+        for calendar in response.get('calendars', {}).values():
+            for block in calendar.get('busy', []):
+                busy.append((_naive_utc(block['start']), _naive_utc(block['end'])))
+        return busy
+
+    async def _run_operation(self, index: int, operation: Dict[str, Any]) -> Dict[str, Any]:
+        op = operation.get('op')
+        event_id = operation.get('event_id')
+        try:
+            if op == 'create':
+                body = GoogleCalendarService._event_body(
+                    operation.get('title'), operation.get('description'),
+                    operation.get('start_time'), operation.get('end_time'),
+                    operation.get('timezone', 'UTC'), operation.get('properties'))
+                event = await self._request('POST', self._events_path, 'batch_create', body)
+            elif op == 'update':
+                body = GoogleCalendarService._patch_body(
+                    operation.get('title'), operation.get('description'),
+                    operation.get('start_time'), operation.get('end_time'),
+                    operation.get('timezone', 'UTC'), operation.get('properties'))
+                event = await self._conditional_patch(operation['event_id'], body, operation.get('etag'),
+                                                     'batch_update')
+            elif op == 'delete':
+                try:
+                    await self._request('DELETE', f"{self._events_path}/{operation['event_id']}",
+                                        'batch_delete')
+                except CalendarAPIError as error:
+                    # Already gone; deleting is idempotent.
+                    if error.status not in (404, 410):
+                        raise
+                event = None
+            else:
+                raise ValueError(f"Unknown batch operation '{op}'")
+        except (KeyError, ValueError) as error:
+            return {'ok': False, 'event_id': None, 'event': None, 'error': str(error), 'status': None}
+        except (CalendarAPIError, httpx.HTTPError, CalendarUnavailable) as error:
+            print(f'An error occurred in batch call {index}: {error}')
+            return {'ok': False, 'event_id': event_id, 'event': None, 'error': str(error),
+                    'status': getattr(error, 'status', None),
+                    'unavailable': isinstance(error, CalendarUnavailable)}
+        return {'ok': True, 'event_id': event.get('id') if event else event_id, 'event': event, 'error': None,
+                'status': None}
+
+    async def _conditional_patch(self, event_id: str, body: Dict[str, Any], etag: Optional[str],
+                                 operation: str = 'update_event') -> Dict[str, Any]:
+        """Patch If-Match `etag`; on 412 refetch and patch what still differs, like the sync service."""
+        path = f'{self._events_path}/{event_id}'
+        try:
+            return await self._request('PATCH', path, operation, body, etag)
+        except CalendarAPIError as error:
+            if not etag or error.status != 412:
+                raise
+        current = await self._request('GET', path, 'get_event')
+        body = GoogleCalendarService._unapplied_fields(current, body)
+        if not body:
+            return current
+        return await self._request('PATCH', path, operation, body, current.get('etag'))
+
+    async def batch_execute(self, operations: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """
+        Run many create/update/delete calls concurrently.
+
+        Same operations and results as GoogleCalendarService.batch_execute,
+        with the guard's background deadline; at most max_connections calls
+        are in flight at a time.
+
+        Args:
+            operations: One dict per call. 'op' is 'create', 'update' or 'delete';
+                the other keys are the keyword arguments of create_event,
+                update_event or delete_event ('event_id' for update/delete).
+
+        Returns:
+            One dict per operation, in the same order, with keys 'ok',
+            'event_id', 'event' (the returned resource, if any), 'error' and
+            'status' (the HTTP status of a failed call, if known)
+        """
+        with background_calls():
+            # The tasks copy the context here, so they see the background deadline.
+            return list(await asyncio.gather(*[
+                self._run_operation(index, operation) for index, operation in enumerate(operations)]))
+
+    async def aclose(self):
+        """Close the pooled connections."""
+        await self._client.aclose()
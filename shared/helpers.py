@@ -1,28 +1,105 @@
-from flask import request, abort
+import json
+from typing import Any, Dict, Optional
+from flask import request, abort, g
 from pydantic import ValidationError as PydanticValidationError
-from .schemas import ToolRequest, ToolCall
+from .schemas import ToolRequest, ToolCall, TOOL_ARGUMENT_ADAPTERS
+
+try:
+    import orjson
+    _loads = orjson.loads
+except ImportError:  # orjson is optional; the stdlib parser is a slower drop-in
+    _loads = json.loads
+
+def parse_tool_request(raw: bytes) -> ToolRequest:
+    """
+    Validates a raw request body against the ToolRequest schema in one pass,
+    without building an intermediate dict first.
+
+    Raises:
+        ValueError: If the body is not valid JSON or does not match the schema
+    """
+    if not raw:
+        raise ValueError("Invalid JSON payload.")
+    try:
+        return ToolRequest.model_validate_json(raw)
+    except PydanticValidationError as e:
+        raise ValueError(f"Invalid request format: {e.errors(include_url=False)}")
+
+def validate_arguments(tool_call: ToolCall) -> Dict[str, Any]:
+    """
+    Decodes string arguments and validates them against the tool's argument
+    schema, storing the result back on the tool call.
+
+    Raises:
+        ValueError: If the arguments are not valid JSON or fail validation
+    """
+    arguments = tool_call.function.arguments
+    if isinstance(arguments, str):
+        try:
+            arguments = _loads(arguments or '{}')
+        except ValueError as e:
+            raise ValueError(f"Invalid JSON in arguments: {e}")
+    if not isinstance(arguments, dict):
+        raise ValueError("Tool arguments must be a JSON object.")
+    adapter = TOOL_ARGUMENT_ADAPTERS.get(tool_call.function.name)
+    if adapter is not None:
+        try:
+            arguments = adapter.validate_python(arguments)
+        except PydanticValidationError as e:
+            raise ValueError(f"Invalid arguments for '{tool_call.function.name}': {e.errors(include_url=False)}")
+    tool_call.function.arguments = arguments
+    return arguments
+
+def caller_id(tool_request: ToolRequest) -> Optional[str]:
+    """The caller's phone number from the VAPI message, if it carries one."""
+    message = tool_request.message
+    customer = message.customer or (message.call.customer if message.call else None)
+    return customer.number if customer and customer.number else None
+
+def conversation_id(tool_request: ToolRequest) -> Optional[str]:
+    """The VAPI call the message belongs to, or else the caller's number."""
+    call = tool_request.message.call
+    return call.id if call and call.id else caller_id(tool_request)
+
+def _get_tool_request() -> ToolRequest:
+    """Validates the body of the current Flask request, once per request."""
+    if 'vapi_tool_request' not in g:
+        try:
+            g.vapi_tool_request = parse_tool_request(request.get_data())
+        except ValueError as e:
+            abort(400, description=str(e))
+    return g.vapi_tool_request
+
+def get_caller_id() -> Optional[str]:
+    """The caller's phone number for the current Flask request; see caller_id()."""
+    return caller_id(_get_tool_request())
+
+def get_conversation_id() -> Optional[str]:
+    """The conversation of the current Flask request; see conversation_id()."""
+    return conversation_id(_get_tool_request())
 
 def get_validated_tool_call(expected_function_name: str) -> ToolCall:
     """
     Validates the incoming JSON request against the ToolRequest schema
     and returns the specific tool call matching the expected function name.
     """
-    json_data = request.get_json()
-    if not json_data:
-        abort(400, description="Invalid JSON payload.")
-
-    try:
-        # Validate the entire request structure
-        tool_req = ToolRequest(**json_data)
-    except PydanticValidationError as e:
-        abort(400, description=f"Invalid request format: {e.errors()}")
+    tool_req = _get_tool_request()
 
     # Find the specific tool call we are looking for
     for tool_call in tool_req.message.toolCalls:
         if tool_call.function.name == expected_function_name:
-            # If arguments are a string, parse them into a dict
-            if isinstance(tool_call.function.arguments, str):
-                tool_call.function.arguments = request.json_loads(tool_call.function.arguments)
+            try:
+                validate_arguments(tool_call)
+            except ValueError as e:
+                abort(400, description=str(e))
             return tool_call
 
-    abort(400, description=f"Tool call with function name '{expected_function_name}' not found.")
\ No newline at end of file
+    abort(400, description=f"Tool call with function name '{expected_function_name}' not found.")
+
+def get_validated_tool_calls() -> list[ToolCall]:
+    """
+    Validates the incoming JSON request against the ToolRequest schema and
+    returns every tool call in the message. Arguments are left undecoded;
+    run validate_arguments() per call so an invalid call fails on its own.
+    """
+    return _get_tool_request().message.toolCalls
@@ -0,0 +1,197 @@
+"""
+Low-overhead latency instrumentation with Prometheus text exposition.
+
+Tool calls are timed per phase (parse, db, calendar, total). A PhaseTimer is
+bound to the running tool call through a context variable, so code deep in
+the call stack only needs `with phase('db'):` and does not have to pass the
+timer around. SQL statements are timed automatically through SQLAlchemy
+cursor events.
+
+Metrics are kept per process in plain dicts under a lock; recording one
+observation is a few dictionary operations, cheap enough to leave on in
+production.
+"""
+import time
+import bisect
+import threading
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Optional, Dict, Tuple, List
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+_registry: List['_Metric'] = []
+
+def _format_labels(names: Tuple[str, ...], values: Tuple[str, ...], extra: str = '') -> str:
+    pairs = [f'{name}="{value}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+class _Metric:
+    kind = ''
+
+    def __init__(self, name: str, documentation: str, labelnames: Tuple[str, ...] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        _registry.append(self)
+
+    def _key(self, labels: Dict[str, str]) -> Tuple[str, ...]:
+        return tuple(str(labels.get(name, '')) for name in self.labelnames)
+
+    def render(self) -> List[str]:
+        return [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} {self.kind}']
+
+class Counter(_Metric):
+    kind = 'counter'
+
+    def __init__(self, name: str, documentation: str, labelnames: Tuple[str, ...] = ()):
+        super().__init__(name, documentation, labelnames)
+        self._values: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, amount: float = 1.0, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def render(self) -> List[str]:
+        lines = super().render()
+        with self._lock:
+            for key, value in self._values.items():
+                lines.append(f'{self.name}{_format_labels(self.labelnames, key)} {value}')
+        return lines
+
+class Histogram(_Metric):
+    kind = 'histogram'
+
+    def __init__(self, name: str, documentation: str, labelnames: Tuple[str, ...] = (),
+                 buckets: Tuple[float, ...] = DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # labels -> [count per bucket (non-cumulative) ..., +Inf count, sum]
+        self._values: Dict[Tuple[str, ...], List[float]] = {}
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._values.get(key)
+            if series is None:
+                series = self._values[key] = [0] * (len(self.buckets) + 1) + [0.0]
+            series[index] += 1
+            series[-1] += value
+
+    def render(self) -> List[str]:
+        lines = super().render()
+        with self._lock:
+            snapshot = {key: list(series) for key, series in self._values.items()}
+        for key, series in snapshot.items():
+            cumulative = 0
+            for bound, count in zip(self.buckets, series):
+                cumulative += count
+                labels = _format_labels(self.labelnames, key, 'le="%s"' % bound)
+                lines.append(f'{self.name}_bucket{labels} {cumulative}')
+            cumulative += series[len(self.buckets)]
+            labels = _format_labels(self.labelnames, key, 'le="+Inf"')
+            lines.append(f'{self.name}_bucket{labels} {cumulative}')
+            lines.append(f'{self.name}_sum{_format_labels(self.labelnames, key)} {series[-1]}')
+            lines.append(f'{self.name}_count{_format_labels(self.labelnames, key)} {cumulative}')
+        return lines
+
+def render_metrics() -> str:
+    """All registered metrics in the Prometheus text exposition format (0.0.4)."""
+    lines = []
+    for metric in _registry:
+        lines.extend(metric.render())
+    return '\n'.join(lines) + '\n'
+
+PROMETHEUS_CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+# --- Metrics shared by the services ---
+
+TOOL_PHASE_SECONDS = Histogram(
+    'vapi_tool_phase_seconds', 'Time spent per tool call, by phase.', ('tool', 'phase'))
+CALENDAR_REQUEST_SECONDS = Histogram(
+    'vapi_calendar_request_seconds', 'Duration of Google Calendar API requests.', ('operation',))
+CALENDAR_ERRORS = Counter(
+    'vapi_calendar_errors_total', 'Google Calendar API calls that failed.', ('operation',))
+CALENDAR_RETRIES = Counter(
+    'vapi_calendar_retries_total', 'Google Calendar calls scheduled for another attempt.', ('operation',))
+CALENDAR_REJECTED = Counter(
+    'vapi_calendar_rejected_total', 'Google Calendar calls not sent (circuit open or out of quota).',
+    ('operation', 'reason'))
+TOOL_CALL_REPLAYS = Counter(
+    'vapi_tool_call_replays_total', 'Retried tool calls answered with their stored result.', ('tool',))
+
+# --- Per tool call phase timing ---
+
+_current_timer: ContextVar[Optional['PhaseTimer']] = ContextVar('vapi_phase_timer', default=None)
+
+class PhaseTimer:
+    """Accumulates phase durations (seconds) for one tool call or request."""
+
+    def __init__(self, tool: str):
+        self.tool = tool
+        self.phases: Dict[str, float] = {}
+        self.active = set()
+        self.started = time.perf_counter()
+
+    def add(self, name: str, seconds: float):
+        self.phases[name] = self.phases.get(name, 0.0) + seconds
+
+    def finish(self):
+        self.phases['total'] = time.perf_counter() - self.started
+        for name, seconds in self.phases.items():
+            TOOL_PHASE_SECONDS.observe(seconds, tool=self.tool, phase=name)
+
+@contextmanager
+def timed_tool(tool: str):
+    """Time a tool call; phases entered inside it are attributed to it."""
+    timer = PhaseTimer(tool)
+    token = _current_timer.set(timer)
+    try:
+        yield timer
+    finally:
+        _current_timer.reset(token)
+        timer.finish()
+
+@contextmanager
+def phase(name: str):
+    """
+    Attribute the enclosed time to a phase of the current tool call, if any.
+    Nested entries of the same phase are only counted once.
+    """
+    timer = _current_timer.get()
+    if timer is None or name in timer.active:
+        yield
+        return
+    timer.active.add(name)
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        timer.active.discard(name)
+        timer.add(name, time.perf_counter() - started)
+
+def server_timing(timer: PhaseTimer) -> str:
+    """Format a finished timer's phases as a Server-Timing header value (milliseconds)."""
+    return ', '.join(f'{name};dur={seconds * 1000:.2f}' for name, seconds in timer.phases.items())
+
+# Every SQL statement counts toward the 'db' phase of the current tool call.
+
+@event.listens_for(Engine, 'before_cursor_execute')
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if _current_timer.get() is not None:
+        conn.info['vapi_query_started'] = time.perf_counter()
+
+@event.listens_for(Engine, 'after_cursor_execute')
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    started = conn.info.pop('vapi_query_started', None)
+    timer = _current_timer.get()
+    if timer is not None and started is not None and 'db' not in timer.active:
+        timer.add('db', time.perf_counter() - started)
@@ -0,0 +1,355 @@
+# nl_datetime.py
+"""
+Spoken dates, times and durations for calendar entries.
+
+Callers say "next Tuesday at 3pm" rather than ISO 8601, and converting it
+costs the LLM tokens and latency, sometimes landing on the wrong day. This
+module resolves such expressions on the server, in the caller's IANA
+timezone and against an anchor (now, or the start of the event for its
+end). It understands:
+
+* ISO 8601 ('2026-03-04T15:00:00Z'); without an offset it is local time
+* offsets: 'now', 'in 2 hours', 'in half an hour', '3 days from now'
+* days: 'today', 'tomorrow', 'the day after tomorrow', weekdays ('friday',
+  'this friday', 'next tuesday'), dates ('march 5', '5th of march 2027',
+  '3/14', 'the 21st')
+* times: '3pm', '3:30 p.m.', '15:00', "at 3", "4 o'clock", 'noon',
+  'midnight', and 'morning', 'afternoon', 'evening', 'tonight', alone or
+  after an hour ('7 in the evening')
+* durations: 'for 45 minutes', '1.5 hours', 'an hour and a half', '1h30m'
+
+A day without a time is 9:00 and a time without a day is its next
+occurrence; an end time without a day is on the start's day instead. A bare or 'this' weekday is the next one from today on, while
+'next' skips today. A month and day without a year is the next such date.
+A bare hour from 1 to 7 without am/pm or a part of the day ('at 3') is in
+the afternoon; with minutes ('at 7:30') it is taken as written.
+
+The patterns are compiled at import. What the words resolve to is cached
+per (expression, anchor date, timezone), so only the comparison with the
+anchor's time of day runs for a repeated expression.
+"""
+import os
+import re
+from datetime import date, datetime, time, timedelta, timezone
+from functools import lru_cache
+from typing import Optional, Tuple, Union
+from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
+
+PARSE_CACHE_SIZE = int(os.getenv('VAPI_DATETIME_CACHE_SIZE', '4096'))
+
+# Time of a day named without one, and of the parts of the day
+DEFAULT_TIME = time(9, 0)
+# Longest duration or offset accepted
+MAX_DURATION = timedelta(days=3660)
+# How far in the past an event may start ('today at 3pm' said at 3:02)
+PAST_GRACE = timedelta(minutes=5)
+
+PERIOD_HOURS = {'morning': 9, 'afternoon': 15, 'evening': 18, 'night': 20, 'tonight': 20}
+
+_NUMBER_WORDS = {
+    'a': 1, 'an': 1, 'one': 1, 'two': 2, 'three': 3, 'four': 4, 'five': 5, 'six': 6, 'seven': 7,
+    'eight': 8, 'nine': 9, 'ten': 10, 'eleven': 11, 'twelve': 12, 'fifteen': 15, 'twenty': 20,
+    'thirty': 30, 'forty five': 45, 'forty-five': 45, 'forty': 40, 'sixty': 60, 'ninety': 90,
+    'a couple of': 2, 'a couple': 2, 'a few': 3,
+}
+_UNIT_SECONDS = {'m': 60, 'h': 3600, 'd': 86400, 'w': 604800}
+_MONTHS = ('jan', 'feb', 'mar', 'apr', 'may', 'jun', 'jul', 'aug', 'sep', 'oct', 'nov', 'dec')
+_WEEKDAYS = ('mon', 'tue', 'wed', 'thu', 'fri', 'sat', 'sun')
+
+# Digits may follow a unit directly ('1h30m'); words stand alone.
+_NUMBER = r'(?<![\d.])\d+(?:\.\d+)?|\b(?:' + '|'.join(
+    re.escape(word) for word in sorted(_NUMBER_WORDS, key=len, reverse=True)) + ')'
+_DURATION_PART_RE = re.compile(
+    rf'(?P<number>{_NUMBER})\s*(?P<unit>minutes?|mins?|m|hours?|hrs?|h|days?|d|weeks?|wks?|w)(?![a-z])'
+    r'(?P<half>\s+and\s+a\s+half)?')
+_DURATION_PHRASES = (
+    (re.compile(r'\bhalf\s+(?:an?\s+)?hour\b'), '30 minutes'),
+    (re.compile(r'\b(?:a\s+)?quarter\s+(?:of\s+an\s+)?hour\b'), '15 minutes'),
+)
+_OFFSET_RE = re.compile(r'^(?:in\s+(?P<ahead>.+)|(?P<later>.+?)\s+(?:from\s+now|later))$')
+_MINUTES_RE = re.compile(r'^\s*\d+(?:\.\d+)?\s*$')
+_TRAILING_DURATION_RE = re.compile(r'^(?P<when>.+?)\s+for\s+(?P<duration>.+)$', re.IGNORECASE)
+
+_MERIDIEM = r'a\.?m\.?|p\.?m\.?'
+_TIME_RE = re.compile(rf"""
+    \b(?P<hour>\d{{1,2}})(?::(?P<minute>\d{{2}}))?\s*(?P<meridiem>{_MERIDIEM})(?![a-z])
+  | \b(?P<hour24>\d{{1,2}}):(?P<minute24>\d{{2}})\b
+  | \b(?P<oclock>\d{{1,2}})\s*o'?clock\b
+  | \bat\s+(?P<bare>\d{{1,2}})\b(?!\s*(?:st|nd|rd|th|/|:|{_MERIDIEM}|o'?clock))
+  | \b(?P<named>noon|midday|midnight)\b
+""", re.VERBOSE)
+# An hour may lead 'in the <period>' ('7 in the evening', '11:30 in the morning').
+_PERIOD_RE = re.compile(r'''
+    (?:(?<![\d/:.])\b(?P<period_hour>\d{1,2})(?::(?P<period_minute>\d{2}))?\s+(?=in\s+the\s))?
+    \b(?P<phrase>(?:in\s+the\s+|this\s+|at\s+)?(?P<period>morning|afternoon|evening|night|tonight))\b
+''', re.VERBOSE)
+
+_MONTH = (r'jan(?:uary)?|feb(?:ruary)?|mar(?:ch)?|apr(?:il)?|may|june?|july?|aug(?:ust)?'
+          r'|sep(?:t(?:ember)?)?|oct(?:ober)?|nov(?:ember)?|dec(?:ember)?')
+_WEEKDAY = (r'mon(?:day)?|tue(?:s(?:day)?)?|wed(?:nesday)?|thu(?:r(?:s(?:day)?)?)?'
+            r'|fri(?:day)?|sat(?:urday)?|sun(?:day)?')
+_DATE_RE = re.compile(rf"""
+    \b(?P<relative>today|tomorrow|day\s+after\s+tomorrow|yesterday)\b
+  | \b(?:(?P<which>this|next|coming)\s+)?(?P<weekday>{_WEEKDAY})\b
+  | \b(?P<month>{_MONTH})\.?\s+(?:the\s+)?(?P<day>\d{{1,2}})(?:st|nd|rd|th)?\b(?:\s+(?P<year>\d{{4}})\b)?
+  | \b(?P<day_first>\d{{1,2}})(?:st|nd|rd|th)?\s+(?:of\s+)?(?P<month_after>{_MONTH})\b(?:\s+(?P<year_after>\d{{4}})\b)?
+  | \b(?P<numeric_month>\d{{1,2}})/(?P<numeric_day>\d{{1,2}})(?:/(?P<numeric_year>\d{{4}}|\d{{2}}))?\b
+  | \bthe\s+(?P<ordinal>\d{{1,2}})(?:st|nd|rd|th)\b
+""", re.VERBOSE)
+# A day of the month just before the period ('march 12 in the evening') is not its hour.
+_MONTH_BEFORE_RE = re.compile(rf'\b(?:{_MONTH})\.?\s+(?:the\s+)?$')
+_RELATIVE_DAYS = {'today': 0, 'tomorrow': 1, 'day after tomorrow': 2, 'yesterday': -1}
+_FILLER = {'at', 'on', 'the', 'of', 'from', 'until', 'till', 'to', 'around', 'about', 'by', 'and'}
+
+# What an expression resolves to for one anchor date: a local wall time (and
+# the step to add while it is not after the anchor), or an offset from the anchor.
+_Plan = Tuple[Optional[datetime], Optional[timedelta], Optional[timedelta]]
+
+def _normalize(expression: str) -> str:
+    return ' '.join(expression.lower().replace(',', ' ').split())
+
+@lru_cache(maxsize=64)
+def _zone(tz_name: str) -> ZoneInfo:
+    try:
+        return ZoneInfo(tz_name)
+    except (ZoneInfoNotFoundError, ValueError):
+        raise ValueError(f"Unknown timezone '{tz_name}'.")
+
+def parse_duration(expression: str) -> timedelta:
+    """
+    Parse a spoken duration such as 'for 45 minutes' or 'an hour and a half'.
+
+    Raises:
+        ValueError: If the expression is not a duration
+    """
+    seconds = _duration_seconds(expression)
+    if seconds is None:
+        raise ValueError(f"Cannot understand the duration '{expression}'.")
+    if seconds > MAX_DURATION.total_seconds():
+        raise ValueError(f"The duration '{expression}' is too long.")
+    return timedelta(seconds=seconds)
+
+@lru_cache(maxsize=PARSE_CACHE_SIZE)
+def _duration_seconds(expression: str) -> Optional[float]:
+    # None rather than an exception, so that non-durations are cached too:
+    # every event_to is tried as a duration first.
+    text = _normalize(expression)
+    for pattern, replacement in _DURATION_PHRASES:
+        text = pattern.sub(replacement, text)
+    seconds = 0.0
+    found = False
+    for match in _DURATION_PART_RE.finditer(text):
+        number = match.group('number')
+        amount = _NUMBER_WORDS.get(number) or float(number)
+        if match.group('half'):
+            amount += 0.5
+        seconds += amount * _UNIT_SECONDS[match.group('unit')[0]]
+        found = True
+    leftover = _DURATION_PART_RE.sub(' ', text).split()
+    if not found or any(word not in ('for', 'and') for word in leftover):
+        return None
+    return seconds
+
+def _time_of_day(match: re.Match, period: Optional[str]) -> time:
+    """The time a _TIME_RE match names; `period` ('evening', ...) settles an hour without am/pm."""
+    if match.group('named'):
+        return time(0, 0) if match.group('named') == 'midnight' else time(12, 0)
+    if match.group('meridiem'):
+        hour, minute = int(match.group('hour')), int(match.group('minute') or 0)
+        if not 1 <= hour <= 12:
+            raise ValueError(f"Invalid time '{match.group(0)}'.")
+        hour = hour % 12 + (12 if match.group('meridiem').startswith('p') else 0)
+    elif match.group('hour24'):
+        return _clock(match.group('hour24'), match.group('minute24'), period, match.group(0))
+    else:
+        return _clock(match.group('oclock') or match.group('bare'), None, period, match.group(0))
+    if hour > 23 or minute > 59:
+        raise ValueError(f"Invalid time '{match.group(0)}'.")
+    return time(hour, minute)
+
+def _clock(written_hour: str, written_minute: Optional[str], period: Optional[str], text: str) -> time:
+    """A time without am/pm: the period decides, else a bare hour from 1 to 7 is in the afternoon."""
+    hour, minute = int(written_hour), int(written_minute or 0)
+    if period in ('afternoon', 'evening', 'night', 'tonight') and hour < 12:
+        hour += 12
+    elif period is None and written_minute is None and 1 <= hour <= 7 and not written_hour.startswith('0'):
+        hour += 12
+    if hour > 23 or minute > 59:
+        raise ValueError(f"Invalid time '{text}'.")
+    return time(hour, minute)
+
+def _date(year: int, month: int, day: int) -> date:
+    try:
+        return date(year, month, day)
+    except ValueError:
+        raise ValueError(f"There is no date {year}-{month:02d}-{day:02d}.")
+
+def _day(match: re.Match, anchor_date: date) -> Tuple[date, Optional[timedelta]]:
+    """The day a _DATE_RE match names, and the step if it may already be past (a weekday that is today)."""
+    if match.group('relative'):
+        word = match.group('relative')
+        return anchor_date + timedelta(days=_RELATIVE_DAYS[word]), None
+    if match.group('weekday'):
+        days = (_WEEKDAYS.index(match.group('weekday')[:3]) - anchor_date.weekday()) % 7
+        if match.group('which') == 'next':
+            return anchor_date + timedelta(days=days or 7), None
+        return anchor_date + timedelta(days=days), timedelta(days=7) if days == 0 else None
+    if match.group('ordinal'):
+        day = int(match.group('ordinal'))
+        month, year = anchor_date.month, anchor_date.year
+        if day < anchor_date.day:
+            month, year = (1, year + 1) if month == 12 else (month + 1, year)
+        return _date(year, month, day), None
+    if match.group('numeric_month'):
+        month, day, year = match.group('numeric_month'), match.group('numeric_day'), match.group('numeric_year')
+        if year and len(year) == 2:
+            year = '20' + year
+    else:
+        month = _MONTHS.index((match.group('month') or match.group('month_after'))[:3]) + 1
+        day = match.group('day') or match.group('day_first')
+        year = match.group('year') or match.group('year_after')
+    if year:
+        return _date(int(year), int(month), int(day)), None
+    result = _date(anchor_date.year, int(month), int(day))
+    return (result.replace(year=result.year + 1) if result < anchor_date else result), None
+
+@lru_cache(maxsize=PARSE_CACHE_SIZE)
+def _plan(expression: str, anchor_date: date, tz_name: str) -> _Plan:
+    try:
+        parsed = datetime.fromisoformat(expression.replace('Z', '+00:00'))
+    except ValueError:
+        pass
+    else:
+        if parsed.tzinfo is not None:
+            parsed = parsed.astimezone(_zone(tz_name)).replace(tzinfo=None)
+        return parsed, None, None
+
+    text = _normalize(expression)
+    if text in ('now', 'right now', 'right away', 'immediately'):
+        return None, timedelta(0), None
+    offset = _OFFSET_RE.match(text)
+    if offset:
+        try:
+            return None, parse_duration(offset.group('ahead') or offset.group('later')), None
+        except ValueError:
+            pass  # 'in the morning' and the like are not offsets
+
+    period_match = _PERIOD_RE.search(text)
+    period = period_match.group('period') if period_match else None
+    at = None
+    if period_match:
+        start = period_match.start()
+        if period_match.group('period_hour') and not _MONTH_BEFORE_RE.search(text[:start]):
+            at = _clock(period_match.group('period_hour'), period_match.group('period_minute'), period,
+                        period_match.group(0))
+        else:
+            start = period_match.start('phrase')
+        text = text[:start] + ' ' + text[period_match.end():]
+    time_match = _TIME_RE.search(text) if at is None else None
+    if time_match:
+        at = _time_of_day(time_match, period)
+        text = text[:time_match.start()] + ' ' + text[time_match.end():]
+    elif period and at is None:
+        at = time(PERIOD_HOURS[period], 0)
+    date_match = _DATE_RE.search(text)
+    if date_match:
+        text = text[:date_match.start()] + ' ' + text[date_match.end():]
+    if any(word not in _FILLER for word in text.split()) or (at is None and date_match is None):
+        raise ValueError(f"Cannot understand the date/time '{expression}'; use ISO 8601 instead.")
+
+    if date_match is None:
+        # Today, or tomorrow once the time has passed ('tonight' stays today).
+        step = None if period == 'tonight' else timedelta(days=1)
+        return datetime.combine(anchor_date, at), None, step
+    day, step = _day(date_match, anchor_date)
+    return datetime.combine(day, at or DEFAULT_TIME), None, step
+
+def parse_datetime_expression(expression: str, tz_name: str = 'UTC',
+                              anchor: Optional[datetime] = None, roll_forward: bool = True) -> datetime:
+    """
+    Resolve a spoken or ISO 8601 date/time.
+
+    Args:
+        expression: What the caller said, e.g. 'next tuesday at 3pm'
+        tz_name: The caller's IANA timezone, e.g. 'America/New_York'
+        anchor: What relative expressions count from (default: now); naive means UTC
+        roll_forward: Move a time or weekday already past at the anchor to its
+            next occurrence; False keeps it on the anchor's day or week
+
+    Returns:
+        Aware datetime in `tz_name`
+
+    Raises:
+        ValueError: If the expression or the timezone is not understood
+    """
+    if not expression or not expression.strip():
+        raise ValueError('Empty date/time.')
+    zone = _zone(tz_name)
+    anchor = anchor or datetime.now(timezone.utc)
+    if anchor.tzinfo is None:
+        anchor = anchor.replace(tzinfo=timezone.utc)
+    local_anchor = anchor.astimezone(zone)
+    wall, offset, step = _plan(expression.strip(), local_anchor.date(), tz_name)
+    if offset is not None:
+        return (anchor + offset).astimezone(zone)
+    result = wall.replace(tzinfo=zone)
+    if roll_forward and step is not None and result <= local_anchor:
+        result = (wall + step).replace(tzinfo=zone)
+    return result
+
+def parse_event_times(event_from: Optional[str], event_to: Optional[str] = None,
+                      duration: Union[str, int, float, None] = None, tz_name: str = 'UTC',
+                      now: Optional[datetime] = None) -> Tuple[Optional[datetime], Optional[datetime]]:
+    """
+    Resolve the start and end of a calendar entry.
+
+    `event_to` may be a time ('4pm', on the start's day) or a duration
+    ('for 45 minutes'); `event_from` may end in a duration ('tomorrow at 3
+    for an hour'); `duration` is a duration or a number of minutes, which
+    may be written as a string ('90').
+
+    Returns:
+        (start, end) as aware datetimes in `tz_name`; None where not given
+
+    Raises:
+        ValueError: If an expression is not understood, the start is in the
+            past, or the end is not after the start
+    """
+    length = None
+    if isinstance(duration, str) and _MINUTES_RE.match(duration):
+        duration = float(duration)
+    if isinstance(duration, (int, float)) and not isinstance(duration, bool):
+        if not 0 < duration <= MAX_DURATION.total_seconds() / 60:
+            raise ValueError(f"The duration must be a positive number of minutes, at most {MAX_DURATION.days} days.")
+        length = timedelta(minutes=duration)
+    elif duration:
+        length = parse_duration(str(duration))
+
+    start = end = None
+    if event_from:
+        trailing = _TRAILING_DURATION_RE.match(event_from.strip())
+        if trailing:
+            try:
+                length = length or parse_duration(trailing.group('duration'))
+                event_from = trailing.group('when')
+            except ValueError:
+                pass
+        start = parse_datetime_expression(event_from, tz_name, now)
+        current = now or datetime.now(timezone.utc)
+        if current.tzinfo is None:
+            current = current.replace(tzinfo=timezone.utc)
+        if start < current - PAST_GRACE:
+            raise ValueError(f"event_from '{event_from}' is in the past.")
+    if event_to:
+        try:
+            length = parse_duration(event_to)
+        except ValueError:
+            # Not the next occurrence: an end before the start is an error, not a booking into tomorrow.
+            end = parse_datetime_expression(event_to, tz_name, start or now, roll_forward=start is None)
+    if end is None and length is not None:
+        if start is None:
+            raise ValueError('A duration needs an event_from to count from.')
+        end = start + length
+    if start is not None and end is not None and end <= start:
+        raise ValueError('event_to must be after event_from.')
+    return start, end
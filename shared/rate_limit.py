@@ -0,0 +1,354 @@
+"""
+Client-side quota, retries and circuit breaking for Google Calendar calls.
+
+A CalendarGuard wraps every API call (GoogleCalendarService._execute and
+AsyncGoogleCalendarService._request) with three things:
+
+* A token bucket sized to the project's Calendar quota. Its state lives in
+  a small file locked with flock, so every worker process on the host draws
+  from the same bucket; without fcntl (or with no path) it is per process.
+* Retries of 429, 5xx, `rateLimitExceeded` and connection errors, with
+  exponential backoff and full jitter. Retrying stops at a deadline short
+  enough for a voice turn; the outbox retries later anyway. Background
+  work (the outbox workers, reconcile) runs under background_calls() with a
+  longer deadline, so it waits for quota instead of failing.
+* A circuit breaker that fails fast once consecutive calls keep failing,
+  and lets a single probe through after a cool-down.
+
+Calls the guard refuses raise CalendarUnavailable.
+"""
+import os
+import time
+import asyncio
+import random
+import struct
+import tempfile
+import threading
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Optional, Callable, Any, Awaitable
+
+from .metrics import CALENDAR_RETRIES, CALENDAR_REJECTED
+
+try:
+    import fcntl
+except ImportError:  # Windows: the bucket is per process
+    fcntl = None
+
+_TRANSIENT_ERRORS = (OSError, TimeoutError)
+try:
+    import httplib2
+    _TRANSIENT_ERRORS += (httplib2.HttpLib2Error,)
+except ImportError:
+    pass
+try:
+    import httpx
+    _TRANSIENT_ERRORS += (httpx.TransportError,)
+except ImportError:
+    pass
+
+TRANSIENT_STATUSES = frozenset({429, 500, 502, 503, 504})
+
+class CalendarUnavailable(Exception):
+    """A Calendar call was not sent: the circuit is open or no quota was left before the deadline."""
+
+class CircuitOpenError(CalendarUnavailable):
+    pass
+
+class RateLimited(CalendarUnavailable):
+    pass
+
+# --- Error classification ---
+
+def error_status(error: Exception) -> Optional[int]:
+    """HTTP status of a googleapiclient HttpError or a CalendarAPIError, if any."""
+    resp = getattr(error, 'resp', None)
+    status = getattr(resp, 'status', None) if resp is not None else getattr(error, 'status', None)
+    try:
+        return int(status) if status is not None else None
+    except (TypeError, ValueError):
+        return None
+
+def _error_text(error: Exception) -> str:
+    content = getattr(error, 'content', None)
+    if isinstance(content, bytes):
+        return content.decode('utf-8', 'replace')
+    return str(content if content is not None else error)
+
+def is_transient(error: Exception, idempotent: bool = True) -> bool:
+    """
+    True for errors worth retrying: quota, server and connection errors.
+    A call that failed with 5xx or timed out may still have been applied,
+    so for non-idempotent calls (inserts, batches containing them) only
+    quota refusals count, which Google answers before doing anything.
+    """
+    status = error_status(error)
+    if status is not None:
+        if status == 429:
+            return True
+        if status in TRANSIENT_STATUSES:
+            return idempotent
+        # Google reports per-user quota as 403 with reason (user)rateLimitExceeded.
+        return status == 403 and 'ateLimitExceeded' in _error_text(error)
+    return idempotent and isinstance(error, _TRANSIENT_ERRORS)
+
+def retry_after(error: Exception) -> Optional[float]:
+    """Seconds from a Retry-After header, if the error carries one."""
+    value = getattr(error, 'retry_after', None)
+    resp = getattr(error, 'resp', None)
+    if value is None and hasattr(resp, 'get'):
+        value = resp.get('retry-after')
+    try:
+        return max(0.0, float(value)) if value is not None else None
+    except (TypeError, ValueError):
+        return None  # HTTP-date form; fall back to our own backoff
+
+# --- Token bucket ---
+
+_STATE = struct.Struct('dd')  # tokens, time of last refill (epoch seconds)
+
+class TokenBucket:
+    """
+    Token bucket refilled at `rate` tokens per second up to `capacity`.
+
+    With a `path`, the state is kept in that file and updated under an
+    exclusive flock, so all processes on the host share one bucket.
+    """
+
+    def __init__(self, rate: float, capacity: float, path: Optional[str] = None):
+        self.rate = rate
+        self.capacity = capacity
+        self.path = path if fcntl is not None else None
+        self._lock = threading.Lock()
+        self._state = (capacity, time.time())
+        self._fd = None
+        self._fd_pid = None
+
+    def _file(self) -> int:
+        # One descriptor per process: flock locks belong to the open file
+        # description, which a forked child would otherwise share.
+        if self._fd is None or self._fd_pid != os.getpid():
+            self._fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o600)
+            self._fd_pid = os.getpid()
+        return self._fd
+
+    def _take(self, state, cost: float, now: float):
+        tokens, updated = state
+        tokens = min(self.capacity, tokens + (now - updated) * self.rate)
+        # A call costing more than the whole bucket waits for a full one and
+        # leaves it in debt.
+        needed = min(cost, self.capacity)
+        if tokens >= needed:
+            return 0.0, (tokens - cost, now)
+        return (needed - tokens) / self.rate, (tokens, now)
+
+    def try_acquire(self, cost: float = 1.0) -> float:
+        """Take `cost` tokens if available; otherwise return the seconds to wait before trying again."""
+        with self._lock:
+            now = time.time()
+            if self.path is None:
+                wait, self._state = self._take(self._state, cost, now)
+                return wait
+            fd = self._file()
+            fcntl.flock(fd, fcntl.LOCK_EX)
+            try:
+                data = os.pread(fd, _STATE.size, 0)
+                state = _STATE.unpack(data) if len(data) == _STATE.size else (self.capacity, now)
+                wait, state = self._take(state, cost, now)
+                os.pwrite(fd, _STATE.pack(*state), 0)
+            finally:
+                fcntl.flock(fd, fcntl.LOCK_UN)
+            return wait
+
+# --- Circuit breaker ---
+
+class CircuitBreaker:
+    """
+    Opens after `failure_threshold` consecutive transient failures and
+    rejects calls for `reset_timeout` seconds, then lets one probe through:
+    success closes the circuit, failure opens it again.
+    """
+
+    def __init__(self, failure_threshold: int = 5, reset_timeout: float = 30.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = 'closed'
+        self._failures = 0
+        self._opened_at = 0.0
+        self._lock = threading.Lock()
+
+    def before_call(self):
+        """Raise CircuitOpenError unless a call may go out now."""
+        with self._lock:
+            if self.state == 'closed':
+                return
+            now = time.monotonic()
+            # Also covers a probe that never reported back.
+            if now - self._opened_at >= self.reset_timeout:
+                self.state = 'half_open'
+                self._opened_at = now
+                return
+            raise CircuitOpenError('Google Calendar circuit is open; not calling the API.')
+
+    def record_success(self):
+        with self._lock:
+            self.state = 'closed'
+            self._failures = 0
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            if self.state == 'half_open' or self._failures >= self.failure_threshold:
+                if self.state != 'open':
+                    print(f"Google Calendar circuit opened after {self._failures} failures.")
+                self.state = 'open'
+                self._opened_at = time.monotonic()
+
+# --- Guard ---
+
+_background: ContextVar[bool] = ContextVar('calendar_background', default=False)
+
+@contextmanager
+def background_calls():
+    """Give the enclosed guarded calls the background deadline instead of the voice-turn one."""
+    token = _background.set(True)
+    try:
+        yield
+    finally:
+        _background.reset(token)
+
+class CalendarGuard:
+    """Quota, retries and circuit breaker around Calendar API calls."""
+
+    def __init__(self, bucket: TokenBucket, breaker: CircuitBreaker, deadline: float = 2.5,
+                 max_attempts: int = 4, base_delay: float = 0.1, max_delay: float = 1.0,
+                 background_deadline: float = 60.0):
+        self.bucket = bucket
+        self.breaker = breaker
+        self.deadline = deadline
+        self.background_deadline = background_deadline
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+
+    def _deadline_at(self, deadline: Optional[float]) -> float:
+        if deadline is None:
+            deadline = self.background_deadline if _background.get() else self.deadline
+        return time.monotonic() + deadline
+
+    def _before_attempt(self, operation: str, cost: float, deadline_at: float) -> float:
+        """Check the breaker and take quota; returns seconds to wait for quota (0: go)."""
+        try:
+            self.breaker.before_call()
+        except CircuitOpenError:
+            CALENDAR_REJECTED.inc(operation=operation, reason='circuit_open')
+            raise
+        wait = self.bucket.try_acquire(cost)
+        if wait and time.monotonic() + wait > deadline_at:
+            CALENDAR_REJECTED.inc(operation=operation, reason='rate_limited')
+            raise RateLimited(f"No Google Calendar quota for '{operation}' before the deadline.")
+        return wait
+
+    def _after_failure(self, error: Exception, operation: str, attempt: int, deadline_at: float,
+                       idempotent: bool) -> float:
+        """Record a failed attempt; returns the backoff delay, or re-raises if it should not be retried."""
+        if not is_transient(error):
+            # The API answered; Google itself is fine.
+            self.breaker.record_success()
+            raise error
+        self.breaker.record_failure()
+        if not is_transient(error, idempotent):
+            raise error
+        delay = retry_after(error)
+        if delay is None:
+            delay = random.uniform(0, min(self.max_delay, self.base_delay * 2 ** (attempt - 1)))
+        if attempt >= self.max_attempts or time.monotonic() + delay > deadline_at:
+            raise error
+        CALENDAR_RETRIES.inc(operation=operation)
+        return delay
+
+    def call(self, fn: Callable[[], Any], operation: str, cost: float = 1.0,
+             deadline: Optional[float] = None, idempotent: bool = True) -> Any:
+        """
+        Run `fn` (one API call) under the guard.
+
+        Args:
+            fn: Sends the request; raises on failure
+            operation: Label for metrics
+            cost: Quota tokens the call uses (the number of calls in a batch)
+            deadline: Seconds to keep waiting and retrying (default: self.deadline,
+                or self.background_deadline under background_calls())
+            idempotent: False for inserts, which are not retried after a
+                connection or server error since they may have been applied
+
+        Raises:
+            CalendarUnavailable: If the circuit is open or no quota came up in time
+            Exception: The last error from `fn` if it was not transient or retries ran out
+        """
+        deadline_at = self._deadline_at(deadline)
+        attempt = 0
+        while True:
+            wait = self._before_attempt(operation, cost, deadline_at)
+            if wait:
+                time.sleep(wait)
+                continue
+            attempt += 1
+            try:
+                result = fn()
+            except Exception as error:
+                time.sleep(self._after_failure(error, operation, attempt, deadline_at, idempotent))
+                continue
+            self.breaker.record_success()
+            return result
+
+    async def acall(self, fn: Callable[[], Awaitable[Any]], operation: str, cost: float = 1.0,
+                    deadline: Optional[float] = None, idempotent: bool = True) -> Any:
+        """call() for a coroutine function; waits without blocking the event loop."""
+        deadline_at = self._deadline_at(deadline)
+        attempt = 0
+        while True:
+            wait = self._before_attempt(operation, cost, deadline_at)
+            if wait:
+                await asyncio.sleep(wait)
+                continue
+            attempt += 1
+            try:
+                result = await fn()
+            except Exception as error:
+                await asyncio.sleep(self._after_failure(error, operation, attempt, deadline_at, idempotent))
+                continue
+            self.breaker.record_success()
+            return result
+
+_guard = None
+_guard_lock = threading.Lock()
+
+def get_calendar_guard() -> CalendarGuard:
+    """
+    Get or create the process-wide guard.
+
+    Configured by VAPI_CALENDAR_QPS (default 10, i.e. Google's default 600
+    queries per minute per user), VAPI_CALENDAR_BURST (20),
+    VAPI_CALENDAR_RATE_FILE (bucket state shared by the host's processes;
+    empty for a per-process bucket), VAPI_CALENDAR_DEADLINE (2.5 seconds),
+    VAPI_CALENDAR_BACKGROUND_DEADLINE (60 seconds, for background_calls()),
+    VAPI_CALENDAR_MAX_ATTEMPTS (4), VAPI_CALENDAR_BREAKER_FAILURES (5) and
+    VAPI_CALENDAR_BREAKER_RESET (30 seconds).
+    """
+    global _guard
+    if _guard is None:
+        with _guard_lock:
+            if _guard is None:
+                path = os.getenv('VAPI_CALENDAR_RATE_FILE',
+                                 os.path.join(tempfile.gettempdir(), 'vapi_calendar_rate.bucket'))
+                bucket = TokenBucket(float(os.getenv('VAPI_CALENDAR_QPS', '10')),
+                                     float(os.getenv('VAPI_CALENDAR_BURST', '20')),
+                                     path or None)
+                breaker = CircuitBreaker(int(os.getenv('VAPI_CALENDAR_BREAKER_FAILURES', '5')),
+                                         float(os.getenv('VAPI_CALENDAR_BREAKER_RESET', '30')))
+                _guard = CalendarGuard(bucket, breaker,
+                                       deadline=float(os.getenv('VAPI_CALENDAR_DEADLINE', '2.5')),
+                                       max_attempts=int(os.getenv('VAPI_CALENDAR_MAX_ATTEMPTS', '4')),
+                                       background_deadline=float(
+                                           os.getenv('VAPI_CALENDAR_BACKGROUND_DEADLINE', '60')))
+    return _guard
@@ -1,6 +1,7 @@
 import datetime as dt
-from typing import Union, Dict, Any
-from pydantic import BaseModel, ValidationError as PydanticValidationError
+from typing import Union, Dict, Any, Optional
+from typing_extensions import TypedDict
+from pydantic import BaseModel, TypeAdapter, ValidationError as PydanticValidationError
 
 # --- Common Schemas for Tool Calling ---
 
@@ -12,13 +13,113 @@ class ToolCall(BaseModel):
     id: str
     function: ToolCallFunction
 
+class Customer(BaseModel):
+    number: Optional[str] = None
+
+class Call(BaseModel):
+    id: Optional[str] = None
+    customer: Optional[Customer] = None
+
 class Message(BaseModel):
     toolCalls: list[ToolCall]
+    # Who is calling; VAPI sends both, depending on the call type.
+    call: Optional[Call] = None
+    customer: Optional[Customer] = None
 
 class ToolRequest(BaseModel):
     """A generic request model for any tool-calling service."""
     message: Message
 
+# --- Tool Argument Schemas ---
+# TypedDicts rather than models: validation coerces and checks the values in
+# pydantic-core but still hands the handlers a plain dict. Unknown keys are
+# dropped and every key is optional; handlers apply their own defaults.
+
+class PageArgs(TypedDict, total=False):
+    after_id: Optional[int]
+    limit: Optional[int]
+    fields: Union[list[str], str, None]
+
+class IdArgs(TypedDict, total=False):
+    id: Optional[int]
+    title: Optional[str]  # Spoken name, resolved to an id when `id` is missing
+
+class CreateTodoArgs(TypedDict, total=False):
+    title: str
+    description: Optional[str]
+
+class GetTodosArgs(PageArgs, total=False):
+    completed: Optional[bool]
+
+class AddReminderArgs(TypedDict, total=False):
+    reminder_text: str
+    importance: str
+
+class GetRemindersArgs(PageArgs, total=False):
+    importance: Optional[str]
+
+class AddCalendarEntryArgs(TypedDict, total=False):
+    title: str
+    description: Optional[str]
+    event_from: Optional[str]
+    event_to: Optional[str]
+    duration: Union[int, str, None]  # Minutes ('90' too), or spoken ('45 minutes')
+    timezone: Optional[str]  # IANA name for spoken and offset-less times
+    check_conflicts: Optional[bool]
+
+# 'from' is a keyword, hence the functional syntax.
+GetCalendarEntriesArgs = TypedDict('GetCalendarEntriesArgs', {
+    'after_id': Optional[int],
+    'limit': Optional[int],
+    'fields': Union[list[str], str, None],
+    'from': Optional[str],
+    'to': Optional[str],
+}, total=False)
+
+class CheckConflictsArgs(TypedDict, total=False):
+    event_from: Optional[str]
+    event_to: Optional[str]
+    include_google: Optional[bool]
+
+FindFreeSlotsArgs = TypedDict('FindFreeSlotsArgs', {
+    'from': Optional[str],
+    'to': Optional[str],
+    'duration_minutes': Optional[int],
+    'limit': Optional[int],
+    'include_google': Optional[bool],
+}, total=False)
+
+# Bulk variants: a list of the single-item arguments, or of IDs.
+
+class CreateTodosArgs(TypedDict, total=False):
+    todos: list[CreateTodoArgs]
+
+class IdsArgs(TypedDict, total=False):
+    ids: list[int]
+
+class AddCalendarEntriesArgs(TypedDict, total=False):
+    entries: list[AddCalendarEntryArgs]
+
+# Built once at import time; function name -> argument validator.
+TOOL_ARGUMENT_ADAPTERS: Dict[str, TypeAdapter] = {
+    'createTodo': TypeAdapter(CreateTodoArgs),
+    'getTodos': TypeAdapter(GetTodosArgs),
+    'completeTodo': TypeAdapter(IdArgs),
+    'deleteTodo': TypeAdapter(IdArgs),
+    'addReminder': TypeAdapter(AddReminderArgs),
+    'getReminders': TypeAdapter(GetRemindersArgs),
+    'deleteReminder': TypeAdapter(IdArgs),
+    'addCalendarEntry': TypeAdapter(AddCalendarEntryArgs),
+    'getCalendarEntries': TypeAdapter(GetCalendarEntriesArgs),
+    'deleteCalendarEntry': TypeAdapter(IdArgs),
+    'createTodos': TypeAdapter(CreateTodosArgs),
+    'completeTodos': TypeAdapter(IdsArgs),
+    'deleteReminders': TypeAdapter(IdsArgs),
+    'addCalendarEntries': TypeAdapter(AddCalendarEntriesArgs),
+    'checkConflicts': TypeAdapter(CheckConflictsArgs),
+    'findFreeSlots': TypeAdapter(FindFreeSlotsArgs),
+}
+
 # --- Common Response Schemas ---
 
 class TodoResponse(BaseModel):
@@ -0,0 +1,490 @@
+# asgi.py
+"""
+Async (ASGI) variant of the VAPI Todo service.
+
+Serves the ten original tool routes and the /tools dispatch endpoint under
+/vapi_project with the same request and response payloads as the Flask
+blueprint, on Starlette with async SQLAlchemy. A tool call waiting on the
+database no longer holds a thread, so one process can keep many slow calls
+in flight.
+
+Both services share the tables, the transactional outbox, the read cache
+and the request schemas, and can run side by side against one database.
+The outbox is drained by asyncio tasks calling the Calendar REST API
+through AsyncGoogleCalendarService.
+
+Run it with any ASGI server:
+
+    uvicorn 'vapi_todo.asgi:create_asgi_app' --factory
+
+Spoken titles (`title` instead of `id`) and the bulk and availability tools
+are only served by the Flask blueprint, and so are read replicas and
+per-user calendars: this
+service's drainer only sends jobs for the deployment's own calendar and
+leaves the jobs of connected users to the Flask workers.
+"""
+import os
+import json
+import asyncio
+from contextlib import asynccontextmanager
+from datetime import date, datetime
+from typing import Optional, Dict, Any, List
+
+from sqlalchemy import select, update
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import create_async_engine, AsyncEngine
+from starlette.applications import Starlette
+from starlette.requests import Request
+from starlette.responses import JSONResponse, PlainTextResponse, Response
+from starlette.routing import Mount, Route
+from werkzeug.http import http_date
+
+from .models import VapiTodo, VapiReminder, VapiCalendarEvent, VapiCalendarSyncJob
+from .calendar_sync import (
+    sync_job_values, todo_event_fields, reminder_event_fields, calendar_event_fields,
+    candidate_jobs_statement, pick_ready_jobs, claim_statement, plan_batch,
+    record_sync_statements, sync_state_statements, finish_values, batch_error,
+)
+from .queries import parse_page_args, parse_bool, parse_datetime, parse_entry_times, page_statement, page_result
+from .availability import overlap_filters
+from .idempotency import AsyncToolCallResults, ToolCallInProgress
+from . import repository
+from shared.cache import get_read_cache
+from shared.google_calendar_async import AsyncGoogleCalendarService
+from shared.helpers import parse_tool_request, validate_arguments
+from shared.metrics import timed_tool, phase, server_timing, render_metrics, PROMETHEUS_CONTENT_TYPE
+from shared.rate_limit import CalendarUnavailable
+from shared.schemas import ToolCall, TodoResponse, ReminderResponse, CalendarEventResponse
+
+# Synchronous driver -> its asyncio counterpart.
+ASYNC_DRIVERS = {
+    'postgresql': 'postgresql+asyncpg',
+    'postgresql+psycopg2': 'postgresql+asyncpg',
+    'sqlite': 'sqlite+aiosqlite',
+    'sqlite+pysqlite': 'sqlite+aiosqlite',
+    'mysql': 'mysql+aiomysql',
+    'mysql+pymysql': 'mysql+aiomysql',
+}
+
+def async_database_url(url: str) -> str:
+    """Swap a synchronous database URL's driver for the asyncio one."""
+    parsed = make_url(url)
+    driver = ASYNC_DRIVERS.get(parsed.drivername)
+    return parsed.set(drivername=driver).render_as_string(hide_password=False) if driver else url
+
+class ToolError(Exception):
+    """Bad input or a missing row; the async counterpart of abort()."""
+
+    def __init__(self, status: int, description: str):
+        super().__init__(description)
+        self.status = status
+        self.description = description
+
+def _json_default(value):
+    # Dates are serialized the way Flask's JSON provider does it.
+    if isinstance(value, date):
+        return http_date(value)
+    raise TypeError(f'Object of type {type(value).__name__} is not JSON serializable')
+
+class FlaskCompatibleJSONResponse(JSONResponse):
+    """Renders JSON exactly like Flask's jsonify(), so both services send the same bytes."""
+
+    def render(self, content: Any) -> bytes:
+        return (json.dumps(content, default=_json_default, ensure_ascii=True, sort_keys=True,
+                           separators=(',', ':')) + '\n').encode('utf-8')
+
+def _required_id(args: Dict[str, Any], label: str):
+    if not args.get('id'):
+        raise ToolError(400, f'Missing {label} ID in arguments.')
+    return args['id']
+
+class AsyncVapiTodoService:
+    """Tool handlers on an async engine, plus the asyncio tasks draining the outbox."""
+
+    def __init__(self, engine: AsyncEngine, calendar_service: AsyncGoogleCalendarService = None,
+                 sync_workers: int = None, poll_interval: float = 1.0, batch_size: int = 50):
+        self.engine = engine
+        self.calendar_service = calendar_service
+        self.sync_workers = int(os.getenv('VAPI_CALENDAR_SYNC_WORKERS', '4')) if sync_workers is None else sync_workers
+        self.poll_interval = poll_interval
+        self.batch_size = batch_size
+        self._wakeup: Optional[asyncio.Event] = None
+        self._tasks: List[asyncio.Task] = []
+        self.tool_call_results = AsyncToolCallResults(engine)
+        # VAPI function name -> (handler, cache entity it writes or None)
+        self.handlers = {
+            'createTodo': (self.create_todo, 'todos'),
+            'getTodos': (self.get_todos, None),
+            'completeTodo': (self.complete_todo, 'todos'),
+            'deleteTodo': (self.delete_todo, 'todos'),
+            'addReminder': (self.add_reminder, 'reminders'),
+            'getReminders': (self.get_reminders, None),
+            'deleteReminder': (self.delete_reminder, 'reminders'),
+            'addCalendarEntry': (self.add_calendar_entry, 'calendar_events'),
+            'getCalendarEntries': (self.get_calendar_entries, None),
+            'deleteCalendarEntry': (self.delete_calendar_entry, 'calendar_events'),
+        }
+
+    # --- Calls ---
+
+    @asynccontextmanager
+    async def _transaction(self):
+        async with self.engine.connect() as conn:
+            yield conn
+            with phase('db'):
+                await conn.commit()
+
+    async def call(self, name: str, args: Dict[str, Any], tool_call_id: Optional[str] = None) -> Any:
+        """
+        Run a tool handler; a write is committed before its cache bump and
+        outbox wake-up, and runs at most once per `tool_call_id` (see idempotency.py).
+        A retry that finds the first attempt still running is refused with 409.
+        """
+        handler, entity = self.handlers[name]
+        if entity is None:
+            return await handler(None, args)
+        if tool_call_id is None:
+            return await self._write(handler, entity, args)
+        try:
+            return await self.tool_call_results.run(
+                tool_call_id, name, lambda store: self._write(handler, entity, args, store))
+        except ToolCallInProgress as e:
+            raise ToolError(409, str(e))
+
+    async def _write(self, handler, entity: str, args: Dict[str, Any], store=None) -> Any:
+        # `store` records the tool call's result in the write's own transaction.
+        async with self._transaction() as conn:
+            result = await handler(conn, args)
+            if store is not None:
+                await store(conn, result)
+        await get_read_cache().bump_async(entity)
+        if self._wakeup is not None:
+            self._wakeup.set()
+        return result
+
+    async def _enqueue(self, conn, entity_type: str, entity_id: int, operation: str,
+                       fields: Optional[Dict[str, Any]] = None, google_calendar_event_id: Optional[str] = None,
+                       user_id: Optional[str] = None):
+        await conn.execute(VapiCalendarSyncJob.__table__.insert(), [
+            sync_job_values(entity_type, entity_id, operation, fields, google_calendar_event_id, user_id)])
+
+    async def _page(self, model, page: Dict[str, Any], filters: List):
+        async with self.engine.connect() as conn:
+            rows = (await conn.execute(page_statement(
+                model, page['fields'], filters, page['after_id'], page['limit']))).all()
+        return page_result(rows, page['limit'], page['paged'])
+
+    # --- Todos ---
+
+    async def create_todo(self, conn, args: Dict[str, Any]):
+        todo = (await conn.execute(repository.insert_statement(VapiTodo), [{
+            'title': args.get('title', ''), 'description': args.get('description', ''),
+            'completed': False}])).one()
+        await self._enqueue(conn, 'todo', todo.id, 'create', todo_event_fields(todo))
+        return 'success'
+
+    async def get_todos(self, conn, args: Dict[str, Any]):
+        try:
+            page = parse_page_args(args, TodoResponse)
+            completed = parse_bool(args.get('completed'))
+        except ValueError as e:
+            raise ToolError(400, str(e))
+
+        filters = [VapiTodo.completed == completed] if completed is not None else []
+        return await get_read_cache().get_or_load_async(
+            'todos', {'tool': 'getTodos', 'completed': completed, **page},
+            lambda: self._page(VapiTodo, page, filters))
+
+    async def complete_todo(self, conn, args: Dict[str, Any]):
+        todo_id = _required_id(args, 'To-Do')
+        todo = (await conn.execute(
+            repository.update_statement(VapiTodo, [todo_id], {'completed': True}))).first()
+        if not todo:
+            raise ToolError(404, 'Todo not found.')
+        await self._enqueue(conn, 'todo', todo.id, 'update', todo_event_fields(todo),
+                            todo.google_calendar_event_id, todo.calendar_user_id)
+        return 'success'
+
+    async def delete_todo(self, conn, args: Dict[str, Any]):
+        todo_id = _required_id(args, 'To-Do')
+        todo = (await conn.execute(repository.delete_statement(VapiTodo, [todo_id]))).first()
+        if not todo:
+            raise ToolError(404, 'Todo not found.')
+        await self._enqueue(conn, 'todo', todo.id, 'delete',
+                            google_calendar_event_id=todo.google_calendar_event_id,
+                            user_id=todo.calendar_user_id)
+        return 'success'
+
+    # --- Reminders ---
+
+    async def add_reminder(self, conn, args: Dict[str, Any]):
+        reminder = (await conn.execute(repository.insert_statement(VapiReminder), [{
+            'reminder_text': args.get('reminder_text', ''),
+            'importance': args.get('importance', '')}])).one()
+        await self._enqueue(conn, 'reminder', reminder.id, 'create', reminder_event_fields(reminder))
+        return 'success'
+
+    async def get_reminders(self, conn, args: Dict[str, Any]):
+        try:
+            page = parse_page_args(args, ReminderResponse)
+        except ValueError as e:
+            raise ToolError(400, str(e))
+
+        importance = args.get('importance')
+        filters = [VapiReminder.importance == importance] if importance else []
+        return await get_read_cache().get_or_load_async(
+            'reminders', {'tool': 'getReminders', 'importance': importance, **page},
+            lambda: self._page(VapiReminder, page, filters))
+
+    async def delete_reminder(self, conn, args: Dict[str, Any]):
+        reminder_id = _required_id(args, 'Reminder')
+        reminder = (await conn.execute(repository.delete_statement(VapiReminder, [reminder_id]))).first()
+        if not reminder:
+            raise ToolError(404, 'Reminder not found.')
+        await self._enqueue(conn, 'reminder', reminder.id, 'delete',
+                            google_calendar_event_id=reminder.google_calendar_event_id,
+                            user_id=reminder.calendar_user_id)
+        return 'success'
+
+    # --- Calendar entries ---
+
+    async def add_calendar_entry(self, conn, args: Dict[str, Any]):
+        try:
+            start_time, end_time = parse_entry_times(args.get('event_from'), args.get('event_to'),
+                                                     args.get('duration'), args.get('timezone'))
+        except ValueError as e:
+            raise ToolError(400, str(e))
+        event = (await conn.execute(repository.insert_statement(VapiCalendarEvent), [{
+            'title': args.get('title', ''), 'description': args.get('description', ''),
+            'event_from': start_time, 'event_to': end_time}])).one()
+        await self._enqueue(conn, 'calendar_event', event.id, 'create', calendar_event_fields(event))
+        return 'success'
+
+    async def get_calendar_entries(self, conn, args: Dict[str, Any]):
+        try:
+            page = parse_page_args(args, CalendarEventResponse)
+            window_from = parse_datetime(args.get('from'))
+            window_to = parse_datetime(args.get('to'))
+        except ValueError as e:
+            raise ToolError(400, str(e))
+
+        # Events overlapping the [from, to) window
+        filters = []
+        if window_from or window_to:
+            filters = overlap_filters(window_from, window_to, self.engine.dialect.name)
+        return await get_read_cache().get_or_load_async(
+            'calendar_events', {'tool': 'getCalendarEntries', 'from': window_from, 'to': window_to, **page},
+            lambda: self._page(VapiCalendarEvent, page, filters))
+
+    async def delete_calendar_entry(self, conn, args: Dict[str, Any]):
+        event_id = _required_id(args, 'Calendar Event')
+        event = (await conn.execute(repository.delete_statement(VapiCalendarEvent, [event_id]))).first()
+        if not event:
+            raise ToolError(404, 'Calendar event not found.')
+        await self._enqueue(conn, 'calendar_event', event.id, 'delete',
+                            google_calendar_event_id=event.google_calendar_event_id,
+                            user_id=event.calendar_user_id)
+        return 'success'
+
+    # --- Outbox draining ---
+
+    async def drain_calendar_outbox(self, partition: int = 0, partitions: int = 1, limit: int = 50) -> int:
+        """
+        Process one round of ready outbox jobs, with the same claiming and
+        retry rules as calendar_sync.drain_calendar_outbox. Only jobs for
+        the deployment's calendar are taken; see the module docstring.
+
+        Returns:
+            Number of jobs that were claimed and attempted
+        """
+        jobs_table = VapiCalendarSyncJob.__table__
+        async with self.engine.connect() as conn:
+            now = datetime.utcnow()
+            candidates = (await conn.execute(candidate_jobs_statement(
+                partition, partitions, limit, now, default_calendar_only=True))).all()
+            jobs = pick_ready_jobs(candidates, now, limit)
+            if not jobs:
+                return 0
+            claimed_ids = (await conn.execute(
+                claim_statement([job.id for job in jobs], datetime.utcnow()))).scalars().all()
+            await conn.commit()
+            if not claimed_ids:
+                return 0
+            jobs = (await conn.execute(
+                select(jobs_table).where(jobs_table.c.id.in_(claimed_ids)).order_by(jobs_table.c.id))).all()
+
+            states = {}
+            for entity_type, statement in sync_state_statements(jobs):
+                for row in await conn.execute(statement):
+                    states[(entity_type, row.id)] = row
+            sendable, operations, settled = plan_batch(jobs, states)
+            if operations:
+                if self.calendar_service is None:
+                    self.calendar_service = AsyncGoogleCalendarService()
+                try:
+                    results = await self.calendar_service.batch_execute(operations)
+                except Exception as e:
+                    results = [{'ok': False, 'error': str(e),
+                                'unavailable': isinstance(e, CalendarUnavailable)}] * len(operations)
+                for job, result in zip(sendable, results):
+                    if result['ok'] and job.operation in ('create', 'update'):
+                        etag = (result.get('event') or {}).get('etag')
+                        for statement in record_sync_statements(job, result['event_id'], etag):
+                            await conn.execute(statement)
+                    settled.append((job, batch_error(result)))
+
+            for job, error in settled:
+                await conn.execute(
+                    update(jobs_table).where(jobs_table.c.id == job.id).values(**finish_values(job, error)))
+            await conn.commit()
+            return len(jobs)
+
+    async def _drain_forever(self, index: int):
+        while True:
+            processed = 0
+            try:
+                processed = await self.drain_calendar_outbox(index, self.sync_workers, self.batch_size)
+            except Exception as e:
+                print(f"Calendar sync task {index} failed: {e}")
+            if processed == 0:
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), self.poll_interval)
+                except asyncio.TimeoutError:
+                    pass
+                self._wakeup.clear()
+
+    def start(self):
+        """Start one outbox draining task per partition (VAPI_CALENDAR_SYNC_WORKERS; 0 disables)."""
+        self._wakeup = asyncio.Event()
+        for index in range(self.sync_workers):
+            self._tasks.append(asyncio.create_task(self._drain_forever(index), name=f'calendar-sync-{index}'))
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        if self.calendar_service is not None:
+            await self.calendar_service.aclose()
+        await self.engine.dispose()
+
+# --- HTTP layer ---
+
+# Route path -> VAPI function name, as in routes.py
+TOOL_ROUTES = {
+    'create_todo': 'createTodo',
+    'get_todos': 'getTodos',
+    'complete_todo': 'completeTodo',
+    'delete_todo': 'deleteTodo',
+    'add_reminder': 'addReminder',
+    'get_reminders': 'getReminders',
+    'delete_reminder': 'deleteReminder',
+    'add_calendar_entry': 'addCalendarEntry',
+    'get_calendar_entries': 'getCalendarEntries',
+    'delete_calendar_entry': 'deleteCalendarEntry',
+}
+
+def _validated_tool_call(body: bytes, function_name: str) -> ToolCall:
+    """helpers.get_validated_tool_call() for a request body, raising ToolError."""
+    try:
+        tool_request = parse_tool_request(body)
+    except ValueError as e:
+        raise ToolError(400, str(e))
+    for tool_call in tool_request.message.toolCalls:
+        if tool_call.function.name == function_name:
+            try:
+                validate_arguments(tool_call)
+            except ValueError as e:
+                raise ToolError(400, str(e))
+            return tool_call
+    raise ToolError(400, f"Tool call with function name '{function_name}' not found.")
+
+def _tool_endpoint(function_name: str):
+    async def endpoint(request: Request) -> Response:
+        """Serve one tool through its dedicated route; errors become HTTP errors as in routes.py."""
+        service: AsyncVapiTodoService = request.app.state.vapi
+        error = None
+        with timed_tool(function_name) as timer:
+            try:
+                with phase('parse'):
+                    tool_call = _validated_tool_call(await request.body(), function_name)
+                result = await service.call(function_name, tool_call.function.arguments, tool_call.id)
+            except ToolError as e:
+                error = e
+        headers = {'Server-Timing': server_timing(timer)}
+        if error is not None:
+            return PlainTextResponse(error.description, status_code=error.status, headers=headers)
+        return FlaskCompatibleJSONResponse(
+            {'results': [{'toolCallId': tool_call.id, 'result': result}]}, headers=headers)
+    return endpoint
+
+async def _run_tool_call(service: AsyncVapiTodoService, tool_call: ToolCall) -> Dict[str, Any]:
+    """One /tools entry; failures go into its `error` field like tools.run_tool_call."""
+    if tool_call.function.name not in service.handlers:
+        return {'toolCallId': tool_call.id, 'error': f"Unknown tool '{tool_call.function.name}'."}
+    with timed_tool(tool_call.function.name):
+        try:
+            with phase('parse'):
+                args = validate_arguments(tool_call)
+        except ValueError as e:
+            return {'toolCallId': tool_call.id, 'error': str(e)}
+        try:
+            return {'toolCallId': tool_call.id, 'result': await service.call(tool_call.function.name, args, tool_call.id)}
+        except ToolError as e:
+            return {'toolCallId': tool_call.id, 'error': e.description}
+        except Exception as e:
+            print(f"Tool call {tool_call.id} ({tool_call.function.name}) failed: {e}")
+            return {'toolCallId': tool_call.id, 'error': 'Internal error while running the tool.'}
+
+async def dispatch_tools(request: Request) -> Response:
+    """
+    Run every tool call in the message concurrently and return all results at once.
+    'dispatch' times the message's parse and total; each call's phases go under its own tool.
+    """
+    service: AsyncVapiTodoService = request.app.state.vapi
+    with timed_tool('dispatch') as timer:
+        try:
+            with phase('parse'):
+                tool_calls = parse_tool_request(await request.body()).message.toolCalls
+        except ValueError as e:
+            return PlainTextResponse(str(e), status_code=400)
+        results = await asyncio.gather(*[_run_tool_call(service, call) for call in tool_calls])
+    return FlaskCompatibleJSONResponse({'results': list(results)},
+                                       headers={'Server-Timing': server_timing(timer)})
+
+async def metrics(request: Request) -> Response:
+    """Prometheus scrape endpoint (metrics of this process only)."""
+    return Response(render_metrics(), media_type=PROMETHEUS_CONTENT_TYPE)
+
+def create_asgi_app(database_url: str = None, calendar_service: AsyncGoogleCalendarService = None,
+                    sync_workers: int = None, **engine_options) -> Starlette:
+    """
+    Build the Starlette app.
+
+    Args:
+        database_url: Database URL; a synchronous driver is swapped for its
+            asyncio one (default: VAPI_ASYNC_DATABASE_URL or DATABASE_URL)
+        calendar_service: Client for the outbox tasks (default: an
+            AsyncGoogleCalendarService, created on first use)
+        sync_workers: Outbox draining tasks (default: VAPI_CALENDAR_SYNC_WORKERS or 4)
+        engine_options: Passed on to create_async_engine
+    """
+    url = database_url or os.getenv('VAPI_ASYNC_DATABASE_URL') or os.getenv('DATABASE_URL')
+    if not url:
+        raise RuntimeError("Set VAPI_ASYNC_DATABASE_URL (or DATABASE_URL) to the service's database.")
+    engine = create_async_engine(async_database_url(url), **engine_options)
+    service = AsyncVapiTodoService(engine, calendar_service, sync_workers)
+
+    @asynccontextmanager
+    async def lifespan(app):
+        service.start()
+        try:
+            yield
+        finally:
+            await service.stop()
+
+    routes = [Route('/tools', dispatch_tools, methods=['POST']), Route('/metrics', metrics)]
+    routes += [Route(f'/{path}', _tool_endpoint(name), methods=['POST']) for path, name in TOOL_ROUTES.items()]
+    app = Starlette(routes=[Mount('/vapi_project', routes=routes)], lifespan=lifespan)
+    app.state.vapi = service
+    return app
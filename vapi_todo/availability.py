@@ -0,0 +1,120 @@
+# availability.py
+"""
+Conflict detection and free/busy queries over calendar entries.
+
+Entries are treated as half-open intervals [event_from, event_to), so
+back-to-back meetings do not conflict. Overlap queries are written so the
+database can answer them from an index: on PostgreSQL the `&&` operator on
+tsrange(event_from, event_to) matches the GiST index
+ix_calendar_events_period; elsewhere the equivalent comparisons use the
+(event_to, event_from) B-tree index. Entries without a start, or ending
+before they start, are not intervals and never conflict.
+
+Busy blocks from Google's freebusy API can be merged in, so events created
+directly in Google Calendar count too.
+"""
+from datetime import datetime, timedelta
+from typing import Optional, Dict, Any, List, Tuple
+
+from sqlalchemy import select, cast, and_, func, DateTime
+from extensions import db
+from shared.google_calendar import get_calendar_service
+from .calendar_sync import current_calendar_user
+from .models import VapiCalendarEvent
+from .replicas import read_rows
+
+# Longest window findFreeSlots will scan.
+MAX_WINDOW = timedelta(days=31)
+
+Interval = Tuple[datetime, datetime]
+
+def overlap_filters(window_from: Optional[datetime], window_to: Optional[datetime],
+                    dialect_name: str) -> List:
+    """
+    WHERE clauses selecting calendar entries that overlap [window_from, window_to).
+    A missing bound leaves that side of the window open.
+    """
+    model = VapiCalendarEvent
+    filters = [model.event_from.isnot(None), model.event_to >= model.event_from]
+    if window_from is None and window_to is None:
+        return filters
+    if dialect_name == 'postgresql':
+        window = func.tsrange(cast(window_from, DateTime), cast(window_to, DateTime))
+        filters.append(func.tsrange(model.event_from, model.event_to).op('&&')(window))
+        return filters
+    if window_from is not None:
+        filters.append(model.event_to > window_from)
+    if window_to is not None:
+        filters.append(model.event_from < window_to)
+    return filters
+
+def _dialect_name() -> str:
+    return db.session.get_bind().dialect.name
+
+def _iso(value: datetime) -> str:
+    return value.isoformat() + 'Z'
+
+def find_conflicts(start: datetime, end: datetime, exclude_id: Optional[int] = None,
+                   limit: int = 20) -> List[Dict[str, Any]]:
+    """Calendar entries overlapping [start, end), earliest first."""
+    model = VapiCalendarEvent
+    filters = overlap_filters(start, end, _dialect_name())
+    if exclude_id is not None:
+        filters.append(model.id != exclude_id)
+    rows = read_rows(
+        select(model.id, model.title, model.event_from, model.event_to)
+        .where(and_(*filters))
+        .order_by(model.event_from)
+        .limit(limit)
+    )
+    return [{'id': row.id, 'title': row.title,
+             'event_from': _iso(row.event_from), 'event_to': _iso(row.event_to)} for row in rows]
+
+def local_busy(window_from: datetime, window_to: datetime) -> List[Interval]:
+    """Intervals of the calendar entries overlapping the window, earliest first."""
+    model = VapiCalendarEvent
+    rows = read_rows(
+        select(model.event_from, model.event_to)
+        .where(and_(*overlap_filters(window_from, window_to, _dialect_name())))
+        .order_by(model.event_from)
+    )
+    return [(row.event_from, row.event_to) for row in rows]
+
+def google_busy(window_from: datetime, window_to: datetime) -> Optional[List[Interval]]:
+    """Busy blocks from the caller's Google Calendar; None if Google could not be reached."""
+    try:
+        service = get_calendar_service(current_calendar_user()) or get_calendar_service()
+        return service.free_busy(window_from, window_to)
+    except Exception as e:
+        print(f"Could not get free/busy from Google Calendar: {e}")
+        return None
+
+def merge_intervals(intervals: List[Interval]) -> List[Interval]:
+    """Sort and merge overlapping or touching intervals."""
+    merged: List[Interval] = []
+    for start, end in sorted(intervals):
+        if merged and start <= merged[-1][1]:
+            if end > merged[-1][1]:
+                merged[-1] = (merged[-1][0], end)
+        else:
+            merged.append((start, end))
+    return merged
+
+def free_slots(window_from: datetime, window_to: datetime, busy: List[Interval],
+               duration: timedelta, limit: int) -> List[Interval]:
+    """Gaps of at least `duration` between the busy blocks inside the window."""
+    slots: List[Interval] = []
+    cursor = window_from
+    for start, end in merge_intervals(busy) + [(window_to, window_to)]:
+        start = min(max(start, window_from), window_to)
+        if start - cursor >= duration:
+            slots.append((cursor, start))
+            if len(slots) >= limit:
+                break
+        cursor = max(cursor, end)
+        if cursor >= window_to:
+            break
+    return slots
+
+def format_intervals(intervals: List[Interval]) -> List[Dict[str, str]]:
+    return [{'start': _iso(start), 'end': _iso(end)} for start, end in intervals]
@@ -0,0 +1,211 @@
+# calendar_pull.py
+"""
+Incremental pull of Google Calendar changes back into the local tables.
+
+The outbox (calendar_sync.py) pushes local writes to Google; this module
+goes the other way. It lists only the events changed since the last run
+using Google's syncToken, maps them to VapiTodo / VapiReminder /
+VapiCalendarEvent rows through google_calendar_event_id, and applies edits
+and deletions in bulk, one page at a time.
+
+When Google invalidates the token (410 Gone) the pull falls back to a full
+listing, bounded by VAPI_CALENDAR_FULL_RESYNC_MAX_PAGES pages.
+"""
+import os
+import re
+from datetime import datetime, timezone
+from typing import Optional, Dict, Any, List
+
+from sqlalchemy import update
+from extensions import db
+from shared.cache import get_read_cache
+from shared.google_calendar import get_calendar_service, SyncTokenExpired
+from .models import VapiCalendarSyncJob, VapiCalendarSyncState
+from .calendar_sync import ENTITY_MODELS
+
+FULL_RESYNC_MAX_PAGES = int(os.getenv('VAPI_CALENDAR_FULL_RESYNC_MAX_PAGES', '200'))
+
+_IMPORTANCE = re.compile(r'^Importance: (.*)$', re.MULTILINE)
+
+# --- Google event -> local columns (inverse of the *_event_fields helpers) ---
+
+def _google_time(value: Optional[Dict[str, Any]]) -> Optional[datetime]:
+    """Convert a Google start/end object to the naive UTC datetimes stored locally."""
+    if not value:
+        return None
+    if value.get('dateTime'):
+        parsed = datetime.fromisoformat(value['dateTime'].replace('Z', '+00:00'))
+        if parsed.tzinfo is not None:
+            parsed = parsed.astimezone(timezone.utc).replace(tzinfo=None)
+        return parsed
+    if value.get('date'):  # All-day event
+        return datetime.fromisoformat(value['date'])
+    return None
+
+def _strip_placeholder(description: str, placeholder: str) -> str:
+    return '' if description == placeholder else description
+
+def _same(current: Any, pulled: Any) -> bool:
+    # Google has no empty-vs-missing distinction: a None column matches ''.
+    return current == pulled or (current in (None, '') and pulled in (None, ''))
+
+def todo_columns(event: Dict[str, Any]) -> Dict[str, Any]:
+    summary = event.get('summary') or ''
+    description = event.get('description') or ''
+    if summary.startswith('COMPLETED: '):
+        return {
+            'title': summary[len('COMPLETED: '):],
+            'completed': True,
+            'description': description.removesuffix('\n\nStatus: Completed'),
+        }
+    if summary.startswith('TODO: '):
+        return {
+            'title': summary[len('TODO: '):],
+            'completed': False,
+            'description': _strip_placeholder(description, 'Task from VAPI Todo System'),
+        }
+    # Renamed in Google without our prefix: keep the completion state as is.
+    return {'title': summary, 'description': description}
+
+def reminder_columns(event: Dict[str, Any]) -> Dict[str, Any]:
+    summary = event.get('summary') or ''
+    columns = {'reminder_text': summary.removeprefix('REMINDER: ')}
+    match = _IMPORTANCE.search(event.get('description') or '')
+    if match:
+        columns['importance'] = match.group(1).strip()
+    return columns
+
+def calendar_event_columns(event: Dict[str, Any]) -> Dict[str, Any]:
+    columns = {
+        'title': event.get('summary') or '',
+        'description': _strip_placeholder(event.get('description') or '', 'Event from VAPI Todo System'),
+    }
+    start = _google_time(event.get('start'))
+    end = _google_time(event.get('end'))
+    if start:
+        columns['event_from'] = start
+    if end:
+        columns['event_to'] = end
+    return columns
+
+COLUMN_MAPPERS = {
+    'todo': todo_columns,
+    'reminder': reminder_columns,
+    'calendar_event': calendar_event_columns,
+}
+
+# --- Applying changes ---
+
+def apply_event_changes(events: List[Dict[str, Any]]) -> Dict[str, int]:
+    """
+    Apply one page of changed Google events to the local tables, without committing.
+
+    Rows with outbox jobs still pending are skipped: their local change has
+    not reached Google yet and must not be overwritten by the older remote
+    version. Events that do not belong to a local row are ignored.
+
+    Returns:
+        Counts of 'updated', 'deleted' and 'skipped' rows
+    """
+    stats = {'updated': 0, 'deleted': 0, 'skipped': 0}
+    by_event_id = {event['id']: event for event in events if event.get('id')}
+    if not by_event_id:
+        return stats
+
+    for entity_type, model in ENTITY_MODELS.items():
+        rows = db.session.query(model).filter(
+            model.google_calendar_event_id.in_(list(by_event_id))).all()
+        if not rows:
+            continue
+        unsynced = {entity_id for (entity_id,) in db.session.query(VapiCalendarSyncJob.entity_id).filter(
+            VapiCalendarSyncJob.entity_type == entity_type,
+            VapiCalendarSyncJob.entity_id.in_([row.id for row in rows]),
+            VapiCalendarSyncJob.status.in_(('pending', 'in_progress')),
+        )}
+
+        deleted_ids, updates = [], []
+        for row in rows:
+            if row.id in unsynced:
+                stats['skipped'] += 1
+                continue
+            event = by_event_id[row.google_calendar_event_id]
+            if event.get('status') == 'cancelled':
+                deleted_ids.append(row.id)
+                continue
+            changes = {column: value for column, value in COLUMN_MAPPERS[entity_type](event).items()
+                       if not _same(getattr(row, column), value)}
+            if changes:
+                # What Google holds no longer matches the last push; the next one sends every field.
+                changes['google_calendar_synced'] = None
+            if event.get('etag') and event['etag'] != row.google_calendar_etag:
+                changes['google_calendar_etag'] = event['etag']
+            if changes:
+                updates.append({'id': row.id, **changes})
+
+        if deleted_ids:
+            db.session.query(model).filter(model.id.in_(deleted_ids)).delete(synchronize_session=False)
+        if updates:
+            db.session.execute(update(model), updates)
+        if deleted_ids or updates:
+            get_read_cache().bump(model.__tablename__)
+        stats['deleted'] += len(deleted_ids)
+        stats['updated'] += len(updates)
+    return stats
+
+def _pull(calendar_service, state: VapiCalendarSyncState, sync_token: Optional[str],
+          max_pages: Optional[int]) -> Dict[str, Any]:
+    stats = {'pages': 0, 'events': 0, 'updated': 0, 'deleted': 0, 'skipped': 0, 'complete': False}
+    next_sync_token = None
+    for events, next_sync_token in calendar_service.list_event_changes(sync_token, max_pages=max_pages):
+        page_stats = apply_event_changes(events)
+        # Commit page by page: memory stays flat and progress survives a crash.
+        db.session.commit()
+        stats['pages'] += 1
+        stats['events'] += len(events)
+        for key, value in page_stats.items():
+            stats[key] += value
+
+    if next_sync_token:
+        state.sync_token = next_sync_token
+        state.last_synced_at = datetime.utcnow()
+        db.session.commit()
+        stats['complete'] = True
+    else:
+        print(f"Calendar pull stopped after {stats['pages']} pages without a sync token; "
+              f"the next run starts over.")
+    return stats
+
+def pull_calendar_changes(calendar_service=None, calendar_id: Optional[str] = None) -> Dict[str, Any]:
+    """
+    Pull changes made in Google Calendar since the last run. Must run inside an app context.
+
+    The sync token is stored per calendar, keyed by `calendar_id` (default:
+    the calendar the service lists, i.e. GOOGLE_CALENDAR_ID), so switching
+    calendars starts a full resync rather than reusing another's token.
+
+    Returns:
+        Counters for the run; 'full_resync' is True when the token had expired
+    """
+    calendar_service = calendar_service or get_calendar_service()
+    calendar_id = calendar_id or calendar_service.calendar_id
+    state = db.session.query(VapiCalendarSyncState).filter(
+        VapiCalendarSyncState.calendar_id == calendar_id).first()
+    if state is None:
+        state = VapiCalendarSyncState(calendar_id=calendar_id)
+        db.session.add(state)
+        db.session.commit()
+
+    if state.sync_token:
+        try:
+            stats = _pull(calendar_service, state, state.sync_token, max_pages=None)
+            stats['full_resync'] = False
+            return stats
+        except SyncTokenExpired as e:
+            print(f"Calendar sync token expired, running a full resync: {e}")
+            db.session.rollback()
+            state.sync_token = None
+            db.session.commit()
+
+    stats = _pull(calendar_service, state, None, max_pages=FULL_RESYNC_MAX_PAGES)
+    stats['full_resync'] = True
+    return stats
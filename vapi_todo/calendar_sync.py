@@ -0,0 +1,548 @@
+# calendar_sync.py
+"""
+Transactional outbox for Google Calendar synchronization.
+
+Routes never talk to Google directly. They add a VapiCalendarSyncJob to the
+same session as the row they are writing, so the job is committed (or rolled
+back) together with it, and the response goes back to VAPI straight away.
+A pool of background threads drains the outbox, retries failures with
+backoff and writes the resulting Google event ID back onto the local row.
+
+Jobs for the same entity are always applied in the order they were queued:
+a job is only picked up when no earlier job for that entity is still pending
+or in progress. Jobs are claimed with a conditional UPDATE and a lease, so
+several processes can run the pool against the same database.
+"""
+import os
+import random
+import threading
+from contextlib import contextmanager
+from contextvars import ContextVar
+from datetime import datetime, timedelta
+from typing import Optional, Dict, Any, List, Tuple
+
+from sqlalchemy import exists, insert, or_, select, update
+from extensions import db
+from shared.google_calendar import get_calendar_service, warm_calendar_service
+from shared.metrics import CALENDAR_RETRIES
+from shared.rate_limit import CalendarUnavailable
+from .models import VapiTodo, VapiReminder, VapiCalendarEvent, VapiCalendarSyncJob
+
+ENTITY_MODELS = {
+    'todo': VapiTodo,
+    'reminder': VapiReminder,
+    'calendar_event': VapiCalendarEvent,
+}
+
+MAX_ATTEMPTS = int(os.getenv('VAPI_CALENDAR_SYNC_MAX_ATTEMPTS', '8'))
+MAX_BACKOFF_SECONDS = 300
+# Wait before retrying a job whose call the rate limiter or circuit breaker refused
+UNAVAILABLE_RETRY_SECONDS = float(os.getenv('VAPI_CALENDAR_SYNC_UNAVAILABLE_RETRY', '5'))
+LEASE_SECONDS = 60
+
+
+class CalendarSyncError(Exception):
+    """Raised when a Google Calendar call for an outbox job did not succeed."""
+
+
+# --- Event fields for each entity type ---
+
+def todo_event_fields(todo: VapiTodo) -> Dict[str, Any]:
+    """Google Calendar fields mirroring a todo."""
+    if todo.completed:
+        return {
+            'title': f"COMPLETED: {todo.title}",
+            'description': f"{todo.description or ''}\n\nStatus: Completed",
+        }
+    return {
+        'title': f"TODO: {todo.title}",
+        'description': todo.description or "Task from VAPI Todo System",
+    }
+
+def reminder_event_fields(reminder: VapiReminder) -> Dict[str, Any]:
+    """Google Calendar fields mirroring a reminder."""
+    return {
+        'title': f"REMINDER: {reminder.reminder_text}",
+        'description': f"Importance: {reminder.importance}\nReminder from VAPI Todo System",
+    }
+
+def event_properties(entity_type: str, entity_id: int) -> Dict[str, str]:
+    """Private extended properties tagging a Google event with the local row it mirrors."""
+    return {'vapiEntity': entity_type, 'vapiId': str(entity_id)}
+
+def calendar_event_fields(event: VapiCalendarEvent) -> Dict[str, Any]:
+    """Google Calendar fields mirroring a calendar entry."""
+    return {
+        'title': event.title,
+        'description': event.description or "Event from VAPI Todo System",
+        'start_time': event.event_from.isoformat() if event.event_from else None,
+        'end_time': event.event_to.isoformat() if event.event_to else None,
+    }
+
+
+# --- Enqueueing (request path) ---
+
+_calendar_user: ContextVar[Optional[str]] = ContextVar('vapi_calendar_user', default=None)
+
+@contextmanager
+def calendar_user(user_id: Optional[str]):
+    """Make `user_id` the owner of the rows the enclosed tool call creates (see user_calendars.py)."""
+    token = _calendar_user.set(user_id)
+    try:
+        yield
+    finally:
+        _calendar_user.reset(token)
+
+def current_calendar_user() -> Optional[str]:
+    """The calendar user of the running tool call; None for the deployment's own calendar."""
+    return _calendar_user.get()
+
+
+def enqueue_calendar_sync(entity_type: str, entity_id: int, operation: str,
+                          fields: Optional[Dict[str, Any]] = None,
+                          google_calendar_event_id: Optional[str] = None,
+                          user_id: Optional[str] = None) -> VapiCalendarSyncJob:
+    """
+    Add a sync job to the current session without committing it.
+
+    The caller commits the job together with the entity change, which is
+    what makes the outbox transactional.
+
+    Args:
+        entity_type: One of the keys of ENTITY_MODELS
+        entity_id: Primary key of the local row
+        operation: 'create', 'update' or 'delete'
+        fields: Event fields for create/update (see the *_event_fields helpers)
+        google_calendar_event_id: Known Google event ID for update/delete
+        user_id: Whose calendar the event lives in (the row's calendar_user_id)
+
+    Returns:
+        The pending VapiCalendarSyncJob
+    """
+    job = VapiCalendarSyncJob(
+        entity_type=entity_type,
+        entity_id=entity_id,
+        operation=operation,
+        payload=fields,
+        google_calendar_event_id=google_calendar_event_id,
+        user_id=user_id,
+        status='pending',
+        attempts=0,
+        next_attempt_at=datetime.utcnow(),
+    )
+    db.session.add(job)
+    return job
+
+def enqueue_calendar_syncs(entity_type: str, operation: str, jobs: List[Dict[str, Any]]):
+    """
+    Add many sync jobs to the current transaction with a single multi-row INSERT.
+
+    Args:
+        entity_type: One of the keys of ENTITY_MODELS
+        operation: 'create', 'update' or 'delete'
+        jobs: One dict per job with 'entity_id' and optionally 'fields',
+            'google_calendar_event_id' and 'user_id', as for enqueue_calendar_sync
+    """
+    if not jobs:
+        return
+    now = datetime.utcnow()
+    db.session.execute(insert(VapiCalendarSyncJob.__table__), [
+        sync_job_values(entity_type, job['entity_id'], operation, job.get('fields'),
+                        job.get('google_calendar_event_id'), job.get('user_id'), now)
+        for job in jobs])
+
+def sync_job_values(entity_type: str, entity_id: int, operation: str,
+                    fields: Optional[Dict[str, Any]] = None,
+                    google_calendar_event_id: Optional[str] = None,
+                    user_id: Optional[str] = None,
+                    now: Optional[datetime] = None) -> Dict[str, Any]:
+    """Column values of a new pending job, for inserting it with a Core statement."""
+    now = now or datetime.utcnow()
+    return {
+        'entity_type': entity_type,
+        'entity_id': entity_id,
+        'operation': operation,
+        'payload': fields,
+        'google_calendar_event_id': google_calendar_event_id,
+        'user_id': user_id,
+        'status': 'pending',
+        'attempts': 0,
+        'next_attempt_at': now,
+        'created_at': now,
+    }
+
+
+# --- Draining (background) ---
+
+def _parse_time(value: Optional[str]) -> Optional[datetime]:
+    return datetime.fromisoformat(value) if value else None
+
+def _event_kwargs(job: VapiCalendarSyncJob) -> Dict[str, Any]:
+    fields = dict(job.payload or {})
+    kwargs = {
+        'title': fields.get('title'),
+        'description': fields.get('description'),
+        'start_time': _parse_time(fields.get('start_time')),
+        'end_time': _parse_time(fields.get('end_time')),
+        'properties': event_properties(job.entity_type, job.entity_id),
+    }
+    if job.operation == 'create' and kwargs['start_time'] is None:
+        # Todos and reminders have no time of their own; pin them to when
+        # they were created rather than to when the worker got to them.
+        kwargs['start_time'] = job.created_at
+    return kwargs
+
+# The statement builders below work on the outbox table directly, so the
+# async service (asgi.py) drains the same outbox with the same rules.
+
+_jobs = VapiCalendarSyncJob.__table__
+
+def claim_statement(job_ids, now: datetime):
+    """
+    UPDATE moving jobs to in_progress, returning the IDs this worker got.
+
+    A job is claimable while pending, or while in progress with an expired
+    lease (its previous worker died). Competing workers lose the UPDATE race.
+    """
+    return (
+        update(_jobs)
+        .where(
+            _jobs.c.id.in_(list(job_ids)),
+            or_(
+                _jobs.c.status == 'pending',
+                (_jobs.c.status == 'in_progress') & (_jobs.c.locked_until < now),
+            ),
+        )
+        .values(status='in_progress', locked_until=now + timedelta(seconds=LEASE_SECONDS))
+        .returning(_jobs.c.id)
+    )
+
+def _claim(jobs, now: datetime):
+    """Atomically move jobs to in_progress and return the ones this worker got."""
+    claimed_ids = db.session.execute(claim_statement([job.id for job in jobs], now)).scalars().all()
+    db.session.commit()
+    if not claimed_ids:
+        return []
+    return db.session.query(VapiCalendarSyncJob).filter(
+        VapiCalendarSyncJob.id.in_(claimed_ids)).order_by(VapiCalendarSyncJob.id).all()
+
+def record_sync_statements(job, event_id: str, etag: Optional[str] = None):
+    """
+    UPDATEs recording a successful create or update on the entity: the
+    event's ID and ETag, and the fields Google now holds. A freshly created
+    ID is also written to the entity's queued jobs.
+    """
+    table = ENTITY_MODELS[job.entity_type].__table__
+    values = {'google_calendar_etag': etag, 'google_calendar_synced': job.payload}
+    if job.operation == 'create':
+        values['google_calendar_event_id'] = event_id
+    statements = [update(table).where(table.c.id == job.entity_id).values(**values)]
+    if job.operation == 'create':
+        # Updates and deletes queued before the event existed did not know its ID.
+        statements.append(update(_jobs).where(
+            _jobs.c.entity_type == job.entity_type,
+            _jobs.c.entity_id == job.entity_id,
+            _jobs.c.id > job.id,
+            _jobs.c.google_calendar_event_id.is_(None),
+        ).values(google_calendar_event_id=event_id))
+    return statements
+
+def _record_sync(job: VapiCalendarSyncJob, result: Dict[str, Any]):
+    for statement in record_sync_statements(job, result['event_id'], (result.get('event') or {}).get('etag')):
+        db.session.execute(statement)
+
+def sync_state_statements(jobs):
+    """
+    SELECTs of the ETag and last-synced fields of the entities with update
+    jobs among `jobs`, one per entity type; see batch_operation.
+    """
+    ids: Dict[str, set] = {}
+    for job in jobs:
+        if job.operation == 'update':
+            ids.setdefault(job.entity_type, set()).add(job.entity_id)
+    statements = []
+    for entity_type, entity_ids in ids.items():
+        table = ENTITY_MODELS[entity_type].__table__
+        statements.append((entity_type, select(
+            table.c.id, table.c.google_calendar_etag, table.c.google_calendar_synced,
+        ).where(table.c.id.in_(entity_ids))))
+    return statements
+
+def _sync_states(jobs) -> Dict[Tuple[str, int], Any]:
+    states = {}
+    for entity_type, statement in sync_state_statements(jobs):
+        for row in db.session.execute(statement):
+            states[(entity_type, row.id)] = row
+    return states
+
+def batch_operation(job, state=None) -> Optional[Dict[str, Any]]:
+    """
+    Translate a job into a GoogleCalendarService.batch_execute operation.
+
+    An update only carries the fields that differ from what was last
+    synced, and is conditional on the ETag of that version; `state` is the
+    entity's row from sync_state_statements.
+
+    Returns None when there is nothing to send, e.g. an update or delete for
+    an entity whose create never produced a Google event, or an update that
+    changes nothing Google shows.
+    """
+    if job.operation == 'create':
+        return {'op': 'create', **_event_kwargs(job)}
+    if job.operation in ('update', 'delete'):
+        if not job.google_calendar_event_id:
+            return None
+        operation = {'op': job.operation, 'event_id': job.google_calendar_event_id}
+        if job.operation == 'update':
+            kwargs = _event_kwargs(job)
+            synced = state.google_calendar_synced if state is not None else None
+            if synced is not None:
+                changed = {key for key, value in (job.payload or {}).items() if synced.get(key) != value}
+                if not changed:
+                    return None
+                # The event was tagged when it was synced.
+                kwargs = {key: value for key, value in kwargs.items() if key in changed}
+            if state is not None and state.google_calendar_etag:
+                operation['etag'] = state.google_calendar_etag
+            operation.update(kwargs)
+        return operation
+    raise CalendarSyncError(f"Unknown operation '{job.operation}'")
+
+def plan_batch(jobs, states: Optional[Dict[Tuple[str, int], Any]] = None):
+    """
+    Split claimed jobs into the ones to send and the ones already settled.
+    `states` maps (entity_type, entity_id) to the rows of sync_state_statements.
+
+    Returns:
+        (sendable jobs, their batch operations, [(job, error or None)] that
+        need no call to Google)
+    """
+    sendable, operations, settled = [], [], []
+    for job in jobs:
+        try:
+            operation = batch_operation(job, (states or {}).get((job.entity_type, job.entity_id)))
+        except CalendarSyncError as e:
+            settled.append((job, e))
+            continue
+        if operation is None:
+            settled.append((job, None))
+        else:
+            sendable.append(job)
+            operations.append(operation)
+    return sendable, operations, settled
+
+def finish_values(job, error: Optional[Exception]) -> Dict[str, Any]:
+    """
+    Column values recording the outcome of an attempted job. A call the
+    guard refused (CalendarUnavailable) never reached Google, so the job is
+    rescheduled without using up one of its attempts.
+    """
+    if error is None:
+        return {'status': 'done', 'locked_until': None, 'last_error': None}
+    if isinstance(error, CalendarUnavailable):
+        delay = UNAVAILABLE_RETRY_SECONDS * random.uniform(0.5, 1.0)
+        return {'status': 'pending', 'locked_until': None, 'last_error': str(error)[:500],
+                'next_attempt_at': datetime.utcnow() + timedelta(seconds=delay)}
+    attempts = job.attempts + 1
+    values = {'attempts': attempts, 'locked_until': None, 'last_error': str(error)[:500]}
+    if attempts >= MAX_ATTEMPTS:
+        values['status'] = 'failed'
+        print(f"Giving up on calendar sync job {job.id} after {attempts} attempts: {error}")
+    else:
+        delay = min(MAX_BACKOFF_SECONDS, 2 ** attempts) * random.uniform(0.5, 1.0)
+        values['status'] = 'pending'
+        values['next_attempt_at'] = datetime.utcnow() + timedelta(seconds=delay)
+        CALENDAR_RETRIES.inc(operation=job.operation)
+    return values
+
+def batch_error(result: Dict[str, Any]) -> Optional[Exception]:
+    """The error to pass to finish_values for one batch_execute result; None if it succeeded."""
+    if result['ok']:
+        return None
+    if result.get('unavailable'):
+        return CalendarUnavailable(result['error'])
+    return CalendarSyncError(result['error'])
+
+def _finish(job: VapiCalendarSyncJob, error: Optional[Exception]):
+    for column, value in finish_values(job, error).items():
+        setattr(job, column, value)
+
+def candidate_jobs_statement(partition: int, partitions: int, limit: int, now: datetime,
+                             default_calendar_only: bool = False):
+    """
+    SELECT of the oldest jobs in a partition that may run at `now`: out of
+    backoff, not leased to a live worker, and with no older unfinished job
+    for the same entity. Readiness is filtered before the LIMIT, so jobs
+    waiting for a retry cannot crowd ready ones out of the page. All jobs of
+    an entity share its user, so leaving per-user jobs out does not break
+    their ordering.
+    """
+    older = _jobs.alias('older')
+    statement = select(_jobs).where(
+        _jobs.c.status.in_(('pending', 'in_progress')),
+        or_(_jobs.c.next_attempt_at.is_(None), _jobs.c.next_attempt_at <= now),
+        or_(_jobs.c.status != 'in_progress', _jobs.c.locked_until.is_(None), _jobs.c.locked_until <= now),
+        ~exists().where(
+            older.c.entity_type == _jobs.c.entity_type,
+            older.c.entity_id == _jobs.c.entity_id,
+            older.c.id < _jobs.c.id,
+            older.c.status.in_(('pending', 'in_progress'))),
+    )
+    if default_calendar_only:
+        statement = statement.where(_jobs.c.user_id.is_(None))
+    if partitions > 1:
+        statement = statement.where(_jobs.c.entity_id % partitions == partition)
+    return statement.order_by(_jobs.c.id).limit(limit)
+
+def pick_ready_jobs(candidates, now: datetime, limit: int):
+    """
+    Return the candidate jobs that may run now, at most one per entity.
+
+    Only the oldest unfinished job of each entity is a candidate, so a job
+    waiting for a retry holds back everything queued after it. The query of
+    candidate_jobs_statement already applies these rules; this re-checks
+    them against `now` on the rows it returned.
+    """
+    seen = set()
+    ready = []
+    for job in candidates:
+        key = (job.entity_type, job.entity_id)
+        if key in seen:
+            continue
+        seen.add(key)
+        if job.status == 'in_progress' and job.locked_until and job.locked_until > now:
+            continue
+        if job.next_attempt_at and job.next_attempt_at > now:
+            continue
+        ready.append(job)
+        if len(ready) >= limit:
+            break
+    return ready
+
+def _ready_jobs(partition: int, partitions: int, limit: int):
+    now = datetime.utcnow()
+    candidates = db.session.execute(candidate_jobs_statement(partition, partitions, limit, now)).all()
+    return pick_ready_jobs(candidates, now, limit)
+
+def _send_batch(user_id: Optional[str], operations: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    try:
+        service = get_calendar_service(user_id)
+        if service is None:
+            raise CalendarSyncError(f"No calendar credentials stored for user {user_id}")
+        return service.batch_execute(operations)
+    except Exception as e:
+        return [{'ok': False, 'error': str(e), 'unavailable': isinstance(e, CalendarUnavailable)}] * len(operations)
+
+def drain_calendar_outbox(partition: int = 0, partitions: int = 1, limit: int = 50) -> int:
+    """
+    Process one round of ready outbox jobs. Must run inside an app context.
+
+    All claimed jobs are sent to Google in a single batch request (up to
+    50 calls), so a backlog costs one round trip per 50 jobs.
+
+    Returns:
+        Number of jobs that were claimed and attempted
+    """
+    jobs = _ready_jobs(partition, partitions, limit)
+    if not jobs:
+        return 0
+    jobs = _claim(jobs, datetime.utcnow())
+    if not jobs:
+        return 0
+
+    sendable, operations, settled = plan_batch(jobs, _sync_states(jobs))
+    for job, error in settled:
+        _finish(job, error)
+
+    # One batch per calendar owner
+    by_user: Dict[Optional[str], list] = {}
+    for job, operation in zip(sendable, operations):
+        by_user.setdefault(job.user_id, []).append((job, operation))
+    for user_id, group in by_user.items():
+        results = _send_batch(user_id, [operation for _, operation in group])
+        for (job, _), result in zip(group, results):
+            if result['ok'] and job.operation in ('create', 'update'):
+                _record_sync(job, result)
+            _finish(job, batch_error(result))
+
+    db.session.commit()
+    return len(jobs)
+
+
+class CalendarSyncWorkerPool:
+    """Background threads draining the calendar outbox, one partition each."""
+
+    def __init__(self, app, num_workers: int = 4, poll_interval: float = 1.0, batch_size: int = 50):
+        self.app = app
+        self.num_workers = max(1, num_workers)
+        self.poll_interval = poll_interval
+        self.batch_size = batch_size
+        self._wakeup = threading.Event()
+        self._stopping = threading.Event()
+        self._threads = []
+
+    def start(self):
+        # Authenticate and build one API client per worker up front, off the
+        # request thread that may have triggered the start.
+        threading.Thread(target=warm_calendar_service, args=(self.num_workers,),
+                         name='calendar-warmup', daemon=True).start()
+        for index in range(self.num_workers):
+            thread = threading.Thread(
+                target=self._run, args=(index,),
+                name=f'calendar-sync-{index}', daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def stop(self, timeout: Optional[float] = None):
+        self._stopping.set()
+        self._wakeup.set()
+        for thread in self._threads:
+            thread.join(timeout)
+        self._threads = []
+
+    def join(self):
+        for thread in self._threads:
+            thread.join()
+
+    def notify(self):
+        """Wake the workers up instead of waiting for the next poll."""
+        self._wakeup.set()
+
+    def _run(self, index: int):
+        while not self._stopping.is_set():
+            processed = 0
+            try:
+                with self.app.app_context():
+                    processed = drain_calendar_outbox(index, self.num_workers, self.batch_size)
+            except Exception as e:
+                print(f"Calendar sync worker {index} failed: {e}")
+            if processed == 0:
+                self._wakeup.wait(self.poll_interval)
+                self._wakeup.clear()
+
+
+_worker_pool = None
+_worker_pool_lock = threading.Lock()
+
+def start_calendar_sync_workers(app, num_workers: Optional[int] = None) -> Optional[CalendarSyncWorkerPool]:
+    """
+    Start the outbox worker pool for this process, once.
+
+    The size comes from VAPI_CALENDAR_SYNC_WORKERS (default 4). Set it to 0 to
+    leave draining to a dedicated `flask vapi_flask calendar-sync` process.
+    """
+    global _worker_pool
+    if num_workers is None:
+        num_workers = int(os.getenv('VAPI_CALENDAR_SYNC_WORKERS', '4'))
+    if num_workers <= 0:
+        return None
+    with _worker_pool_lock:
+        if _worker_pool is None:
+            _worker_pool = CalendarSyncWorkerPool(app, num_workers=num_workers)
+            _worker_pool.start()
+    return _worker_pool
+
+def notify_calendar_sync():
+    """Tell the local worker pool (if any) that new jobs were committed."""
+    if _worker_pool is not None:
+        _worker_pool.notify()
@@ -0,0 +1,401 @@
+# idempotency.py
+"""
+Idempotent write tool calls, keyed on the toolCallId VAPI sends.
+
+When a tool call takes too long, VAPI gives up and sends the same call
+again. Without this, a retried createTodo would insert a second row and a
+second Google event. Write tools therefore go through ToolCallResults.run:
+
+* a result this process already stored is returned from an in-memory LRU
+  without touching the database;
+* a retry that arrives while the first attempt is still running in this
+  process waits for it and returns its result;
+* across processes, the first attempt claims the toolCallId in the
+  tool_call_results table (unique per tool), and later ones poll that row until
+  the result is stored. The attempt renews its lease (VAPI_IDEMPOTENCY_LEASE
+  seconds) while it runs, so only a claim whose process died is taken over.
+
+The result is stored in the same transaction as the call's write, so they
+commit together or not at all: a retry never runs a write that already
+committed. Storing is fenced on the lease, so an attempt whose claim was taken
+over rolls back and returns the other attempt's result. Only successful
+results are stored; a call that failed rolled its writes back, so its retry
+simply runs again. A retry waits at most VAPI_IDEMPOTENCY_WAIT seconds for a
+running attempt, then fails with ToolCallInProgress. Results are kept for
+VAPI_IDEMPOTENCY_TTL seconds (default a day), which is far longer than any
+retry window.
+"""
+import os
+import time
+import asyncio
+import threading
+from datetime import datetime, timedelta
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple
+
+from sqlalchemy import and_, delete, insert, or_, select, update
+from sqlalchemy.exc import IntegrityError
+from extensions import db
+from shared.cache import LRUCacheBackend
+from shared.metrics import TOOL_CALL_REPLAYS, phase
+from .models import VapiToolCallResult
+
+IDEMPOTENCY_TTL = float(os.getenv('VAPI_IDEMPOTENCY_TTL', '86400'))
+IDEMPOTENCY_LEASE = float(os.getenv('VAPI_IDEMPOTENCY_LEASE', '30'))
+IDEMPOTENCY_WAIT = float(os.getenv('VAPI_IDEMPOTENCY_WAIT', '20'))
+IDEMPOTENCY_CACHE_SIZE = int(os.getenv('VAPI_IDEMPOTENCY_CACHE_SIZE', '4096'))
+
+# Expired rows are deleted at most this often, by whichever call comes next.
+_PURGE_INTERVAL = 300.0
+# Polling a claim held by another process: first and longest pause.
+_POLL_DELAY = 0.02
+_MAX_POLL_DELAY = 0.5
+
+_results = VapiToolCallResult.__table__
+
+class ToolCallInProgress(Exception):
+    """Another attempt at the same toolCallId is still running after the wait ran out."""
+
+class _LeaseLost(Exception):
+    """Our claim was taken over while the attempt ran; its write must not commit."""
+
+def _is_call(tool_call_id: str, function_name: str):
+    return and_(_results.c.tool_call_id == tool_call_id, _results.c.function_name == function_name)
+
+def _holds_lease(locked_until: datetime):
+    return and_(_results.c.status == 'in_progress', _results.c.locked_until == locked_until)
+
+def lease_end(now: datetime, lease: float) -> datetime:
+    """
+    When a lease taken at `now` runs out. Whole seconds, so the value the
+    database stores compares equal to ours on every backend.
+    """
+    return (now + timedelta(seconds=lease)).replace(microsecond=0)
+
+# --- Statement builders (shared with the ASGI service) ---
+
+def claim_statement(tool_call_id: str, function_name: str, now: datetime, locked_until: datetime, ttl: float):
+    """INSERT claiming a tool's toolCallId; fails with IntegrityError if it is already known."""
+    return insert(_results).values(
+        tool_call_id=tool_call_id, function_name=function_name, status='in_progress',
+        locked_until=locked_until, expires_at=now + timedelta(seconds=ttl), created_at=now)
+
+def takeover_statement(tool_call_id: str, function_name: str, now: datetime, locked_until: datetime, ttl: float):
+    """UPDATE claiming a row whose attempt died or whose result expired; matches nothing otherwise."""
+    return update(_results).where(
+        _is_call(tool_call_id, function_name),
+        or_(and_(_results.c.status == 'in_progress', _results.c.locked_until < now),
+            _results.c.expires_at < now),
+    ).values(status='in_progress', response=None, locked_until=locked_until,
+             expires_at=now + timedelta(seconds=ttl))
+
+def renew_statement(tool_call_id: str, function_name: str, locked_until: datetime, renewed_until: datetime):
+    """UPDATE extending the lease we hold; matches nothing once it was taken over."""
+    return update(_results).where(
+        _is_call(tool_call_id, function_name), _holds_lease(locked_until)).values(locked_until=renewed_until)
+
+def lookup_statement(tool_call_id: str, function_name: str):
+    return select(_results.c.status, _results.c.response).where(_is_call(tool_call_id, function_name))
+
+def store_statement(tool_call_id: str, function_name: str, result: Any, now: datetime, ttl: float,
+                    locked_until: datetime):
+    """UPDATE recording the result of the call we hold the lease on; matches nothing once it was taken over."""
+    return update(_results).where(_is_call(tool_call_id, function_name), _holds_lease(locked_until)).values(
+        status='done', response=result, locked_until=None, expires_at=now + timedelta(seconds=ttl))
+
+def release_statement(tool_call_id: str, function_name: str, locked_until: datetime):
+    """DELETE of our claim after its attempt failed, so the retry can run."""
+    return delete(_results).where(_is_call(tool_call_id, function_name), _holds_lease(locked_until))
+
+def purge_statement(now: datetime):
+    return delete(_results).where(_results.c.expires_at < now)
+
+class _Lease:
+    """A claim's lease, renewed every third of its length until the attempt stops it."""
+
+    def __init__(self, engine, tool_call_id: str, function_name: str, locked_until: datetime, lease: float):
+        self.engine = engine
+        self.tool_call_id = tool_call_id
+        self.function_name = function_name
+        self.locked_until = locked_until
+        self.lease = lease
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._renew, name='vapi-idempotency-lease', daemon=True)
+        self._thread.start()
+
+    def _renew(self):
+        while not self._stopped.wait(self.lease / 3):
+            renewed_until = lease_end(datetime.utcnow(), self.lease)
+            try:
+                with self.engine.begin() as conn:
+                    if not conn.execute(renew_statement(self.tool_call_id, self.function_name,
+                                                        self.locked_until, renewed_until)).rowcount:
+                        return  # Taken over: storing the result will fail
+            except Exception as e:
+                print(f"Could not renew the lease on tool call {self.tool_call_id}: {e}")
+                continue
+            self.locked_until = renewed_until
+
+    def stop(self) -> datetime:
+        """Stop renewing; returns the lease's current end, which fences the store or release."""
+        self._stopped.set()
+        self._thread.join()
+        return self.locked_until
+
+class _AsyncLease:
+    """_Lease as a task on the event loop."""
+
+    def __init__(self, engine, tool_call_id: str, function_name: str, locked_until: datetime, lease: float):
+        self.engine = engine
+        self.tool_call_id = tool_call_id
+        self.function_name = function_name
+        self.locked_until = locked_until
+        self.lease = lease
+        self._stopped = asyncio.Event()
+        self._task = asyncio.get_running_loop().create_task(self._renew())
+
+    async def _renew(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._stopped.wait(), self.lease / 3)
+                return
+            except asyncio.TimeoutError:
+                pass
+            renewed_until = lease_end(datetime.utcnow(), self.lease)
+            try:
+                async with self.engine.begin() as conn:
+                    if not (await conn.execute(renew_statement(self.tool_call_id, self.function_name,
+                                                               self.locked_until, renewed_until))).rowcount:
+                        return
+            except Exception as e:
+                print(f"Could not renew the lease on tool call {self.tool_call_id}: {e}")
+                continue
+            self.locked_until = renewed_until
+
+    async def stop(self) -> datetime:
+        self._stopped.set()
+        await self._task
+        return self.locked_until
+
+class _ToolCallResultsBase:
+    def __init__(self, ttl: float = IDEMPOTENCY_TTL, lease: float = IDEMPOTENCY_LEASE,
+                 wait: float = IDEMPOTENCY_WAIT, cache_size: int = IDEMPOTENCY_CACHE_SIZE):
+        self.ttl = ttl
+        self.lease = lease
+        self.wait = wait
+        # Values are 1-tuples, so any result (even None) can be told from a miss.
+        self.cache = LRUCacheBackend(cache_size)
+        self._next_purge = 0.0
+
+    def _cached(self, tool_call_id: str, function_name: str) -> Optional[Tuple[Any]]:
+        stored = self.cache.get(f'{function_name}:{tool_call_id}')
+        if stored is not None:
+            TOOL_CALL_REPLAYS.inc(tool=function_name)
+        return stored
+
+    def _purge_due(self) -> bool:
+        now = time.monotonic()
+        if now < self._next_purge:
+            return False
+        self._next_purge = now + _PURGE_INTERVAL
+        return True
+
+    @staticmethod
+    def _remaining(tool_call_id: str, deadline: float) -> float:
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            raise ToolCallInProgress(f'Tool call {tool_call_id} is still running; try again later.')
+        return remaining
+
+class ToolCallResults(_ToolCallResultsBase):
+    """Runs write tool calls at most once per toolCallId on the Flask-SQLAlchemy engine."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._in_flight: Dict[Tuple[str, str], threading.Event] = {}
+        self._lock = threading.Lock()
+
+    def run(self, tool_call_id: str, function_name: str, execute: Callable[[], Any]) -> Any:
+        """
+        Return the result of `execute()` for this toolCallId, running it only
+        if no attempt has succeeded yet. `execute` leaves its write in
+        `db.session` uncommitted; it is committed here together with the
+        result. Exceptions from `execute` propagate, and ToolCallInProgress
+        is raised when another attempt outlasts the wait. Must run inside an
+        app context.
+        """
+        deadline = time.monotonic() + self.wait
+        while True:
+            stored = self._cached(tool_call_id, function_name)
+            if stored is not None:
+                return stored[0]
+            with self._lock:
+                running = self._in_flight.get((tool_call_id, function_name))
+                if running is None:
+                    self._in_flight[(tool_call_id, function_name)] = threading.Event()
+                    break
+            # Same process: wait for that attempt; if it failed, run it ourselves.
+            if not running.wait(self._remaining(tool_call_id, deadline)):
+                self._remaining(tool_call_id, deadline)
+        try:
+            return self._run_claimed(tool_call_id, function_name, execute, deadline)
+        finally:
+            with self._lock:
+                self._in_flight.pop((tool_call_id, function_name)).set()
+
+    def _run_claimed(self, tool_call_id: str, function_name: str, execute: Callable[[], Any],
+                     deadline: float) -> Any:
+        while True:
+            stored, locked_until = self._claim(tool_call_id, function_name, deadline)
+            if stored is not None:
+                TOOL_CALL_REPLAYS.inc(tool=function_name)
+                break
+            lease = _Lease(db.engine, tool_call_id, function_name, locked_until, self.lease)
+            try:
+                result = execute()
+                locked_until = lease.stop()
+                with phase('db'):
+                    if db.session.execute(store_statement(tool_call_id, function_name, result, datetime.utcnow(),
+                                                          self.ttl, locked_until)).rowcount:
+                        db.session.commit()
+                        stored = (result,)
+                        break
+                # Taken over while we ran: drop our write and wait for that attempt's result.
+                db.session.rollback()
+            except BaseException:
+                locked_until = lease.stop()
+                # Roll the attempt back first, so the release does not wait on its locks.
+                db.session.rollback()
+                with db.engine.begin() as conn:
+                    conn.execute(release_statement(tool_call_id, function_name, locked_until))
+                raise
+        self.cache.set(f'{function_name}:{tool_call_id}', stored, self.ttl)
+        return stored[0]
+
+    def _claim(self, tool_call_id: str, function_name: str,
+               deadline: float) -> Tuple[Optional[Tuple[Any]], Optional[datetime]]:
+        """
+        Claim the toolCallId. Returns (None, end of our lease) once it is ours,
+        or (the 1-tuple result another attempt stored, None).
+        """
+        if self._purge_due():
+            with db.engine.begin() as conn:
+                conn.execute(purge_statement(datetime.utcnow()))
+        delay = _POLL_DELAY
+        while True:
+            now = datetime.utcnow()
+            locked_until = lease_end(now, self.lease)
+            try:
+                with db.engine.begin() as conn:
+                    conn.execute(claim_statement(tool_call_id, function_name, now, locked_until, self.ttl))
+                return None, locked_until
+            except IntegrityError:
+                pass
+            with db.engine.begin() as conn:
+                # Known already: take over a dead attempt or an expired result, else read the row.
+                if conn.execute(takeover_statement(tool_call_id, function_name, now, locked_until, self.ttl)).rowcount:
+                    return None, locked_until
+                row = conn.execute(lookup_statement(tool_call_id, function_name)).first()
+            if row is not None and row.status == 'done':
+                return (row.response,), None
+            if row is not None:
+                time.sleep(min(delay, self._remaining(tool_call_id, deadline)))  # Another process is running it
+                delay = min(delay * 2, _MAX_POLL_DELAY)
+
+class AsyncToolCallResults(_ToolCallResultsBase):
+    """ToolCallResults for the ASGI service, on its async engine."""
+
+    def __init__(self, engine, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.engine = engine
+        self._in_flight: Dict[Tuple[str, str], asyncio.Event] = {}
+
+    async def run(self, tool_call_id: str, function_name: str,
+                  execute: Callable[[Callable[[Any, Any], Awaitable[None]]], Awaitable[Any]]) -> Any:
+        """
+        See ToolCallResults.run. `execute(store)` must await `store(conn, result)`
+        on the connection of its write, before committing it.
+        """
+        deadline = time.monotonic() + self.wait
+        while True:
+            stored = self._cached(tool_call_id, function_name)
+            if stored is not None:
+                return stored[0]
+            running = self._in_flight.get((tool_call_id, function_name))
+            if running is None:
+                self._in_flight[(tool_call_id, function_name)] = asyncio.Event()
+                break
+            try:
+                await asyncio.wait_for(running.wait(), self._remaining(tool_call_id, deadline))
+            except asyncio.TimeoutError:
+                self._remaining(tool_call_id, deadline)
+        try:
+            return await self._run_claimed(tool_call_id, function_name, execute, deadline)
+        finally:
+            self._in_flight.pop((tool_call_id, function_name)).set()
+
+    async def _run_claimed(self, tool_call_id: str, function_name: str,
+                           execute: Callable[[Callable[[Any, Any], Awaitable[None]]], Awaitable[Any]],
+                           deadline: float) -> Any:
+        while True:
+            stored, locked_until = await self._claim(tool_call_id, function_name, deadline)
+            if stored is not None:
+                TOOL_CALL_REPLAYS.inc(tool=function_name)
+                break
+            lease = _AsyncLease(self.engine, tool_call_id, function_name, locked_until, self.lease)
+
+            async def store(conn, result):
+                stored_until = await lease.stop()
+                if not (await conn.execute(store_statement(tool_call_id, function_name, result, datetime.utcnow(),
+                                                           self.ttl, stored_until))).rowcount:
+                    raise _LeaseLost()
+
+            try:
+                stored = (await execute(store),)
+                break
+            except _LeaseLost:
+                pass  # Its write was not committed; wait for the attempt that took over
+            except BaseException:
+                async with self.engine.begin() as conn:
+                    await conn.execute(release_statement(tool_call_id, function_name, await lease.stop()))
+                raise
+        self.cache.set(f'{function_name}:{tool_call_id}', stored, self.ttl)
+        return stored[0]
+
+    async def _claim(self, tool_call_id: str, function_name: str,
+                     deadline: float) -> Tuple[Optional[Tuple[Any]], Optional[datetime]]:
+        if self._purge_due():
+            async with self.engine.begin() as conn:
+                await conn.execute(purge_statement(datetime.utcnow()))
+        delay = _POLL_DELAY
+        while True:
+            now = datetime.utcnow()
+            locked_until = lease_end(now, self.lease)
+            try:
+                async with self.engine.begin() as conn:
+                    await conn.execute(claim_statement(tool_call_id, function_name, now, locked_until, self.ttl))
+                return None, locked_until
+            except IntegrityError:
+                pass
+            async with self.engine.begin() as conn:
+                if (await conn.execute(takeover_statement(tool_call_id, function_name, now, locked_until,
+                                                          self.ttl))).rowcount:
+                    return None, locked_until
+                row = (await conn.execute(lookup_statement(tool_call_id, function_name))).first()
+            if row is not None and row.status == 'done':
+                return (row.response,), None
+            if row is not None:
+                await asyncio.sleep(min(delay, self._remaining(tool_call_id, deadline)))
+                delay = min(delay * 2, _MAX_POLL_DELAY)
+
+# Global instance for easy access
+_tool_call_results = None
+_tool_call_results_lock = threading.Lock()
+
+def get_tool_call_results() -> ToolCallResults:
+    """Get or create the process-wide ToolCallResults of the Flask blueprint."""
+    global _tool_call_results
+    if _tool_call_results is None:
+        with _tool_call_results_lock:
+            if _tool_call_results is None:
+                _tool_call_results = ToolCallResults()
+    return _tool_call_results
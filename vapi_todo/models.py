@@ -1,6 +1,7 @@
 # models.py
+from datetime import datetime
 from extensions import db
-from sqlalchemy import Column, Integer, String, Boolean, DateTime
+from sqlalchemy import Column, Integer, String, Text, Boolean, DateTime, JSON, Index, and_, func
 
 class VapiTodo(db.Model):
     __tablename__ = 'todos'
@@ -9,6 +10,18 @@ class VapiTodo(db.Model):
     description = Column(String, nullable=True)
     completed = Column(Boolean, default=False)
     google_calendar_event_id = Column(String, nullable=True)  # Google Calendar event ID
+    google_calendar_etag = Column(String, nullable=True)  # ETag of the event version last synced
+    google_calendar_synced = Column(JSON, nullable=True)  # Event fields as last synced; None: unknown
+    calendar_user_id = Column(String, nullable=True)  # User whose calendar mirrors the row; None: the deployment's own
+    created_at = Column(DateTime, nullable=True, default=datetime.utcnow)
+    updated_at = Column(DateTime, nullable=True, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+    __table_args__ = (
+        # Serves getTodos pages filtered by status: WHERE completed = ? AND id > ? ORDER BY id
+        Index('ix_todos_completed_id', 'completed', 'id'),
+        # Serves incremental exports: WHERE updated_at >= :since (see export.py)
+        Index('ix_todos_updated_at', 'updated_at'),
+    )
 
 class VapiReminder(db.Model):
     __tablename__ = 'reminders'
@@ -16,6 +29,18 @@ class VapiReminder(db.Model):
     reminder_text = Column(String)
     importance = Column(String)
     google_calendar_event_id = Column(String, nullable=True)  # Google Calendar event ID
+    google_calendar_etag = Column(String, nullable=True)  # ETag of the event version last synced
+    google_calendar_synced = Column(JSON, nullable=True)  # Event fields as last synced; None: unknown
+    calendar_user_id = Column(String, nullable=True)  # User whose calendar mirrors the row; None: the deployment's own
+    created_at = Column(DateTime, nullable=True, default=datetime.utcnow)
+    updated_at = Column(DateTime, nullable=True, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+    __table_args__ = (
+        # Serves getReminders pages filtered by importance
+        Index('ix_reminders_importance_id', 'importance', 'id'),
+        # Serves incremental exports: WHERE updated_at >= :since (see export.py)
+        Index('ix_reminders_updated_at', 'updated_at'),
+    )
 
 class VapiCalendarEvent(db.Model):
     __tablename__ = 'calendar_events'
@@ -25,3 +50,81 @@ class VapiCalendarEvent(db.Model):
     event_from = Column(DateTime)
     event_to = Column(DateTime)
     google_calendar_event_id = Column(String, nullable=True)  # Google Calendar event ID
+    google_calendar_etag = Column(String, nullable=True)  # ETag of the event version last synced
+    google_calendar_synced = Column(JSON, nullable=True)  # Event fields as last synced; None: unknown
+    calendar_user_id = Column(String, nullable=True)  # User whose calendar mirrors the row; None: the deployment's own
+    created_at = Column(DateTime, nullable=True, default=datetime.utcnow)
+    updated_at = Column(DateTime, nullable=True, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+    __table_args__ = (
+        # Serves time window and overlap queries: WHERE event_to > :from AND event_from < :to.
+        # Portable fallback for the range index below.
+        Index('ix_calendar_events_event_to_event_from', 'event_to', 'event_from'),
+        # Serves incremental exports: WHERE updated_at >= :since (see export.py)
+        Index('ix_calendar_events_updated_at', 'updated_at'),
+        # On PostgreSQL, overlaps are answered by a GiST index on the [event_from, event_to)
+        # range (see availability.py). Only well-formed intervals are indexed.
+        Index(
+            'ix_calendar_events_period',
+            func.tsrange(event_from, event_to),
+            postgresql_using='gist',
+            postgresql_where=and_(event_from.isnot(None), event_to >= event_from),
+        ).ddl_if(dialect='postgresql'),
+    )
+
+class VapiCalendarSyncJob(db.Model):
+    """Outbox row describing one pending Google Calendar write for a local entity."""
+    __tablename__ = 'calendar_sync_outbox'
+    id = Column(Integer, primary_key=True)
+    entity_type = Column(String, nullable=False)  # 'todo', 'reminder' or 'calendar_event'
+    entity_id = Column(Integer, nullable=False)
+    operation = Column(String, nullable=False)  # 'create', 'update' or 'delete'
+    payload = Column(JSON, nullable=True)  # Event fields for create/update
+    google_calendar_event_id = Column(String, nullable=True)
+    user_id = Column(String, nullable=True)  # Whose calendar to write; None: the deployment's own
+    status = Column(String, nullable=False, default='pending')  # 'pending', 'in_progress', 'done' or 'failed'
+    attempts = Column(Integer, nullable=False, default=0)
+    next_attempt_at = Column(DateTime, nullable=False, default=datetime.utcnow)
+    locked_until = Column(DateTime, nullable=True)
+    last_error = Column(String, nullable=True)
+    created_at = Column(DateTime, nullable=False, default=datetime.utcnow)
+
+    __table_args__ = (
+        Index('ix_calendar_sync_outbox_status_id', 'status', 'id'),
+        Index('ix_calendar_sync_outbox_entity', 'entity_type', 'entity_id', 'id'),
+    )
+
+class VapiCalendarSyncState(db.Model):
+    """Where the incremental pull from Google Calendar left off."""
+    __tablename__ = 'calendar_sync_state'
+    id = Column(Integer, primary_key=True)
+    calendar_id = Column(String, nullable=False, unique=True)
+    sync_token = Column(String, nullable=True)  # nextSyncToken of the last complete listing
+    last_synced_at = Column(DateTime, nullable=True)
+
+class VapiUserCalendarCredential(db.Model):
+    """OAuth token of a user who connected their own Google Calendar (see user_calendars.py)."""
+    __tablename__ = 'calendar_user_credentials'
+    id = Column(Integer, primary_key=True)
+    user_id = Column(String, nullable=False, unique=True)  # The caller's phone number, as VAPI sends it
+    token_json = Column(Text, nullable=False)  # Authorized-user JSON, including the refresh token
+    calendar_id = Column(String, nullable=True)  # None: the user's primary calendar
+    updated_at = Column(DateTime, nullable=False, default=datetime.utcnow)
+
+class VapiToolCallResult(db.Model):
+    """Outcome of a write tool call, so a retried toolCallId is answered without running again (see idempotency.py)."""
+    __tablename__ = 'tool_call_results'
+    id = Column(Integer, primary_key=True)
+    tool_call_id = Column(String, nullable=False)  # ToolCall.id as VAPI sent it
+    function_name = Column(String, nullable=False)
+    status = Column(String, nullable=False, default='in_progress')  # 'in_progress' or 'done'
+    response = Column(JSON, nullable=True)  # The tool's `result`, once done
+    locked_until = Column(DateTime, nullable=True)  # Lease of the attempt in progress
+    expires_at = Column(DateTime, nullable=False)
+    created_at = Column(DateTime, nullable=False, default=datetime.utcnow)
+
+    __table_args__ = (
+        # A toolCallId is only claimed once per tool
+        Index('ux_tool_call_results_call', 'tool_call_id', 'function_name', unique=True),
+        Index('ix_tool_call_results_expires_at', 'expires_at'),
+    )
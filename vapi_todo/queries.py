@@ -0,0 +1,137 @@
+# queries.py
+"""
+Keyset-paginated, filtered and projected reads for the get_* tools.
+
+Pages are ordered by primary key and continue from `after_id`, so every page
+is an index range scan that reads only the rows it returns, however deep
+into the table the caller is. Only the requested columns are selected and
+rows are returned as plain dicts without building a pydantic model per row.
+"""
+import os
+from datetime import datetime, timezone
+from typing import Optional, Dict, Any, List, Sequence, Union
+
+from sqlalchemy import select
+from .replicas import read_rows
+from shared.nl_datetime import parse_event_times
+
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 200
+
+# Timezone of spoken times when the tool call names none
+DEFAULT_TIMEZONE = os.getenv('VAPI_DEFAULT_TIMEZONE', 'UTC')
+
+
+def parse_bool(value: Any) -> Optional[bool]:
+    """Interpret a tool argument as a boolean filter; None means 'no filter'."""
+    if value is None or value == '':
+        return None
+    if isinstance(value, bool):
+        return value
+    text = str(value).strip().lower()
+    if text in ('true', '1', 'yes', 'y', 'completed', 'done'):
+        return True
+    if text in ('false', '0', 'no', 'n', 'open', 'pending'):
+        return False
+    raise ValueError(f"Invalid boolean value '{value}'.")
+
+def as_naive_utc(value: datetime) -> datetime:
+    """Columns hold naive UTC timestamps; convert aware datetimes to match."""
+    if value.tzinfo is not None:
+        return value.astimezone(timezone.utc).replace(tzinfo=None)
+    return value
+
+def parse_datetime(value: Any) -> Optional[datetime]:
+    """Parse an ISO 8601 tool argument; None means 'no bound'."""
+    if value is None or value == '':
+        return None
+    try:
+        parsed = datetime.fromisoformat(str(value).replace('Z', '+00:00'))
+    except ValueError:
+        raise ValueError(f"Invalid ISO datetime '{value}'.")
+    return as_naive_utc(parsed)
+
+def parse_entry_times(event_from: Optional[str], event_to: Optional[str],
+                      duration: Union[str, int, None] = None, tz_name: Optional[str] = None):
+    """
+    Parse the event_from/event_to/duration arguments of a calendar entry:
+    ISO 8601 or spoken ('next tuesday at 3pm', 'for 45 minutes'), in the
+    caller's timezone (see shared/nl_datetime.py).
+
+    Raises:
+        ValueError: If a time is not understood, or the end is not after the start
+    """
+    start_time, end_time = parse_event_times(event_from, event_to, duration, tz_name or DEFAULT_TIMEZONE)
+    # Stored as naive UTC, like every other timestamp column
+    return (as_naive_utc(start_time) if start_time else None,
+            as_naive_utc(end_time) if end_time else None)
+
+def parse_page_args(args: Dict[str, Any], response_model) -> Dict[str, Any]:
+    """
+    Validate the paging and projection arguments shared by all get_* tools.
+
+    Args:
+        args: Tool call arguments
+        response_model: Pydantic response schema whose fields may be projected
+
+    Returns:
+        Dict with 'after_id', 'limit', 'fields' and 'paged'. Without
+        'after_id' or 'limit' the call is not paged: it gets the bare list
+        the tools returned before paging, unless there are more than
+        MAX_PAGE_SIZE rows (see page_result).
+
+    Raises:
+        ValueError: If an argument is malformed
+    """
+    paged = args.get('after_id') not in (None, '') or args.get('limit') not in (None, '')
+    try:
+        after_id = int(args['after_id']) if args.get('after_id') not in (None, '') else None
+        limit = int(args['limit']) if args.get('limit') not in (None, '') else (
+            DEFAULT_PAGE_SIZE if paged else MAX_PAGE_SIZE)
+    except (TypeError, ValueError):
+        raise ValueError("'after_id' and 'limit' must be integers.")
+    limit = max(1, min(limit, MAX_PAGE_SIZE))
+
+    allowed = list(response_model.model_fields)
+    fields = args.get('fields')
+    if fields in (None, '', []):
+        fields = allowed
+    else:
+        if isinstance(fields, str):
+            fields = [field.strip() for field in fields.split(',') if field.strip()]
+        unknown = [field for field in fields if field not in allowed]
+        if unknown:
+            raise ValueError(f"Unknown fields {unknown}; choose from {allowed}.")
+        if 'id' not in fields:
+            fields = ['id'] + list(fields)
+    return {'after_id': after_id, 'limit': limit, 'fields': fields, 'paged': paged}
+
+def page_statement(model, fields: Sequence[str], filters: Sequence = (),
+                   after_id: Optional[int] = None, limit: int = DEFAULT_PAGE_SIZE):
+    """
+    Build the SELECT for one page. One extra row is fetched to detect whether
+    another page follows.
+    """
+    stmt = select(*[getattr(model, field) for field in fields]).where(*filters)
+    if after_id is not None:
+        stmt = stmt.where(model.id > after_id)
+    return stmt.order_by(model.id).limit(limit + 1)
+
+def page_result(rows, limit: int, paged: bool = True) -> Union[Dict[str, Any], List[Dict[str, Any]]]:
+    """
+    Turn fetched rows into the tool result: the items plus the next cursor.
+    An unpaged call gets just the items when they are all of them; when
+    rows were left out it gets the cursor too, so nothing is dropped silently.
+    """
+    items: List[Dict[str, Any]] = [dict(row._mapping) for row in rows[:limit]]
+    if not paged and len(rows) <= limit:
+        return items
+    next_after_id = items[-1]['id'] if len(rows) > limit else None
+    return {'items': items, 'next_after_id': next_after_id}
+
+def fetch_page(model, fields: Sequence[str], filters: Sequence = (),
+               after_id: Optional[int] = None, limit: int = DEFAULT_PAGE_SIZE,
+               paged: bool = True) -> Union[Dict[str, Any], List[Dict[str, Any]]]:
+    """Run a page query on the Flask-SQLAlchemy session, or the tool call's replica (see replicas.py)."""
+    rows = read_rows(page_statement(model, fields, filters, after_id, limit))
+    return page_result(rows, limit, paged)
@@ -0,0 +1,274 @@
+# reconcile.py
+"""
+Reconciliation and backfill between the local tables and Google Calendar.
+
+The outbox retries failed syncs, but gives up after MAX_ATTEMPTS, and
+anything that went wrong before it existed is never retried. This job
+compares the two sides and repairs the differences, with the local
+tables as the source of truth (run `calendar-pull` first to take in edits
+made in Google):
+
+* rows without a Google event get one;
+* events whose row is gone, or that duplicate a row's event, are deleted;
+* events whose title, description or times differ from the row are patched.
+
+Events are matched to rows through the private extended properties every
+event the app creates carries (`vapiEntity`, `vapiId`; see
+calendar_sync.event_properties). Events created before the tags existed
+are found through the row's google_calendar_event_id and are tagged by the
+same patch. One pass per entity type: the tagged events are listed into a
+dict keyed by local id, then the rows are walked in id order, so the work
+is linear in rows plus events. Repairs go out through batch_execute.
+"""
+import os
+from datetime import datetime, timedelta
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
+
+from sqlalchemy import bindparam, select, update
+from extensions import db
+from shared.google_calendar import get_calendar_service
+from .models import VapiCalendarSyncJob
+from .calendar_sync import (
+    ENTITY_MODELS, todo_event_fields, reminder_event_fields, calendar_event_fields, event_properties,
+)
+from .calendar_pull import _google_time
+
+EVENT_FIELDS = {
+    'todo': todo_event_fields,
+    'reminder': reminder_event_fields,
+    'calendar_event': calendar_event_fields,
+}
+
+# Rows read per query, and repairs sent per flush
+RECONCILE_PAGE_SIZE = int(os.getenv('VAPI_RECONCILE_PAGE_SIZE', '1000'))
+RECONCILE_BATCH_SIZE = int(os.getenv('VAPI_RECONCILE_BATCH_SIZE', '500'))
+
+_LIST_FIELDS = 'id,summary,description,start,end,extendedProperties'
+
+# A Google event reduced to what is compared: (event id, fingerprint of the
+# text fields, fingerprint of text and times). Keeps the listing small in memory.
+Remote = Tuple[str, int, int]
+
+def _second(value: Optional[datetime]) -> Optional[datetime]:
+    # Google keeps whole seconds.
+    return value.replace(microsecond=0) if value else None
+
+def _fingerprints(title, description, start, end) -> Tuple[int, int]:
+    text = (title or '', description or '')
+    return hash(text), hash(text + (_second(start), _second(end)))
+
+def _remote(event: Dict[str, Any]) -> Remote:
+    return (event['id'], *_fingerprints(event.get('summary'), event.get('description'),
+                                        _google_time(event.get('start')), _google_time(event.get('end'))))
+
+def _expected(entity_type: str, row) -> Tuple[Dict[str, Any], bool]:
+    """
+    The event fields a row should have, and whether its times are compared.
+    Only calendar entries have times of their own; todos and reminders sit
+    at their creation time, like the outbox puts them.
+    """
+    fields = EVENT_FIELDS[entity_type](row)
+    fields['start_time'] = fields['end_time'] = None
+    if entity_type == 'calendar_event' and row.event_from:
+        fields['start_time'] = row.event_from
+        fields['end_time'] = row.event_to or row.event_from + timedelta(hours=1)
+        return fields, True
+    return fields, False
+
+def _matches(remote: Remote, fields: Dict[str, Any], with_times: bool) -> bool:
+    text, full = _fingerprints(fields['title'], fields['description'], fields['start_time'], fields['end_time'])
+    return remote[2] == full if with_times else remote[1] == text
+
+class _Repairs:
+    """Pending repairs of one entity type, sent in batches."""
+
+    def __init__(self, service, model, entity_type: str, stats: Dict[str, int], dry_run: bool,
+                 batch_size: int, progress: Optional[Callable[[Dict[str, int]], None]]):
+        self.service = service
+        self.table = model.__table__
+        self.entity_type = entity_type
+        self.stats = stats
+        self.dry_run = dry_run
+        self.batch_size = batch_size
+        self.progress = progress
+        self.operations: List[Dict[str, Any]] = []
+        self.actions: List[Tuple[str, Optional[int]]] = []  # (stat to count, local id or None)
+        self.event_ids: List[Dict[str, Any]] = []  # Google event IDs to write back
+
+    def add(self, action: str, operation: Dict[str, Any], row_id: Optional[int] = None):
+        self.operations.append(operation)
+        self.actions.append((action, row_id))
+        if len(self.operations) >= self.batch_size:
+            self.flush()
+
+    def create(self, row, fields: Dict[str, Any]):
+        start = fields['start_time']
+        if start is None and self.entity_type != 'calendar_event':
+            start = row.created_at
+        self.add('created', {'op': 'create', 'title': fields['title'], 'description': fields['description'],
+                             'start_time': start, 'end_time': fields['end_time'],
+                             'properties': event_properties(self.entity_type, row.id)}, row.id)
+
+    def update(self, row, event_id: str, fields: Dict[str, Any], action: str = 'updated'):
+        operation = {'op': 'update', 'event_id': event_id, 'title': fields['title'],
+                     'description': fields['description'],
+                     'properties': event_properties(self.entity_type, row.id)}
+        if fields['start_time']:
+            operation.update(start_time=fields['start_time'], end_time=fields['end_time'])
+        self.add(action, operation, row.id)
+
+    def delete(self, event_id: str):
+        self.add('deleted', {'op': 'delete', 'event_id': event_id})
+
+    def adopt(self, row_id: int, event_id: str):
+        """Record an event that exists in Google but whose ID never reached the row."""
+        self.stats['adopted'] += 1
+        self.event_ids.append({'row_id': row_id, 'event_id': event_id, 'etag': None})
+
+    def _send(self, operations: List[Dict[str, Any]], actions: List[Tuple[str, Optional[int]]]):
+        if self.dry_run:
+            for action, _ in actions:
+                self.stats[action] += 1
+            return
+        for operation, (action, row_id), result in zip(operations, actions,
+                                                       self.service.batch_execute(operations)):
+            if result['ok']:
+                self.stats[action] += 1
+                if row_id is not None:
+                    self.event_ids.append({'row_id': row_id, 'event_id': result['event_id'],
+                                           'etag': (result.get('event') or {}).get('etag')})
+            elif action == 'tagged' and result.get('status') in (404, 410):
+                # The row pointed at an event that no longer exists: create it again.
+                operation = {key: value for key, value in operation.items() if key != 'event_id'}
+                operation['op'] = 'create'
+                self.operations.append(operation)
+                self.actions.append(('created', row_id))
+            else:
+                self.stats['failed'] += 1
+
+    def flush(self):
+        """
+        Send every pending repair and write the event IDs and ETags back. The
+        last-synced fields are cleared, so the next outbox update sends them all.
+        """
+        while self.operations:
+            operations, actions = self.operations[:self.batch_size], self.actions[:self.batch_size]
+            del self.operations[:self.batch_size], self.actions[:self.batch_size]
+            self._send(operations, actions)
+        if self.event_ids and not self.dry_run:
+            db.session.execute(
+                update(self.table).where(self.table.c.id == bindparam('row_id'))
+                .values(google_calendar_event_id=bindparam('event_id'), google_calendar_etag=bindparam('etag'),
+                        google_calendar_synced=None),
+                self.event_ids)
+            db.session.commit()
+        self.event_ids = []
+        if self.progress is not None:
+            self.progress(self.stats)
+
+def _unsynced_ids(entity_type: str) -> set:
+    """Rows with outbox jobs still pending: the outbox is about to change their event."""
+    return set(db.session.execute(select(VapiCalendarSyncJob.entity_id).where(
+        VapiCalendarSyncJob.entity_type == entity_type,
+        VapiCalendarSyncJob.status.in_(('pending', 'in_progress')))).scalars())
+
+def _reconcile_entity(service, entity_type: str, user_id: Optional[str], repairs: _Repairs,
+                      page_size: int):
+    stats = repairs.stats
+    table = ENTITY_MODELS[entity_type].__table__
+
+    # Google side: local id -> event; further events tagged with the same id are duplicates.
+    remote: Dict[int, Remote] = {}
+    duplicates: Dict[int, List[Remote]] = {}
+    for events in service.list_events({'vapiEntity': entity_type}, fields=_LIST_FIELDS):
+        for event in events:
+            stats['events'] += 1
+            try:
+                local_id = int(event['extendedProperties']['private']['vapiId'])
+            except (KeyError, TypeError, ValueError):
+                continue
+            if local_id in remote:
+                duplicates.setdefault(local_id, []).append(_remote(event))
+            else:
+                remote[local_id] = _remote(event)
+
+    unsynced = _unsynced_ids(entity_type)
+    owner = table.c.calendar_user_id.is_(None) if user_id is None else table.c.calendar_user_id == user_id
+    after_id = 0
+    while True:
+        # Keyset pages rather than one long cursor, so repairs can commit in between.
+        rows = db.session.execute(select(table).where(owner, table.c.id > after_id)
+                                  .order_by(table.c.id).limit(page_size)).all()
+        db.session.commit()
+        if not rows:
+            break
+        after_id = rows[-1].id
+        for row in rows:
+            stats['rows'] += 1
+            candidates = [remote.pop(row.id)] + duplicates.pop(row.id, []) if row.id in remote else []
+            if row.id in unsynced:
+                stats['skipped'] += 1
+                continue
+            current = row.google_calendar_event_id
+            if current:
+                match = next((candidate for candidate in candidates if candidate[0] == current), None)
+            else:
+                match = candidates[0] if candidates else None
+            for candidate in candidates:
+                if candidate is not match:
+                    repairs.delete(candidate[0])
+
+            fields, with_times = _expected(entity_type, row)
+            if match is None and current:
+                repairs.update(row, current, fields, 'tagged')  # Untagged, or gone (then recreated)
+            elif match is None:
+                repairs.create(row, fields)
+            else:
+                if not current:
+                    repairs.adopt(row.id, match[0])
+                if _matches(match, fields, with_times):
+                    stats['unchanged'] += 1
+                else:
+                    repairs.update(row, match[0], fields)
+
+    # Whatever is left belongs to no row of this calendar.
+    for entry in remote.values():
+        repairs.delete(entry[0])
+    for entries in duplicates.values():
+        for entry in entries:
+            repairs.delete(entry[0])
+    repairs.flush()
+
+def reconcile_calendar(user_id: Optional[str] = None, entity_types: Sequence[str] = tuple(ENTITY_MODELS),
+                       dry_run: bool = False, batch_size: int = RECONCILE_BATCH_SIZE,
+                       page_size: int = RECONCILE_PAGE_SIZE, calendar_service=None,
+                       progress: Optional[Callable[[Dict[str, int]], None]] = None) -> Dict[str, int]:
+    """
+    Reconcile one calendar with the rows it mirrors.
+
+    Args:
+        user_id: Calendar user (see user_calendars.py); None for the deployment's calendar
+        entity_types: Keys of ENTITY_MODELS to reconcile
+        dry_run: Count the repairs without making them
+        batch_size: Repairs per batch_execute call
+        page_size: Local rows per query
+        calendar_service: Service to use (default: get_calendar_service(user_id))
+        progress: Called with the running counts after every batch
+
+    Returns:
+        Counts of 'rows' and 'events' seen, rows 'skipped' (outbox busy) and
+        'unchanged', and repairs 'created', 'updated', 'tagged', 'adopted',
+        'deleted' and 'failed'. In a dry run the repairs are the planned ones.
+
+    Raises:
+        ValueError: If the user has no calendar credentials
+    """
+    service = calendar_service or get_calendar_service(user_id)
+    if service is None:
+        raise ValueError(f"No calendar credentials stored for user {user_id}.")
+    stats = dict.fromkeys(('rows', 'events', 'skipped', 'unchanged', 'created', 'updated',
+                           'tagged', 'adopted', 'deleted', 'failed'), 0)
+    for entity_type in entity_types:
+        repairs = _Repairs(service, ENTITY_MODELS[entity_type], entity_type, stats, dry_run, batch_size, progress)
+        _reconcile_entity(service, entity_type, user_id, repairs, page_size)
+    return stats
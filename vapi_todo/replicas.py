@@ -0,0 +1,213 @@
+# replicas.py
+"""
+Read-replica routing for the Flask blueprint.
+
+Set VAPI_DB_REPLICAS to a JSON list of replica databases of the primary,
+either URLs or objects with a `url` and create_engine options:
+
+    VAPI_DB_REPLICAS='["postgresql://replica1/vapi", {"url": "postgresql://replica2/vapi", "pool_size": 20}]'
+
+Read-only tools (tools.READ_ONLY_TOOLS) then run their queries on the
+replicas, round robin; writes and everything else stay on the primary
+engine of Flask-SQLAlchemy. So that callers see their own changes, the
+reads of a conversation go to the primary for VAPI_READ_YOUR_WRITES_SECONDS
+after it wrote anything. The window lives in the read cache's backend, so
+it covers every process when VAPI_CACHE_URL is set.
+
+A replica whose query fails with a connection error is marked down for
+VAPI_REPLICA_RETRY_SECONDS, and the query is retried on another replica, or
+on the primary when none is left. Once that time has passed, the replica is
+probed with `SELECT 1` before it gets reads again.
+
+Engine options default to VAPI_DB_ENGINE_OPTIONS (JSON, with pool_pre_ping
+on), and each replica can override them. Use engine_options() for the
+primary's SQLALCHEMY_ENGINE_OPTIONS to size its pool the same way.
+"""
+import os
+import json
+import time
+import itertools
+import threading
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+from sqlalchemy import create_engine, text
+from sqlalchemy.engine import Engine
+from sqlalchemy.exc import OperationalError
+from extensions import db
+from shared.cache import get_read_cache
+
+READ_YOUR_WRITES_SECONDS = float(os.getenv('VAPI_READ_YOUR_WRITES_SECONDS', '10'))
+REPLICA_RETRY_SECONDS = float(os.getenv('VAPI_REPLICA_RETRY_SECONDS', '30'))
+
+def engine_options(overrides: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+    """
+    create_engine options: pool_pre_ping, then VAPI_DB_ENGINE_OPTIONS, then `overrides`.
+
+    Raises:
+        ValueError: If VAPI_DB_ENGINE_OPTIONS is not a JSON object
+    """
+    options = {'pool_pre_ping': True}
+    configured = json.loads(os.getenv('VAPI_DB_ENGINE_OPTIONS') or '{}')
+    if not isinstance(configured, dict):
+        raise ValueError('VAPI_DB_ENGINE_OPTIONS must be a JSON object.')
+    options.update(configured)
+    options.update(overrides or {})
+    return options
+
+def parse_replicas(value: Optional[str]) -> List[Tuple[str, Dict[str, Any]]]:
+    """
+    (url, engine options) of each replica in a VAPI_DB_REPLICAS value.
+
+    Raises:
+        ValueError: If the value is not a JSON list of URLs and {"url": ...} objects
+    """
+    try:
+        entries = json.loads(value or '[]')
+    except ValueError as e:
+        raise ValueError(f'VAPI_DB_REPLICAS is not valid JSON: {e}')
+    if not isinstance(entries, list):
+        raise ValueError('VAPI_DB_REPLICAS must be a JSON list.')
+    replicas = []
+    for entry in entries:
+        if isinstance(entry, str):
+            entry = {'url': entry}
+        if not isinstance(entry, dict) or not entry.get('url'):
+            raise ValueError(f'Replica entries need a url: {entry!r}')
+        options = dict(entry)
+        replicas.append((options.pop('url'), engine_options(options)))
+    return replicas
+
+class ReplicaSet:
+    """Replica engines, picked round robin among the healthy ones."""
+
+    def __init__(self, engines: Sequence[Engine], retry_after: float = REPLICA_RETRY_SECONDS):
+        self.engines = list(engines)
+        self.retry_after = retry_after
+        self._down_until = [0.0] * len(self.engines)
+        self._turn = itertools.count()
+        self._lock = threading.Lock()
+
+    def pick(self) -> Optional[Engine]:
+        """The next healthy replica, or None when all of them are down."""
+        start = next(self._turn)
+        for offset in range(len(self.engines)):
+            index = (start + offset) % len(self.engines)
+            if self._available(index):
+                return self.engines[index]
+        return None
+
+    def mark_down(self, engine: Engine, error: Exception):
+        index = self.engines.index(engine)
+        print(f'Read replica {index} failed, using the others for {self.retry_after:g}s: {error}')
+        self._down_until[index] = time.monotonic() + self.retry_after
+
+    def _available(self, index: int) -> bool:
+        if not self._down_until[index]:
+            return True
+        with self._lock:
+            # Only one caller probes; the others keep skipping the replica meanwhile.
+            if time.monotonic() < self._down_until[index]:
+                return False
+            self._down_until[index] = time.monotonic() + self.retry_after
+        try:
+            with self.engines[index].connect() as connection:
+                connection.execute(text('SELECT 1'))
+        except OperationalError as e:
+            print(f'Read replica {index} is still down: {e}')
+            return False
+        self._down_until[index] = 0.0
+        return True
+
+    def dispose(self):
+        for engine in self.engines:
+            engine.dispose()
+
+# Global instance for easy access
+_replica_set = None
+_replica_set_loaded = False
+_replica_set_lock = threading.Lock()
+
+def get_replica_set() -> Optional[ReplicaSet]:
+    """The replicas of VAPI_DB_REPLICAS, created on first use; None if there are none."""
+    global _replica_set, _replica_set_loaded
+    if not _replica_set_loaded:
+        with _replica_set_lock:
+            if not _replica_set_loaded:
+                replicas = parse_replicas(os.getenv('VAPI_DB_REPLICAS'))
+                if replicas:
+                    _replica_set = ReplicaSet([create_engine(url, **options) for url, options in replicas])
+                _replica_set_loaded = True
+    return _replica_set
+
+def set_replica_set(replica_set: Optional[ReplicaSet]):
+    """Replace the replicas, e.g. with engines of local SQLite copies for testing."""
+    global _replica_set, _replica_set_loaded
+    with _replica_set_lock:
+        _replica_set = replica_set
+        _replica_set_loaded = True
+
+# --- Routing (request path) ---
+
+_conversation: ContextVar[Optional[str]] = ContextVar('vapi_conversation', default=None)
+_read_engine: ContextVar[Optional[Engine]] = ContextVar('vapi_read_engine', default=None)
+
+@contextmanager
+def conversation(conversation_id: Optional[str]):
+    """Attribute the enclosed tool calls to a conversation, for read-your-writes."""
+    token = _conversation.set(conversation_id)
+    try:
+        yield
+    finally:
+        _conversation.reset(token)
+
+def current_conversation() -> Optional[str]:
+    return _conversation.get()
+
+def _window_key(conversation_id: str) -> str:
+    cache = get_read_cache()
+    return f'{cache.namespace}:wrote:{conversation_id}'
+
+def record_write():
+    """Send the conversation's reads to the primary for a while. Call after a write commits."""
+    conversation_id = _conversation.get()
+    if conversation_id is not None and get_replica_set() is not None:
+        get_read_cache().backend.set(_window_key(conversation_id), True, READ_YOUR_WRITES_SECONDS)
+
+@contextmanager
+def replica_reads():
+    """Run the enclosed reads (see read_rows) on a replica, unless the conversation just wrote."""
+    replica_set = get_replica_set()
+    engine = None
+    if replica_set is not None:
+        conversation_id = _conversation.get()
+        if conversation_id is None or get_read_cache().backend.get(_window_key(conversation_id)) is None:
+            engine = replica_set.pick()
+    token = _read_engine.set(engine)
+    try:
+        yield
+    finally:
+        _read_engine.reset(token)
+
+def read_source() -> str:
+    """'replica' or 'primary': where the running tool call's reads go."""
+    return 'primary' if _read_engine.get() is None else 'replica'
+
+def read_rows(statement) -> List[Any]:
+    """
+    Execute a SELECT where the running tool call's reads go and return its
+    rows. A replica that fails is marked down and the next one is tried,
+    then the primary (the Flask-SQLAlchemy session).
+    """
+    engine = _read_engine.get()
+    while engine is not None:
+        try:
+            with engine.connect() as connection:
+                return connection.execute(statement).all()
+        except OperationalError as e:
+            replica_set = get_replica_set()
+            replica_set.mark_down(engine, e)
+            engine = replica_set.pick()
+            _read_engine.set(engine)
+    return db.session.execute(statement).all()
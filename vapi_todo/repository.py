@@ -0,0 +1,64 @@
+# repository.py
+"""
+Single-statement writes for VapiTodo, VapiReminder and VapiCalendarEvent.
+
+Every write is one INSERT / UPDATE / DELETE ... RETURNING, so a tool call
+never reads a row back before or after changing it. A missing row shows up
+as an empty RETURNING result, i.e. an affected row count of zero.
+
+The *_statement builders only depend on the models' tables and can be run on
+any SQLAlchemy connection or session; the other functions execute them on
+the Flask-SQLAlchemy session without committing.
+"""
+from typing import Optional, Dict, Any, List, Sequence
+
+from sqlalchemy import insert, update, delete
+from sqlalchemy.engine import Row
+from extensions import db
+
+# --- Statement builders ---
+
+def _where_ids(model, ids: Sequence[int]):
+    table = model.__table__
+    return table.c.id == ids[0] if len(ids) == 1 else table.c.id.in_(ids)
+
+def insert_statement(model):
+    """INSERT returning every column; execute with one parameter dict per row."""
+    table = model.__table__
+    return insert(table).returning(*table.c, sort_by_parameter_order=True)
+
+def update_statement(model, ids: Sequence[int], values: Dict[str, Any]):
+    """UPDATE the given rows, returning every column of the updated ones."""
+    table = model.__table__
+    return update(table).where(_where_ids(model, ids)).values(**values).returning(*table.c)
+
+def delete_statement(model, ids: Sequence[int]):
+    """DELETE the given rows, returning what the outbox needs to remove their events."""
+    table = model.__table__
+    return delete(table).where(_where_ids(model, ids)).returning(
+        table.c.id, table.c.google_calendar_event_id, table.c.calendar_user_id)
+
+# --- Executors (Flask-SQLAlchemy session, no commit) ---
+
+def insert_rows(model, values: List[Dict[str, Any]]) -> List[Row]:
+    """Insert rows in one multi-row statement; returned rows are in input order."""
+    return db.session.execute(insert_statement(model), values).all()
+
+def insert_row(model, values: Dict[str, Any]) -> Row:
+    return db.session.execute(insert_statement(model), [values]).one()
+
+def update_rows(model, ids: Sequence[int], values: Dict[str, Any]) -> List[Row]:
+    """Update rows by ID; IDs that do not exist are simply absent from the result."""
+    return db.session.execute(update_statement(model, ids, values)).all()
+
+def update_row(model, entity_id: int, values: Dict[str, Any]) -> Optional[Row]:
+    """Update one row; None if it does not exist."""
+    return db.session.execute(update_statement(model, [entity_id], values)).first()
+
+def delete_rows(model, ids: Sequence[int]) -> List[Row]:
+    """Delete rows by ID; IDs that do not exist are simply absent from the result."""
+    return db.session.execute(delete_statement(model, ids)).all()
+
+def delete_row(model, entity_id: int) -> Optional[Row]:
+    """Delete one row; None if it does not exist."""
+    return db.session.execute(delete_statement(model, [entity_id])).first()
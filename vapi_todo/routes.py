@@ -1,12 +1,21 @@
 import os
+import hmac
+import time
+import click
 import markdown2
-from datetime import datetime, timedelta
-from flask import Blueprint, request, jsonify, abort, render_template, current_app
-from extensions import db
-from .models import VapiTodo, VapiReminder, VapiCalendarEvent # Models are specific, so they stay
-from shared.schemas import TodoResponse, ReminderResponse, CalendarEventResponse
-from shared.helpers import get_validated_tool_call
-from shared.google_calendar import get_calendar_service
+from flask import (
+    Blueprint, Response, jsonify, render_template, current_app, g, request, abort, stream_with_context,
+)
+from .calendar_sync import ENTITY_MODELS, CalendarSyncWorkerPool, start_calendar_sync_workers, calendar_user
+from .calendar_pull import pull_calendar_changes
+from .export import export_lines, gzip_chunks, parse_entities
+from .reconcile import RECONCILE_BATCH_SIZE, reconcile_calendar
+from .replicas import conversation
+from .queries import parse_datetime
+from .tools import call_tool, run_tool_calls
+from .user_calendars import authorize_user, calendar_user_for, enable_user_calendars
+from shared.helpers import get_validated_tool_call, get_validated_tool_calls, get_caller_id, get_conversation_id
+from shared.metrics import timed_tool, phase, server_timing, render_metrics, PROMETHEUS_CONTENT_TYPE
 
 vapi_flask_bp = Blueprint(
     'vapi_flask',
@@ -16,229 +25,204 @@ vapi_flask_bp = Blueprint(
     static_url_path='/static'
 )
 
+enable_user_calendars()
+
+@vapi_flask_bp.before_app_request
+def _start_calendar_sync():
+    # Started lazily so each (possibly forked) worker process gets its own threads.
+    start_calendar_sync_workers(current_app._get_current_object())
+
+@vapi_flask_bp.cli.command('calendar-sync')
+@click.option('--workers', default=4, show_default=True, help='Number of worker threads.')
+def calendar_sync_command(workers):
+    """Drain the Google Calendar outbox until interrupted."""
+    pool = CalendarSyncWorkerPool(current_app._get_current_object(), num_workers=workers)
+    pool.start()
+    try:
+        pool.join()
+    except KeyboardInterrupt:
+        pool.stop()
+
+@vapi_flask_bp.cli.command('calendar-pull')
+@click.option('--interval', type=float, default=0, help='Repeat every N seconds instead of running once.')
+def calendar_pull_command(interval):
+    """Pull changes made in Google Calendar into the local tables."""
+    while True:
+        stats = pull_calendar_changes()
+        click.echo(f"Calendar pull: {stats}")
+        if not interval:
+            break
+        time.sleep(interval)
+
+@vapi_flask_bp.cli.command('calendar-authorize')
+@click.argument('user_id')
+@click.option('--calendar-id', default=None, help="Calendar to sync to (default: the user's primary calendar).")
+@click.option('--credentials-file', default='credentials.json', show_default=True,
+              help='OAuth client secrets, unless GOOGLE_CREDENTIALS_B64 is set.')
+def calendar_authorize_command(user_id, calendar_id, credentials_file):
+    """Connect USER_ID (the caller's phone number) to their own Google Calendar."""
+    authorize_user(user_id, credentials_file, calendar_id)
+    click.echo(f"Stored Google Calendar credentials for {user_id}.")
+
+@vapi_flask_bp.cli.command('calendar-reconcile')
+@click.option('--user', 'user_id', default=None, help="Reconcile this user's calendar instead of the deployment's.")
+@click.option('--entity', 'entity_types', multiple=True, type=click.Choice(list(ENTITY_MODELS)),
+              help='Entity type to reconcile (repeatable; default: all).')
+@click.option('--dry-run', is_flag=True, help='Only count the repairs.')
+@click.option('--batch-size', type=int, default=RECONCILE_BATCH_SIZE, show_default=True,
+              help='Repairs per batch request.')
+def calendar_reconcile_command(user_id, entity_types, dry_run, batch_size):
+    """Repair differences between the local tables and Google Calendar."""
+    def progress(stats):
+        click.echo(' '.join(f'{key}={value}' for key, value in stats.items()), err=True)
+    try:
+        stats = reconcile_calendar(user_id, entity_types or tuple(ENTITY_MODELS), dry_run=dry_run,
+                                   batch_size=batch_size, progress=progress)
+    except ValueError as e:
+        raise click.ClickException(str(e))
+    click.echo(f"Calendar reconcile{' (dry run)' if dry_run else ''}: {stats}")
+
+@vapi_flask_bp.cli.command('export')
+@click.option('--entities', default='', help='Comma-separated tables to export (default: all).')
+@click.option('--updated-since', default=None, help='Only rows created or updated since this ISO 8601 time.')
+@click.option('--output', '-o', type=click.File('wb'), default='-', help='File to write (default: stdout).')
+@click.option('--gzip', 'compress', is_flag=True, help='Gzip the output.')
+def export_command(entities, updated_since, output, compress):
+    """Stream todos, reminders and calendar events as NDJSON."""
+    try:
+        entities = parse_entities(entities)
+        updated_since = parse_datetime(updated_since)
+    except ValueError as e:
+        raise click.BadParameter(str(e))
+    chunks = export_lines(entities, updated_since)
+    for chunk in gzip_chunks(chunks) if compress else chunks:
+        output.write(chunk)
+
+@vapi_flask_bp.after_request
+def _add_server_timing(response):
+    timer = g.pop('vapi_phase_timer', None)
+    if timer is not None:
+        response.headers['Server-Timing'] = server_timing(timer)
+    return response
+
+@vapi_flask_bp.route('/export')
+def export():
+    """
+    Stream the tables as NDJSON (see export.py), gzipped if the client accepts it.
+    Query parameters: `entities` and `updated_since`. Requests must send
+    VAPI_EXPORT_TOKEN as a bearer token; without one configured the endpoint
+    does not exist (404) and only the `export` command is available.
+    """
+    token = os.getenv('VAPI_EXPORT_TOKEN')
+    if not token:
+        abort(404)
+    if not hmac.compare_digest(request.headers.get('Authorization', ''), f'Bearer {token}'):
+        abort(401, description='Missing or invalid export token.')
+    try:
+        entities = parse_entities(request.args.get('entities'))
+        updated_since = parse_datetime(request.args.get('updated_since'))
+    except ValueError as e:
+        abort(400, description=str(e))
+
+    chunks = export_lines(entities, updated_since)
+    headers = {'Vary': 'Accept-Encoding'}
+    if 'gzip' in request.accept_encodings:
+        chunks = gzip_chunks(chunks)
+        headers['Content-Encoding'] = 'gzip'
+    return Response(stream_with_context(chunks), mimetype='application/x-ndjson', headers=headers)
+
+@vapi_flask_bp.route('/metrics')
+def metrics():
+    """Prometheus scrape endpoint (metrics of this process only)."""
+    return Response(render_metrics(), content_type=PROMETHEUS_CONTENT_TYPE)
+
+def _single_tool_response(function_name: str):
+    """Serve one tool through its dedicated route; errors become HTTP errors as before."""
+    with timed_tool(function_name) as timer:
+        g.vapi_phase_timer = timer
+        with phase('parse'):
+            tool_call = get_validated_tool_call(function_name)
+        with calendar_user(calendar_user_for(get_caller_id())), conversation(get_conversation_id()):
+            result = call_tool(tool_call, tool_call.function.arguments)
+    return jsonify({'results': [{'toolCallId': tool_call.id, 'result': result}]})
+
+@vapi_flask_bp.route('/tools', methods=['POST'])
+def dispatch_tools():
+    """
+    Run every tool call in the message concurrently and return all results at once.
+    'dispatch' times the message's parse and total; each call's phases go under its own tool.
+    """
+    with timed_tool('dispatch') as timer:
+        g.vapi_phase_timer = timer
+        with phase('parse'):
+            tool_calls = get_validated_tool_calls()
+        with calendar_user(calendar_user_for(get_caller_id())), conversation(get_conversation_id()):
+            results = run_tool_calls(current_app._get_current_object(), tool_calls)
+    return jsonify({'results': results})
+
 @vapi_flask_bp.route('/create_todo', methods=['POST'])
 def create_todo():
-    tool_call = get_validated_tool_call('createTodo')
-    args = tool_call.function.arguments
-    title = args.get('title', '')
-    description = args.get('description', '')
-    
-    # Create todo in database
-    todo = VapiTodo(title=title, description=description)
-    db.session.add(todo)
-    db.session.commit()
-    db.session.refresh(todo)
-    
-    # Sync with Google Calendar
-    try:
-        calendar_service = get_calendar_service()
-        google_event_id = calendar_service.create_event(
-            title=f"TODO: {title}",
-            description=description or "Task from VAPI Todo System"
-        )
-        if google_event_id:
-            todo.google_calendar_event_id = google_event_id
-            db.session.commit()
-    except Exception as e:
-        print(f"Failed to sync with Google Calendar: {e}")
-    
-    return jsonify({'results': [{'toolCallId': tool_call.id, 'result': 'success'}]})
+    return _single_tool_response('createTodo')
 
 @vapi_flask_bp.route('/get_todos', methods=['POST'])
 def get_todos():
-    tool_call = get_validated_tool_call('getTodos')
-    todos_db = db.session.query(VapiTodo).all()
-    todos_response = [TodoResponse.model_validate(todo).model_dump() for todo in todos_db]
-    return jsonify({'results': [{'toolCallId': tool_call.id, 'result': todos_response}]})
+    return _single_tool_response('getTodos')
 
 @vapi_flask_bp.route('/complete_todo', methods=['POST'])
 def complete_todo():
-    tool_call = get_validated_tool_call('completeTodo')
-    args = tool_call.function.arguments
-    todo_id = args.get('id')
-    if not todo_id:
-        abort(400, description='Missing To-Do ID in arguments.')
-    
-    todo = db.session.query(VapiTodo).filter(VapiTodo.id == todo_id).first()
-    if not todo:
-        abort(404, description='Todo not found.')
-    
-    todo.completed = True
-    db.session.commit()
-    
-    # Update Google Calendar event
-    if todo.google_calendar_event_id:
-        try:
-            calendar_service = get_calendar_service()
-            calendar_service.update_event(
-                event_id=todo.google_calendar_event_id,
-                title=f"COMPLETED: {todo.title}",
-                description=f"{todo.description or ''}\n\nStatus: Completed"
-            )
-        except Exception as e:
-            print(f"Failed to update Google Calendar event: {e}")
-    
-    return jsonify({'results': [{'toolCallId': tool_call.id, 'result': 'success'}]})
+    return _single_tool_response('completeTodo')
 
 @vapi_flask_bp.route('/delete_todo', methods=['POST'])
 def delete_todo():
-    tool_call = get_validated_tool_call('deleteTodo')
-    args = tool_call.function.arguments
-    todo_id = args.get('id')
-    if not todo_id:
-        abort(400, description='Missing To-Do ID in arguments.')
-    
-    todo = db.session.query(VapiTodo).filter(VapiTodo.id == todo_id).first()
-    if not todo:
-        abort(404, description='Todo not found.')
-    
-    # Delete from Google Calendar first
-    if todo.google_calendar_event_id:
-        try:
-            calendar_service = get_calendar_service()
-            calendar_service.delete_event(todo.google_calendar_event_id)
-        except Exception as e:
-            print(f"Failed to delete Google Calendar event: {e}")
-    
-    db.session.delete(todo)
-    db.session.commit()
-    return jsonify({'results': [{'toolCallId': tool_call.id, 'result': 'success'}]})
+    return _single_tool_response('deleteTodo')
 
 @vapi_flask_bp.route('/add_reminder', methods=['POST'])
 def add_reminder():
-    tool_call = get_validated_tool_call('addReminder')
-    args = tool_call.function.arguments
-    reminder_text = args.get('reminder_text', '')
-    importance = args.get('importance', '')
-    
-    # Create reminder in database
-    reminder = VapiReminder(reminder_text=reminder_text, importance=importance)
-    db.session.add(reminder)
-    db.session.commit()
-    db.session.refresh(reminder)
-    
-    # Sync with Google Calendar
-    try:
-        calendar_service = get_calendar_service()
-        google_event_id = calendar_service.create_event(
-            title=f"REMINDER: {reminder_text}",
-            description=f"Importance: {importance}\nReminder from VAPI Todo System"
-        )
-        if google_event_id:
-            reminder.google_calendar_event_id = google_event_id
-            db.session.commit()
-    except Exception as e:
-        print(f"Failed to sync reminder with Google Calendar: {e}")
-    
-    return jsonify({'results': [{'toolCallId': tool_call.id, 'result': 'success'}]})
+    return _single_tool_response('addReminder')
 
 @vapi_flask_bp.route('/get_reminders', methods=['POST'])
 def get_reminders():
-    tool_call = get_validated_tool_call('getReminders')
-    reminders_db = db.session.query(VapiReminder).all()
-    reminders_response = [ReminderResponse.model_validate(reminder).model_dump() for reminder in reminders_db]
-    return jsonify({'results': [{'toolCallId': tool_call.id, 'result': reminders_response}]})
+    return _single_tool_response('getReminders')
 
 @vapi_flask_bp.route('/delete_reminder', methods=['POST'])
 def delete_reminder():
-    tool_call = get_validated_tool_call('deleteReminder')
-    args = tool_call.function.arguments
-    reminder_id = args.get('id')
-    if not reminder_id:
-        abort(400, description='Missing Reminder ID in arguments.')
-    
-    reminder = db.session.query(VapiReminder).filter(VapiReminder.id == reminder_id).first()
-    if not reminder:
-        abort(404, description='Reminder not found.')
-    
-    # Delete from Google Calendar first
-    if reminder.google_calendar_event_id:
-        try:
-            calendar_service = get_calendar_service()
-            calendar_service.delete_event(reminder.google_calendar_event_id)
-        except Exception as e:
-            print(f"Failed to delete Google Calendar event: {e}")
-    
-    db.session.delete(reminder)
-    db.session.commit()
-    return jsonify({'results': [{'toolCallId': tool_call.id, 'result': 'success'}]})
+    return _single_tool_response('deleteReminder')
 
 @vapi_flask_bp.route('/add_calendar_entry', methods=['POST'])
 def add_calendar_entry():
-    tool_call = get_validated_tool_call('addCalendarEntry')
-    args = tool_call.function.arguments
-    title = args.get('title', '')
-    description = args.get('description', '')
-    event_from = args.get('event_from')
-    event_to = args.get('event_to')
-    
-    # Parse datetime strings
-    start_time = None
-    end_time = None
-    if event_from:
-        try:
-            start_time = datetime.fromisoformat(event_from.replace('Z', '+00:00'))
-        except:
-            start_time = datetime.utcnow()
-    if event_to:
-        try:
-            end_time = datetime.fromisoformat(event_to.replace('Z', '+00:00'))
-        except:
-            end_time = start_time + timedelta(hours=1) if start_time else datetime.utcnow() + timedelta(hours=1)
-    
-    # Create calendar event in database
-    event = VapiCalendarEvent(title=title, description=description, event_from=start_time, event_to=end_time)
-    db.session.add(event)
-    db.session.commit()
-    db.session.refresh(event)
-    
-    # Sync with Google Calendar
-    try:
-        calendar_service = get_calendar_service()
-        google_event_id = calendar_service.create_event(
-            title=title,
-            description=description or "Event from VAPI Todo System",
-            start_time=start_time,
-            end_time=end_time
-        )
-        if google_event_id:
-            event.google_calendar_event_id = google_event_id
-            db.session.commit()
-    except Exception as e:
-        print(f"Failed to sync calendar event with Google Calendar: {e}")
-    
-    return jsonify({'results': [{'toolCallId': tool_call.id, 'result': 'success'}]})
+    return _single_tool_response('addCalendarEntry')
 
 @vapi_flask_bp.route('/get_calendar_entries', methods=['POST'])
 def get_calendar_entries():
-    tool_call = get_validated_tool_call('getCalendarEntries')
-    events_db = db.session.query(VapiCalendarEvent).all()
-    events_response = [CalendarEventResponse.model_validate(event).model_dump() for event in events_db]
-    return jsonify({'results': [{'toolCallId': tool_call.id, 'result': events_response}]})
+    return _single_tool_response('getCalendarEntries')
 
 @vapi_flask_bp.route('/delete_calendar_entry', methods=['POST'])
 def delete_calendar_entry():
-    tool_call = get_validated_tool_call('deleteCalendarEntry')
-    args = tool_call.function.arguments
-    event_id = args.get('id')
-    if not event_id:
-        abort(400, description='Missing Calendar Event ID in arguments.')
-    
-    event = db.session.query(VapiCalendarEvent).filter(VapiCalendarEvent.id == event_id).first()
-    if not event:
-        abort(404, description='Calendar event not found.')
-    
-    # Delete from Google Calendar first
-    if event.google_calendar_event_id:
-        try:
-            calendar_service = get_calendar_service()
-            calendar_service.delete_event(event.google_calendar_event_id)
-        except Exception as e:
-            print(f"Failed to delete Google Calendar event: {e}")
-    
-    db.session.delete(event)
-    db.session.commit()
-    return jsonify({'results': [{'toolCallId': tool_call.id, 'result': 'success'}]})
+    return _single_tool_response('deleteCalendarEntry')
+
+@vapi_flask_bp.route('/create_todos', methods=['POST'])
+def create_todos():
+    return _single_tool_response('createTodos')
+
+@vapi_flask_bp.route('/complete_todos', methods=['POST'])
+def complete_todos():
+    return _single_tool_response('completeTodos')
+
+@vapi_flask_bp.route('/delete_reminders', methods=['POST'])
+def delete_reminders():
+    return _single_tool_response('deleteReminders')
+
+@vapi_flask_bp.route('/add_calendar_entries', methods=['POST'])
+def add_calendar_entries():
+    return _single_tool_response('addCalendarEntries')
+
+@vapi_flask_bp.route('/check_conflicts', methods=['POST'])
+def check_conflicts():
+    return _single_tool_response('checkConflicts')
+
+@vapi_flask_bp.route('/find_free_slots', methods=['POST'])
+def find_free_slots():
+    return _single_tool_response('findFreeSlots')
 
 @vapi_flask_bp.route('/readme')
 def view_vapi_readme():
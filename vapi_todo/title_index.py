@@ -0,0 +1,197 @@
+# title_index.py
+"""
+In-memory fuzzy index over the spoken names of todos, reminders and events.
+
+Lets the id-based tools take a title instead ("the grocery one"), so the
+assistant does not have to list everything first. Each entity type has a
+trigram index (pg_trgm style, per word) over its title column. A lookup only
+touches the postings of the query's trigrams, which keeps resolution well
+under a millisecond for personal-sized tables.
+
+The index follows the read cache generations (shared.cache): write handlers
+apply their changes incrementally as they bump the generation, and if the
+generation moved in a way the index did not see (another process, the
+Calendar pull) the index is rebuilt from the database on the next lookup.
+Seeing other processes' writes needs the shared backend (VAPI_CACHE_URL):
+with the in-process one each worker has its own generations. A title that
+matches nothing is therefore also looked up in the database (LIKE on its
+words), which finds rows the index has not caught up with yet.
+"""
+import re
+import math
+import threading
+from collections import defaultdict
+from typing import Optional, Dict, Any, List, Tuple, Iterable, Sequence
+
+from sqlalchemy import and_, select
+from extensions import db
+from shared.cache import get_read_cache
+from .models import VapiTodo, VapiReminder, VapiCalendarEvent
+
+# Cache entity name -> (model, indexed column name)
+TITLE_COLUMNS = {
+    'todos': (VapiTodo, 'title'),
+    'reminders': (VapiReminder, 'reminder_text'),
+    'calendar_events': (VapiCalendarEvent, 'title'),
+}
+
+MIN_SCORE = 0.5         # Below this a title does not match at all
+AMBIGUITY_MARGIN = 0.1  # Candidates this close to the best one make the match ambiguous
+MAX_CANDIDATES = 5
+
+# Words people wrap around a name when speaking ("the one about groceries").
+FILLER_WORDS = frozenset({
+    'a', 'an', 'the', 'my', 'one', 'ones', 'that', 'this', 'about', 'called', 'named',
+    'item', 'todo', 'to-do', 'task', 'reminder', 'event', 'entry', 'please',
+})
+
+_WORD = re.compile(r'[a-z0-9]+')
+
+def _words(text: str) -> List[str]:
+    return _WORD.findall(text.lower())
+
+def _query_words(query: str) -> List[str]:
+    return [word for word in _words(query) if word not in FILLER_WORDS] or _words(query)
+
+def _trigrams(words: Iterable[str]) -> frozenset:
+    grams = set()
+    for word in words:
+        padded = f'  {word} '
+        grams.update(padded[i:i + 3] for i in range(len(padded) - 2))
+    return frozenset(grams)
+
+class TitleIndex:
+    """Trigram index over one entity type's titles."""
+
+    def __init__(self, entity: str):
+        self.entity = entity
+        self.generation: Optional[int] = None  # None: must be rebuilt before use
+        self.titles: Dict[int, str] = {}
+        self._grams: Dict[int, frozenset] = {}
+        self._postings: Dict[str, set] = defaultdict(set)
+        self._lock = threading.Lock()
+
+    def _add(self, entity_id: int, title: str):
+        self._remove(entity_id)
+        grams = _trigrams(_words(title or ''))
+        self.titles[entity_id] = title or ''
+        self._grams[entity_id] = grams
+        for gram in grams:
+            self._postings[gram].add(entity_id)
+
+    def _remove(self, entity_id: int):
+        for gram in self._grams.pop(entity_id, ()):
+            ids = self._postings[gram]
+            ids.discard(entity_id)
+            if not ids:
+                del self._postings[gram]
+        self.titles.pop(entity_id, None)
+
+    def _rebuild(self):
+        model, column = TITLE_COLUMNS[self.entity]
+        # Read the generation before the rows, like the read cache does.
+        generation = get_read_cache().generation(self.entity)
+        rows = db.session.execute(select(model.id, getattr(model, column))).all()
+        self.titles, self._grams, self._postings = {}, {}, defaultdict(set)
+        for entity_id, title in rows:
+            self._add(entity_id, title)
+        self.generation = generation
+
+    def apply(self, generation: int, added: Iterable[Tuple[int, str]] = (), removed: Iterable[int] = ()):
+        """
+        Apply a committed write that moved the entity to `generation`.
+
+        If the index was not at the generation just before it, some other
+        write was missed and the index is marked for a rebuild instead.
+        """
+        with self._lock:
+            if self.generation is None or self.generation != generation - 1:
+                self.generation = None
+                return
+            for entity_id in removed:
+                self._remove(entity_id)
+            for entity_id, title in added:
+                self._add(entity_id, title)
+            self.generation = generation
+
+    def search(self, query: str, limit: Optional[int] = MAX_CANDIDATES) -> List[Dict[str, Any]]:
+        """Best matching titles, each with a score between 0 and 1; all of them when `limit` is None."""
+        words = _query_words(query)
+        query_grams = _trigrams(words)
+        if not query_grams:
+            return []
+        with self._lock:
+            if self.generation is None or self.generation != get_read_cache().generation(self.entity):
+                self._rebuild()
+            # A score of MIN_SCORE needs at least `needed` shared trigrams, so
+            # every match contains one of the rarest len - needed + 1 query
+            # trigrams (prefix filtering); common trigrams never need scanning.
+            needed = max(1, math.ceil(MIN_SCORE * len(query_grams)))
+            by_rarity = sorted(query_grams, key=lambda gram: len(self._postings.get(gram, ())))
+            candidates = set()
+            for gram in by_rarity[:len(query_grams) - needed + 1]:
+                candidates.update(self._postings.get(gram, ()))
+            scored = []
+            for entity_id in candidates:
+                count = len(self._grams[entity_id] & query_grams)
+                # Mostly how much of the query the title covers, with a nudge
+                # towards titles that contain little else.
+                coverage = count / len(query_grams)
+                jaccard = count / (len(query_grams) + len(self._grams[entity_id]) - count)
+                scored.append((0.7 * coverage + 0.3 * jaccard, entity_id))
+            scored.sort(reverse=True)
+            return [{'id': entity_id, 'title': self.titles[entity_id], 'score': round(score, 3)}
+                    for score, entity_id in scored[:limit]]
+
+    def _eligible(self, candidates: List[Dict[str, Any]], filters: Sequence) -> List[Dict[str, Any]]:
+        """The candidates whose rows also match `filters` (e.g. todos not completed yet)."""
+        if not filters or not candidates:
+            return candidates
+        model, _ = TITLE_COLUMNS[self.entity]
+        kept = set(db.session.execute(select(model.id).where(
+            model.id.in_([match['id'] for match in candidates]), *filters)).scalars())
+        return [match for match in candidates if match['id'] in kept]
+
+    def _lookup_database(self, query: str, filters: Sequence) -> List[Dict[str, Any]]:
+        """Rows whose title contains every word of the query, for titles the index has not seen."""
+        words = _query_words(query)
+        if not words:
+            return []
+        model, column = TITLE_COLUMNS[self.entity]
+        title = getattr(model, column)
+        rows = db.session.execute(select(model.id, title).where(
+            and_(*[title.ilike(f'%{word}%') for word in words]), *filters)
+            .order_by(model.id).limit(MAX_CANDIDATES)).all()
+        if rows:
+            with self._lock:
+                self.generation = None  # Behind: rebuild on the next lookup
+        return [{'id': entity_id, 'title': text or '', 'score': None} for entity_id, text in rows]
+
+    def resolve(self, query: str, filters: Sequence = ()) -> Tuple[Optional[int], List[Dict[str, Any]]]:
+        """
+        Resolve a spoken name to one ID.
+
+        Args:
+            query: What the caller said
+            filters: SQLAlchemy criteria the row must also meet
+
+        Returns:
+            (id, [match]) for a clear match, (None, candidates) when several
+            titles match about equally well, and (None, []) when none does
+        """
+        candidates = [match for match in self.search(query, limit=None) if match['score'] >= MIN_SCORE]
+        candidates = self._eligible(candidates, filters)[:MAX_CANDIDATES]
+        if not candidates:
+            candidates = self._lookup_database(query, filters)
+            if len(candidates) == 1:
+                return candidates[0]['id'], candidates
+            return None, candidates
+        close = [match for match in candidates if match['score'] >= candidates[0]['score'] - AMBIGUITY_MARGIN]
+        if len(close) == 1:
+            return close[0]['id'], close
+        return None, close
+
+_indexes = {entity: TitleIndex(entity) for entity in TITLE_COLUMNS}
+
+def get_title_index(entity: str) -> TitleIndex:
+    return _indexes[entity]
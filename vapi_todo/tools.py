@@ -0,0 +1,480 @@
+# tools.py
+"""
+Tool handlers for the VAPI Todo assistant and the registry that maps VAPI
+function names to them.
+
+Each handler takes the decoded tool-call arguments and returns the value for
+the `result` field of the VAPI response. Handlers signal bad input with
+`abort()`, exactly like the per-tool routes always have, so they can be served
+both by their own route and by the `/tools` dispatch endpoint.
+"""
+import os
+from contextvars import ContextVar
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
+
+from flask import abort
+from werkzeug.exceptions import HTTPException
+from extensions import db
+from .models import VapiTodo, VapiReminder, VapiCalendarEvent
+from .calendar_sync import (
+    enqueue_calendar_sync, enqueue_calendar_syncs, notify_calendar_sync, calendar_user, current_calendar_user,
+    todo_event_fields, reminder_event_fields, calendar_event_fields,
+)
+from .queries import parse_page_args, parse_bool, parse_datetime, parse_entry_times, fetch_page
+from .availability import (
+    MAX_WINDOW, overlap_filters, find_conflicts, local_busy, google_busy,
+    merge_intervals, free_slots, format_intervals,
+)
+from . import repository
+from .title_index import get_title_index
+from .idempotency import ToolCallInProgress, get_tool_call_results
+from .replicas import (
+    READ_YOUR_WRITES_SECONDS, conversation, current_conversation, record_write, replica_reads, read_source,
+)
+from shared.cache import get_read_cache
+from shared.helpers import validate_arguments
+from shared.metrics import timed_tool, phase
+from shared.schemas import ToolCall, TodoResponse, ReminderResponse, CalendarEventResponse
+
+# Upper bound on the items of one bulk tool call.
+MAX_BULK_ITEMS = int(os.getenv('VAPI_MAX_BULK_ITEMS', '100'))
+
+def _bulk_items(args: Dict[str, Any], key: str, label: str) -> List[Any]:
+    items = args.get(key) or []
+    if not items:
+        abort(400, description=f'Missing {label} in arguments.')
+    if len(items) > MAX_BULK_ITEMS:
+        abort(400, description=f'At most {MAX_BULK_ITEMS} {label} per call.')
+    return items
+
+def _bulk_ids(args: Dict[str, Any], label: str) -> List[int]:
+    # Duplicates are dropped, keeping the order the caller gave.
+    return list(dict.fromkeys(_bulk_items(args, 'ids', label)))
+
+# Bookkeeping of writes whose commit the caller does (see call_tool), run once it has.
+_after_commit: ContextVar[Optional[List[Callable[[], None]]]] = ContextVar('vapi_after_commit', default=None)
+
+def _commit(entity: str, added: List[Tuple[int, str]] = (), removed: List[int] = ()):
+    """
+    Commit the handler's transaction, then do the bookkeeping shared by every
+    write handler. `added` and `removed` are the (id, title) pairs and IDs
+    the write changed in the title index. Under call_tool the write is only
+    flushed: it commits together with the tool call's stored result.
+    """
+    pending = _after_commit.get()
+    if pending is not None:
+        with phase('db'):
+            db.session.flush()
+        pending.append(lambda: _written(entity, added, removed))
+        return
+    with phase('db'):
+        db.session.commit()
+    _written(entity, added, removed)
+
+def _written(entity: str, added: List[Tuple[int, str]], removed: List[int]):
+    generation = get_read_cache().bump(entity)
+    get_title_index(entity).apply(generation, added, removed)
+    record_write()
+    notify_calendar_sync()
+
+def _cached_read(entity: str, params: Dict[str, Any], loader: Callable[[], Any]) -> Any:
+    # Replica results may lag the primary: cached apart, they never answer a
+    # read-your-writes read. A lagging result can still land under the
+    # generation of the write it misses, so it is only kept for the
+    # read-your-writes window, the lag replicas are allowed anyway.
+    source = read_source()
+    ttl = READ_YOUR_WRITES_SECONDS if source == 'replica' else None
+    return get_read_cache().get_or_load(entity, {**params, 'source': source}, loader, ttl)
+
+def _target_id(args: Dict[str, Any], entity: str, label: str, not_found: str, filters: Sequence = ()):
+    """
+    The row a single-item tool acts on: `id`, or else the row meeting
+    `filters` whose title best matches the spoken `title`.
+
+    Returns:
+        (id, None), or (None, result) with the candidates when the title is ambiguous
+    """
+    if args.get('id'):
+        return args['id'], None
+    title = (args.get('title') or '').strip()
+    if not title:
+        abort(400, description=f'Missing {label} ID in arguments.')
+    entity_id, candidates = get_title_index(entity).resolve(title, filters)
+    if entity_id is not None:
+        return entity_id, None
+    if not candidates:
+        abort(404, description=not_found)
+    return None, {'status': 'ambiguous',
+                  'candidates': [{'id': match['id'], 'title': match['title']} for match in candidates]}
+
+# --- Todos ---
+
+def create_todo(args: Dict[str, Any]):
+    title = args.get('title', '')
+    description = args.get('description', '')
+
+    # Create todo in database, queueing its Google Calendar sync in the same transaction
+    todo = repository.insert_row(VapiTodo, {'title': title, 'description': description, 'completed': False,
+                                                'calendar_user_id': current_calendar_user()})
+    enqueue_calendar_sync('todo', todo.id, 'create', todo_event_fields(todo), user_id=todo.calendar_user_id)
+    _commit('todos', added=[(todo.id, todo.title)])
+    return 'success'
+
+def get_todos(args: Dict[str, Any]):
+    try:
+        page = parse_page_args(args, TodoResponse)
+        completed = parse_bool(args.get('completed'))
+    except ValueError as e:
+        abort(400, description=str(e))
+
+    filters = [VapiTodo.completed == completed] if completed is not None else []
+    return _cached_read(
+        'todos', {'tool': 'getTodos', 'completed': completed, **page},
+        lambda: fetch_page(VapiTodo, page['fields'], filters, page['after_id'], page['limit'],
+                           page['paged']))
+
+def create_todos(args: Dict[str, Any]):
+    items = _bulk_items(args, 'todos', 'todos')
+
+    # One multi-row INSERT for the todos and one for their outbox jobs
+    user_id = current_calendar_user()
+    rows = repository.insert_rows(VapiTodo, [
+        {'title': item.get('title', ''), 'description': item.get('description', ''), 'completed': False,
+         'calendar_user_id': user_id}
+        for item in items])
+    enqueue_calendar_syncs('todo', 'create', [
+        {'entity_id': row.id, 'fields': todo_event_fields(row), 'user_id': row.calendar_user_id}
+        for row in rows])
+    _commit('todos', added=[(row.id, row.title) for row in rows])
+    return [{'id': row.id, 'title': row.title, 'status': 'created'} for row in rows]
+
+def complete_todo(args: Dict[str, Any]):
+    # Only open todos can be meant by "complete the grocery one".
+    todo_id, ambiguous = _target_id(args, 'todos', 'To-Do', 'Todo not found.', [VapiTodo.completed.is_(False)])
+    if ambiguous:
+        return ambiguous
+
+    todo = repository.update_row(VapiTodo, todo_id, {'completed': True})
+    if not todo:
+        abort(404, description='Todo not found.')
+
+    enqueue_calendar_sync('todo', todo.id, 'update', todo_event_fields(todo),
+                          todo.google_calendar_event_id, todo.calendar_user_id)
+    _commit('todos')
+    return 'success'
+
+def complete_todos(args: Dict[str, Any]):
+    todo_ids = _bulk_ids(args, 'To-Do IDs')
+
+    rows = repository.update_rows(VapiTodo, todo_ids, {'completed': True})
+    enqueue_calendar_syncs('todo', 'update', [
+        {'entity_id': row.id, 'fields': todo_event_fields(row),
+         'google_calendar_event_id': row.google_calendar_event_id, 'user_id': row.calendar_user_id}
+        for row in rows])
+    _commit('todos')
+    completed = {row.id for row in rows}
+    return [{'id': todo_id, 'status': 'completed' if todo_id in completed else 'not_found'}
+            for todo_id in todo_ids]
+
+def delete_todo(args: Dict[str, Any]):
+    todo_id, ambiguous = _target_id(args, 'todos', 'To-Do', 'Todo not found.')
+    if ambiguous:
+        return ambiguous
+
+    todo = repository.delete_row(VapiTodo, todo_id)
+    if not todo:
+        abort(404, description='Todo not found.')
+
+    enqueue_calendar_sync('todo', todo.id, 'delete',
+                          google_calendar_event_id=todo.google_calendar_event_id,
+                          user_id=todo.calendar_user_id)
+    _commit('todos', removed=[todo.id])
+    return 'success'
+
+# --- Reminders ---
+
+def add_reminder(args: Dict[str, Any]):
+    reminder_text = args.get('reminder_text', '')
+    importance = args.get('importance', '')
+
+    # Create reminder in database, queueing its Google Calendar sync in the same transaction
+    reminder = repository.insert_row(VapiReminder, {
+        'reminder_text': reminder_text, 'importance': importance, 'calendar_user_id': current_calendar_user()})
+    enqueue_calendar_sync('reminder', reminder.id, 'create', reminder_event_fields(reminder),
+                          user_id=reminder.calendar_user_id)
+    _commit('reminders', added=[(reminder.id, reminder.reminder_text)])
+    return 'success'
+
+def get_reminders(args: Dict[str, Any]):
+    try:
+        page = parse_page_args(args, ReminderResponse)
+    except ValueError as e:
+        abort(400, description=str(e))
+
+    importance = args.get('importance')
+    filters = [VapiReminder.importance == importance] if importance else []
+    return _cached_read(
+        'reminders', {'tool': 'getReminders', 'importance': importance, **page},
+        lambda: fetch_page(VapiReminder, page['fields'], filters, page['after_id'], page['limit'],
+                           page['paged']))
+
+def delete_reminder(args: Dict[str, Any]):
+    reminder_id, ambiguous = _target_id(args, 'reminders', 'Reminder', 'Reminder not found.')
+    if ambiguous:
+        return ambiguous
+
+    reminder = repository.delete_row(VapiReminder, reminder_id)
+    if not reminder:
+        abort(404, description='Reminder not found.')
+
+    enqueue_calendar_sync('reminder', reminder.id, 'delete',
+                          google_calendar_event_id=reminder.google_calendar_event_id,
+                          user_id=reminder.calendar_user_id)
+    _commit('reminders', removed=[reminder.id])
+    return 'success'
+
+def delete_reminders(args: Dict[str, Any]):
+    reminder_ids = _bulk_ids(args, 'Reminder IDs')
+
+    rows = repository.delete_rows(VapiReminder, reminder_ids)
+    enqueue_calendar_syncs('reminder', 'delete', [
+        {'entity_id': row.id, 'google_calendar_event_id': row.google_calendar_event_id,
+         'user_id': row.calendar_user_id} for row in rows])
+    _commit('reminders', removed=[row.id for row in rows])
+    deleted = {row.id for row in rows}
+    return [{'id': reminder_id, 'status': 'deleted' if reminder_id in deleted else 'not_found'}
+            for reminder_id in reminder_ids]
+
+# --- Calendar entries ---
+
+def add_calendar_entry(args: Dict[str, Any]):
+    title = args.get('title', '')
+    description = args.get('description', '')
+    try:
+        start_time, end_time = parse_entry_times(args.get('event_from'), args.get('event_to'),
+                                                 args.get('duration'), args.get('timezone'))
+    except ValueError as e:
+        abort(400, description=str(e))
+
+    if args.get('check_conflicts') and start_time:
+        conflicts = find_conflicts(start_time, end_time or start_time + timedelta(hours=1))
+        if conflicts:
+            return {'status': 'conflict', 'conflicts': conflicts}
+
+    # Create calendar event in database, queueing its Google Calendar sync in the same transaction
+    event = repository.insert_row(VapiCalendarEvent, {
+        'title': title, 'description': description, 'event_from': start_time, 'event_to': end_time,
+        'calendar_user_id': current_calendar_user()})
+    enqueue_calendar_sync('calendar_event', event.id, 'create', calendar_event_fields(event),
+                          user_id=event.calendar_user_id)
+    _commit('calendar_events', added=[(event.id, event.title)])
+    return 'success'
+
+def add_calendar_entries(args: Dict[str, Any]):
+    items = _bulk_items(args, 'entries', 'calendar entries')
+
+    user_id = current_calendar_user()
+    values = []
+    for item in items:
+        try:
+            start_time, end_time = parse_entry_times(item.get('event_from'), item.get('event_to'),
+                                                     item.get('duration'), item.get('timezone'))
+        except ValueError as e:
+            abort(400, description=f"Entry '{item.get('title', '')}': {e}")
+        values.append({'title': item.get('title', ''), 'description': item.get('description', ''),
+                       'event_from': start_time, 'event_to': end_time, 'calendar_user_id': user_id})
+    rows = repository.insert_rows(VapiCalendarEvent, values)
+    enqueue_calendar_syncs('calendar_event', 'create', [
+        {'entity_id': row.id, 'fields': calendar_event_fields(row), 'user_id': row.calendar_user_id}
+        for row in rows])
+    _commit('calendar_events', added=[(row.id, row.title) for row in rows])
+    return [{'id': row.id, 'title': row.title, 'status': 'created'} for row in rows]
+
+def get_calendar_entries(args: Dict[str, Any]):
+    try:
+        page = parse_page_args(args, CalendarEventResponse)
+        window_from = parse_datetime(args.get('from'))
+        window_to = parse_datetime(args.get('to'))
+    except ValueError as e:
+        abort(400, description=str(e))
+
+    # Events overlapping the [from, to) window
+    filters = []
+    if window_from or window_to:
+        filters = overlap_filters(window_from, window_to, db.session.get_bind().dialect.name)
+    return _cached_read(
+        'calendar_events', {'tool': 'getCalendarEntries', 'from': window_from, 'to': window_to, **page},
+        lambda: fetch_page(VapiCalendarEvent, page['fields'], filters, page['after_id'], page['limit'],
+                           page['paged']))
+
+def check_conflicts(args: Dict[str, Any]):
+    try:
+        start = parse_datetime(args.get('event_from'))
+        end = parse_datetime(args.get('event_to'))
+    except ValueError as e:
+        abort(400, description=str(e))
+    if not start:
+        abort(400, description='Missing event_from in arguments.')
+    end = end or start + timedelta(hours=1)
+    if end <= start:
+        abort(400, description='event_to must be after event_from.')
+
+    conflicts = _cached_read(
+        'calendar_events', {'tool': 'checkConflicts', 'from': start, 'to': end},
+        lambda: find_conflicts(start, end))
+    result = {'available': not conflicts, 'conflicts': conflicts}
+    if args.get('include_google'):
+        busy = google_busy(start, end)
+        if busy is None:
+            result['google'] = 'unavailable'
+        else:
+            result['google_busy'] = format_intervals(merge_intervals(busy))
+            result['available'] = result['available'] and not busy
+    return result
+
+def find_free_slots(args: Dict[str, Any]):
+    try:
+        window_from = parse_datetime(args.get('from')) or datetime.utcnow()
+        window_to = parse_datetime(args.get('to')) or window_from + timedelta(days=1)
+    except ValueError as e:
+        abort(400, description=str(e))
+    duration = timedelta(minutes=args.get('duration_minutes') or 30)
+    limit = max(1, min(args.get('limit') or 10, 50))
+    if window_to <= window_from:
+        abort(400, description="'to' must be after 'from'.")
+    if window_to - window_from > MAX_WINDOW:
+        abort(400, description=f'The window can span at most {MAX_WINDOW.days} days.')
+    if duration <= timedelta(0):
+        abort(400, description='duration_minutes must be positive.')
+
+    busy = list(_cached_read(
+        'calendar_events', {'tool': 'findFreeSlots', 'from': window_from, 'to': window_to},
+        lambda: local_busy(window_from, window_to)))
+    result = {}
+    if args.get('include_google'):
+        remote = google_busy(window_from, window_to)
+        if remote is None:
+            result['google'] = 'unavailable'
+        else:
+            busy.extend(remote)
+    result['slots'] = format_intervals(free_slots(window_from, window_to, busy, duration, limit))
+    return result
+
+def delete_calendar_entry(args: Dict[str, Any]):
+    event_id, ambiguous = _target_id(args, 'calendar_events', 'Calendar Event', 'Calendar event not found.')
+    if ambiguous:
+        return ambiguous
+
+    event = repository.delete_row(VapiCalendarEvent, event_id)
+    if not event:
+        abort(404, description='Calendar event not found.')
+
+    enqueue_calendar_sync('calendar_event', event.id, 'delete',
+                          google_calendar_event_id=event.google_calendar_event_id,
+                          user_id=event.calendar_user_id)
+    _commit('calendar_events', removed=[event.id])
+    return 'success'
+
+# --- Registry and dispatch ---
+
+# VAPI function name -> handler. Names must match the tools created in the VAPI dashboard.
+TOOL_HANDLERS: Dict[str, Callable[[Dict[str, Any]], Any]] = {
+    'createTodo': create_todo,
+    'getTodos': get_todos,
+    'completeTodo': complete_todo,
+    'deleteTodo': delete_todo,
+    'addReminder': add_reminder,
+    'getReminders': get_reminders,
+    'deleteReminder': delete_reminder,
+    'addCalendarEntry': add_calendar_entry,
+    'getCalendarEntries': get_calendar_entries,
+    'deleteCalendarEntry': delete_calendar_entry,
+    'createTodos': create_todos,
+    'completeTodos': complete_todos,
+    'deleteReminders': delete_reminders,
+    'addCalendarEntries': add_calendar_entries,
+    'checkConflicts': check_conflicts,
+    'findFreeSlots': find_free_slots,
+}
+
+# Tools that only read. The others run at most once per toolCallId (see idempotency.py).
+READ_ONLY_TOOLS = frozenset({'getTodos', 'getReminders', 'getCalendarEntries', 'checkConflicts', 'findFreeSlots'})
+
+def call_tool(tool_call: ToolCall, args: Dict[str, Any]) -> Any:
+    """
+    Run a tool call's handler; a retried write returns the first attempt's
+    result. A retry that finds the first attempt still running is refused with 409.
+    """
+    name = tool_call.function.name
+    handler = TOOL_HANDLERS[name]
+    if name in READ_ONLY_TOOLS:
+        with replica_reads():
+            return handler(args)
+    pending = []
+    token = _after_commit.set(pending)
+    try:
+        result = get_tool_call_results().run(tool_call.id, name, lambda: handler(args))
+    except ToolCallInProgress as e:
+        abort(409, description=str(e))
+    finally:
+        _after_commit.reset(token)
+    for written in pending:
+        written()
+    return result
+
+_executor = ThreadPoolExecutor(
+    max_workers=int(os.getenv('VAPI_TOOL_DISPATCH_WORKERS', '8')),
+    thread_name_prefix='vapi-tool',
+)
+
+def run_tool_call(tool_call: ToolCall) -> Dict[str, Any]:
+    """
+    Execute one tool call and wrap its outcome in a VAPI result entry.
+
+    Failures are reported in the entry's `error` field instead of being
+    raised, so one bad call cannot fail the others in the same message.
+    Its phases are recorded under its own tool name.
+    """
+    if tool_call.function.name not in TOOL_HANDLERS:
+        return {'toolCallId': tool_call.id, 'error': f"Unknown tool '{tool_call.function.name}'."}
+    with timed_tool(tool_call.function.name):
+        return _run_handler(tool_call)
+
+def _run_handler(tool_call: ToolCall) -> Dict[str, Any]:
+    try:
+        with phase('parse'):
+            args = validate_arguments(tool_call)
+    except ValueError as e:
+        return {'toolCallId': tool_call.id, 'error': str(e)}
+    try:
+        return {'toolCallId': tool_call.id, 'result': call_tool(tool_call, args)}
+    except HTTPException as e:
+        db.session.rollback()
+        return {'toolCallId': tool_call.id, 'error': e.description}
+    except Exception as e:
+        db.session.rollback()
+        print(f"Tool call {tool_call.id} ({tool_call.function.name}) failed: {e}")
+        return {'toolCallId': tool_call.id, 'error': 'Internal error while running the tool.'}
+
+def _run_in_app_context(app, tool_call: ToolCall, user_id: Optional[str],
+                        conversation_id: Optional[str]) -> Dict[str, Any]:
+    # Each call gets its own app context, and with it its own database session.
+    # Pool threads do not inherit the caller's context variables.
+    with app.app_context(), calendar_user(user_id), conversation(conversation_id):
+        return run_tool_call(tool_call)
+
+def run_tool_calls(app, tool_calls: List[ToolCall]) -> List[Dict[str, Any]]:
+    """
+    Execute every tool call of a message concurrently.
+
+    Returns:
+        One result entry per tool call, in the order the calls were given
+    """
+    if len(tool_calls) == 1:
+        return [run_tool_call(tool_calls[0])]
+    user_id, conversation_id = current_calendar_user(), current_conversation()
+    futures = [_executor.submit(_run_in_app_context, app, tool_call, user_id, conversation_id)
+               for tool_call in tool_calls]
+    return [future.result() for future in futures]
@@ -0,0 +1,65 @@
+# user_calendars.py
+"""
+Per-user Google Calendars.
+
+A caller who connected their own Google account (`flask calendar-authorize`)
+gets the rows they create synced to their calendar instead of the
+deployment's. Users are identified by the phone number VAPI sends with each
+message. Their OAuth tokens live in calendar_user_credentials and are loaded
+into the bounded per-user service cache in shared.google_calendar; callers
+without a stored token keep using the deployment's calendar.
+"""
+import json
+from datetime import datetime
+from typing import Any, Optional, Tuple
+
+from google.oauth2.credentials import Credentials
+from sqlalchemy import select, update, insert
+from extensions import db
+from shared.google_calendar import (
+    SCOPES, get_calendar_service, get_user_calendar_services, oauth_flow, set_user_credentials_store,
+)
+from .models import VapiUserCalendarCredential
+
+_credentials = VapiUserCalendarCredential.__table__
+
+def load_user_credentials(user_id: str) -> Optional[Tuple[Credentials, Optional[str]]]:
+    """The user's stored credentials and calendar ID, or None if they never connected a calendar."""
+    # Its own connection: this runs from the service cache, outside the handler's transaction.
+    with db.engine.connect() as connection:
+        row = connection.execute(
+            select(_credentials.c.token_json, _credentials.c.calendar_id)
+            .where(_credentials.c.user_id == user_id)).first()
+    if row is None:
+        return None
+    return Credentials.from_authorized_user_info(json.loads(row.token_json), SCOPES), row.calendar_id
+
+def save_user_credentials(user_id: str, creds: Any, calendar_id: Optional[str] = None):
+    """Store (or replace) a user's token; `calendar_id` is only changed when given."""
+    values = {'token_json': creds.to_json(), 'updated_at': datetime.utcnow()}
+    if calendar_id is not None:
+        values['calendar_id'] = calendar_id
+    with db.engine.begin() as connection:
+        result = connection.execute(
+            update(_credentials).where(_credentials.c.user_id == user_id).values(**values))
+        if result.rowcount == 0:
+            connection.execute(insert(_credentials).values(user_id=user_id, **values))
+
+def calendar_user_for(caller: Optional[str]) -> Optional[str]:
+    """The calendar user for a caller: the caller if they connected a calendar, else None."""
+    if caller is None or get_user_calendar_services() is None:
+        return None
+    return caller if get_calendar_service(caller) is not None else None
+
+def authorize_user(user_id: str, credentials_file: str = 'credentials.json',
+                   calendar_id: Optional[str] = None):
+    """Run the OAuth consent flow in a local browser and store the user's token."""
+    creds = oauth_flow(credentials_file).run_local_server(port=0)
+    save_user_credentials(user_id, creds, calendar_id)
+    services = get_user_calendar_services()
+    if services is not None:
+        services.invalidate(user_id)
+
+def enable_user_calendars():
+    """Serve per-user calendars from the calendar_user_credentials table."""
+    set_user_credentials_store(load_user_credentials, save_user_credentials)